@@ -0,0 +1,592 @@
+import asyncio
+import contextvars
+import functools
+import itertools
+import logging
+import time
+import uuid
+from typing import Any, AsyncGenerator, Callable, Iterable, List, Optional, Tuple
+
+import redis.asyncio
+from redis.asyncio.lock import Lock
+from redis.exceptions import LockError
+
+from .cache import REMOVE_SCRIPT, UPSERT_SCRIPT, RedisCacheBase
+from .codecs import Codec
+
+logger = logging.getLogger(__name__)
+
+# The lock of the build running in the current task, see
+# `AsyncMongoclassRedisCache._extend_build_lock()`
+_building_lock: contextvars.ContextVar = contextvars.ContextVar(
+    "_building_lock", default=None
+)
+
+
+class AsyncTimedLock(Lock):
+
+    """
+    The `redis.asyncio` counterpart of `TimedLock`
+    """
+
+    on_acquire: Optional[Callable[[bool, float], None]] = None
+
+    async def acquire(self, *args, **kwargs) -> bool:
+        started = time.monotonic()
+        acquired = await super().acquire(*args, **kwargs)
+        if self.on_acquire is not None:
+            self.on_acquire(acquired, time.monotonic() - started)
+        return acquired
+
+
+class AsyncMongoclassRedisCache(RedisCacheBase):
+
+    """
+    The `redis.asyncio` counterpart of `MongoclassRedisCache`, for use in async services. It uses the same key layout, codecs and invalidation messages, so both classes can work on the same caches.
+
+    MongoDB is still accessed through the (blocking) client of the mongoclasses, those calls run in the default executor of the event loop. Periodic re-updates, write-through with `attach()`, bounded collections, subsets, sharded collections and the local cache are only available on `MongoclassRedisCache`. Collections that were sharded with `MongoclassRedisCache` raise a ValueError, rebuild them without shards first.
+
+    Parameters
+    ----------
+    `mongoclass_instance` : MongoClassClient
+        The client the cached mongoclasses belong to.
+    `codec` : Codec
+        The codec used to encode documents when (re)building a cache. Defaults to `JSONCodec`.
+    `connection` : redis.asyncio.Redis
+        An existing connection to use instead of creating one from `*args, **kwargs`
+    `*args, **kwargs` :
+        To be passed onto `redis.asyncio.Redis()`
+
+    Attributes
+    ----------
+    `stats` : CacheStats
+        The hit rates, lock wait times, refresh durations and payload sizes of every cached collection.
+    """
+
+    def __init__(
+        self,
+        mongoclass_instance,
+        *args,
+        codec: Optional[Codec] = None,
+        connection: Optional[redis.asyncio.Redis] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(mongoclass_instance, codec)
+        self.r = connection or redis.asyncio.Redis(*args, **kwargs)
+
+        self._upsert_script = self.r.register_script(UPSERT_SCRIPT)
+        self._remove_script = self.r.register_script(REMOVE_SCRIPT)
+
+    async def close(self) -> None:
+        """
+        Close the connection of this cache.
+        """
+
+        await self.r.aclose()
+
+    async def _run(self, function: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(function, *args)
+        )
+
+    async def get_codec(self, database_name: str, collection_name: str) -> Codec:
+        """
+        Get the codec a cached collection was written with. Falls back to the codec of this cache if nothing was recorded yet.
+        """
+
+        return self._resolve_codec(
+            await self.r.get(self.get_codec_name(database_name, collection_name))
+        )
+
+    async def get_shards(self, database_name: str, collection_name: str) -> int:
+        """
+        Get how many shards a cached collection is spread over, 0 if it isn't sharded.
+        """
+
+        return int(
+            await self.r.get(self.get_shards_name(database_name, collection_name)) or 0
+        )
+
+    async def _check_layout(self, database_name: str, collection_name: str) -> None:
+        # Sharded collections have to be read and written through their shards
+        if await self.get_shards(database_name, collection_name):
+            raise ValueError(
+                f"{database_name}.{collection_name} is sharded, which only "
+                "MongoclassRedisCache supports"
+            )
+
+    async def _upgrade_legacy(self, mongoclass: object) -> bool:
+        # See `MongoclassRedisCache._upgrade_legacy()`
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+
+        pipe = self.r.pipeline(transaction=False)
+        pipe.exists(self.get_codec_name(database_name, collection_name))
+        pipe.type(self.get_list_name(database_name, collection_name))
+        pipe.exists(self.get_hash_name(database_name, collection_name))
+        if not self._is_legacy(*await pipe.execute()):
+            return False
+
+        await self.cache(mongoclass)
+        return True
+
+    def get_lock(
+        self, database_name: str, collection_name: str, *args, **kwargs
+    ) -> AsyncTimedLock:
+        lock = self.r.lock(
+            f"lock:{database_name}:{collection_name}",
+            *args,
+            lock_class=AsyncTimedLock,
+            **kwargs,
+        )
+        lock.on_acquire = functools.partial(
+            self._record_lock_wait, database_name, collection_name
+        )
+        return lock
+
+    async def insert_to_cache(self, mongoclass_object: object) -> None:
+        """
+        Insert a new mongoclass instance to the cache of that mongoclass.
+
+        Parameters
+        ----------
+        `mongoclass_object` : object
+            The mongoclass object to insert.
+        """
+
+        database_name = mongoclass_object.DATABASE_NAME
+        collection_name = mongoclass_object.COLLECTION_NAME
+
+        # Objects that were never inserted don't have an id to be stored under
+        if mongoclass_object._mongodb_id is None:
+            key = f"local:{uuid.uuid4().hex}"
+        else:
+            key = self.get_id_key(mongoclass_object._mongodb_id)
+
+        await self._check_layout(database_name, collection_name)
+        if not await self.r.exists(self.get_codec_name(database_name, collection_name)):
+            await self._upgrade_legacy(type(mongoclass_object))
+        codec = await self.get_codec(database_name, collection_name)
+        pipe = self.r.pipeline()
+        pipe.set(self.get_codec_name(database_name, collection_name), codec.name)
+        await self._upsert_documents(
+            database_name,
+            collection_name,
+            [(key, self.to_document(mongoclass_object))],
+            codec,
+            client=pipe,
+        )
+        await pipe.execute()
+
+    async def delete_from_cache(
+        self, mongoclass: object, filter_func: Callable[[object], bool]
+    ) -> bool:
+
+        async for key, item in self._iter_cached(mongoclass):
+            if filter_func(item):
+                break
+        else:
+            return False
+
+        return bool(
+            await self._remove_keys(
+                mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, [key]
+            )
+        )
+
+    async def get_from_cache(
+        self, mongoclass: object, filter_func: Callable[[object], bool]
+    ) -> Optional[object]:
+        """
+        Get a specific object from the cache.
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance).
+        `filter_func` : Callable[[object], bool]
+            A callable that takes an element from the cache as input and returns a boolean value to indicate if it should be returned and finding should be stopped.
+
+        Returns
+        -------
+        `Optional[object]` :
+            A mongoclass object if the object was found else None.
+        """
+
+        async for item in self.get_cached(mongoclass):
+            if filter_func(item):
+                self.stats.record(
+                    mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, "hit"
+                )
+                return item
+
+        self.stats.record(mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, "miss")
+
+    async def get_cached(
+        self, mongoclass: object, batch_size: int = 500
+    ) -> AsyncGenerator[object, None]:
+        """
+        Return all cached objects of a mongoclass collection.
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance).
+        `batch_size` : int
+            How many objects to load at once. The next batch is read concurrently while the current one is being decoded.
+
+        Yields
+        ------
+        `object` :
+            A mongoclass object.
+        """
+
+        async for _, item in self._iter_cached(mongoclass, batch_size):
+            yield item
+
+    async def _iter_cached(
+        self, mongoclass: object, batch_size: int = 500
+    ) -> AsyncGenerator[Tuple[bytes, object], None]:
+        await self._check_layout(mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME)
+        codec_name = self.get_codec_name(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME
+        )
+        codec = await self.r.get(codec_name)
+        if codec is None and await self._upgrade_legacy(mongoclass):
+            codec = await self.r.get(codec_name)
+        codec = self._resolve_codec(codec)
+        list_name = self.get_list_name(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME
+        )
+        hash_name = self.get_hash_name(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME
+        )
+
+        batch = await self._fetch_batch(list_name, hash_name, 0, batch_size)
+        start = 0
+        pending = None
+        try:
+            while batch:
+                pending = None
+                start += batch_size
+                if len(batch) == batch_size:
+                    pending = asyncio.ensure_future(
+                        self._fetch_batch(list_name, hash_name, start, batch_size)
+                    )
+
+                for key, serialized in batch:
+                    # Removed between reading the order and the documents
+                    if serialized is None:
+                        continue
+
+                    yield key, self.mongoclass_instance.map_document(
+                        codec.decode(serialized),
+                        mongoclass.COLLECTION_NAME,
+                        mongoclass.DATABASE_NAME,
+                    )
+
+                batch = await pending if pending is not None else None
+        finally:
+            # The iteration was stopped early
+            if pending is not None and not pending.done():
+                pending.cancel()
+
+    async def _fetch_batch(
+        self, list_name: str, hash_name: str, start: int, batch_size: int
+    ) -> List[Tuple[bytes, Optional[bytes]]]:
+        keys = await self.r.lrange(list_name, start, start + batch_size - 1)
+        if not keys:
+            return []
+        return list(zip(keys, await self.r.hmget(hash_name, keys)))
+
+    async def cache(
+        self,
+        mongoclass: object,
+        watermark: Optional[str] = None,
+        change_stream: bool = False,
+        chunk_size: int = 1000,
+    ) -> None:
+        """
+        Cache the contents of a mongoclass collection. See `MongoclassRedisCache.cache()`
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance).
+        `watermark` : str
+            A field that is set to an increasing value every time a document is written, used by `.refresh()`
+        `change_stream` : bool
+            Record a change stream resume token so `.refresh()` can apply the changes from the collection's change stream. Defaults to False.
+        `chunk_size` : int
+            How many documents to fetch and write to Redis at once. Defaults to 1000.
+        """
+
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        await self._check_layout(mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME)
+        await self._build_once(
+            mongoclass,
+            self._encode_options(watermark, change_stream),
+            self._build,
+            mongoclass,
+            watermark,
+            change_stream,
+            chunk_size,
+        )
+
+    async def _build_once(
+        self,
+        mongoclass: object,
+        options: Optional[str],
+        function: Callable[..., Any],
+        *args,
+    ) -> bool:
+        # See `MongoclassRedisCache._build_once()`
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+
+        lock = self.r.lock(
+            self._get_build_lock_name(database_name, collection_name, None),
+            timeout=self.BUILD_LOCK_TIMEOUT,
+        )
+        building = await lock.acquire(blocking=False)
+        acquired = building or await lock.acquire(
+            blocking_timeout=self.BUILD_WAIT_TIMEOUT
+        )
+        if not acquired:
+            logger.warning(
+                "Gave up waiting for another build of %s.%s",
+                database_name,
+                collection_name,
+            )
+
+        token = _building_lock.set(lock if acquired else None)
+        try:
+            if (building and options is not None) or await self._is_stale(
+                database_name, collection_name, options
+            ):
+                with self.stats.timed(database_name, collection_name, "build"):
+                    await function(*args)
+                return True
+            return False
+        finally:
+            _building_lock.reset(token)
+            if acquired:
+                try:
+                    await lock.release()
+                except LockError:
+                    logger.warning(
+                        "The build lock of %s.%s expired before the build finished",
+                        database_name,
+                        collection_name,
+                    )
+
+    async def _extend_build_lock(self) -> None:
+        # Called by builds after every chunk they write
+        lock = _building_lock.get()
+        if lock is None:
+            return
+
+        try:
+            await lock.extend(self.BUILD_LOCK_TIMEOUT, replace_ttl=True)
+        except LockError:
+            # Another process took over, both builds end up with a full snapshot
+            _building_lock.set(None)
+
+    async def _is_stale(
+        self, database_name: str, collection_name: str, options: Optional[str]
+    ) -> bool:
+        pipe = self.r.pipeline(transaction=False)
+        pipe.exists(self.get_codec_name(database_name, collection_name))
+        pipe.get(self.get_options_name(database_name, collection_name))
+        return self._is_stale_snapshot(*await pipe.execute(), options)
+
+    async def _build(
+        self,
+        mongoclass: object,
+        watermark: Optional[str],
+        change_stream: bool,
+        chunk_size: int,
+    ) -> None:
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        list_name = self.get_list_name(database_name, collection_name)
+        hash_name = self.get_hash_name(database_name, collection_name)
+
+        sync = await self._run(self._start_sync, mongoclass, watermark, change_stream)
+        await self._track_writes(database_name, collection_name)
+        build = uuid.uuid4().hex
+
+        count = 0
+        latest = None
+        documents = await self._run(self._find_documents, mongoclass, {}, chunk_size)
+        while True:
+            chunk, latest = await self._run(
+                self._encode_chunk, documents, chunk_size, watermark, latest
+            )
+            if not chunk:
+                break
+
+            pipe = self.r.pipeline(transaction=False)
+            self._add_build_chunk(pipe, list_name, hash_name, build, chunk, not count)
+            await pipe.execute()
+            count += len(chunk)
+            self.stats.record_payloads(
+                database_name, collection_name, map(len, chunk.values())
+            )
+            await self._extend_build_lock()
+
+        if watermark:
+            sync["value"] = self._encode_sync_value(latest)
+
+        async with self.get_lock(database_name, collection_name):
+            pipe = self.r.pipeline(transaction=True)
+            self._swap_snapshot(
+                pipe,
+                database_name,
+                collection_name,
+                None,
+                build,
+                count,
+                self.codec.name,
+                self._encode_options(watermark, change_stream),
+            )
+            self._set_sync(pipe, database_name, collection_name, sync)
+            self._untrack_writes(database_name, collection_name, pipe)
+            written = (await pipe.execute())[-2]
+            self.stats.record(database_name, collection_name, "documents", count)
+
+            await self._reload_keys(mongoclass, written)
+
+    async def refresh(self, mongoclass: object, detect_deletes: bool = False) -> None:
+        """
+        Incrementally update the cache of a mongoclass collection. See `MongoclassRedisCache.refresh()`
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance).
+        `detect_deletes` : bool
+            Scan the ids of the collection to remove deleted documents from the cache. Defaults to False.
+        """
+
+        with self.stats.timed(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, "refresh"
+        ):
+            await self._refresh(mongoclass, detect_deletes)
+
+    async def _refresh(self, mongoclass: object, detect_deletes: bool) -> None:
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        sync_name = self.get_sync_name(database_name, collection_name)
+
+        await self._check_layout(database_name, collection_name)
+        sync = await self.r.hgetall(sync_name)
+        if not sync or not await self.r.exists(
+            self.get_codec_name(database_name, collection_name)
+        ):
+            return await self._rebuild(mongoclass, {})
+
+        async with self.get_lock(database_name, collection_name):
+            await self._track_writes(database_name, collection_name)
+            changes = await self._run(self._collect_changes, mongoclass, sync)
+
+            if changes is not None:
+                upserts, deletes, sync = changes
+
+                await self._upsert_documents(
+                    database_name,
+                    collection_name,
+                    [(self.get_id_key(x["_id"]), x) for x in upserts],
+                    await self.get_codec(database_name, collection_name),
+                )
+                await self._remove_keys(
+                    database_name,
+                    collection_name,
+                    [self.get_id_key(x) for x in deletes],
+                )
+                await self.r.hset(sync_name, mapping=sync)
+
+                if detect_deletes:
+                    existing = await self._run(self._find_existing_keys, mongoclass)
+                    cached = await self.r.hkeys(
+                        self.get_hash_name(database_name, collection_name)
+                    )
+                    await self._remove_keys(
+                        database_name,
+                        collection_name,
+                        [x for x in cached if x not in existing],
+                    )
+            else:
+                # Don't try to resume from it again if the rebuild fails
+                await self.r.hdel(sync_name, "resume_token")
+
+            pipe = self.r.pipeline(transaction=True)
+            self._untrack_writes(database_name, collection_name, pipe)
+            await self._reload_keys(mongoclass, (await pipe.execute())[-2])
+
+        # The collection was dropped or renamed, or its change stream history was
+        # lost, there is nothing to resume from
+        if changes is None:
+            await self._rebuild(mongoclass, self._get_resync_defaults(sync, 0, None))
+
+    async def _rebuild(self, mongoclass: object, defaults: dict) -> None:
+        options_name = self.get_options_name(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME
+        )
+        args = self._get_rebuild_args(await self.r.get(options_name), defaults)
+
+        # Sharded collections were refused by `._check_layout()` already
+        del args["shards"]
+        await self.cache(mongoclass, **args)
+
+    async def _upsert_documents(
+        self,
+        database_name: str,
+        collection_name: str,
+        documents: Iterable[Tuple[str, dict]],
+        codec: Codec,
+        client: Optional[redis.asyncio.client.Pipeline] = None,
+    ) -> None:
+        payloads = self._encode_documents(
+            database_name, collection_name, documents, codec
+        )
+        if payloads:
+            await self._upsert_script(
+                self._get_write_keys(database_name, collection_name),
+                list(itertools.chain.from_iterable(payloads)),
+                client,
+            )
+
+    async def _remove_keys(
+        self, database_name: str, collection_name: str, keys: Iterable[str]
+    ) -> int:
+        keys = list(keys)
+        if not keys:
+            return 0
+
+        return await self._remove_script(
+            self._get_write_keys(database_name, collection_name), keys
+        )
+
+    async def _track_writes(self, database_name: str, collection_name: str) -> None:
+        pipe = self.r.pipeline(transaction=True)
+        self._track_writes_to(pipe, database_name, collection_name)
+        await pipe.execute()
+
+    async def _reload_keys(self, mongoclass: object, keys: Iterable[bytes]) -> None:
+        documents, missing = await self._run(self._load_keys, mongoclass, keys)
+        if not documents and not missing:
+            return
+
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+
+        await self._upsert_documents(
+            database_name,
+            collection_name,
+            documents.items(),
+            await self.get_codec(database_name, collection_name),
+        )
+        await self._remove_keys(database_name, collection_name, missing)
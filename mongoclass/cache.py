@@ -1,29 +1,1020 @@
-import json
+import functools
+import itertools
+import logging
+import mmap
+import os
+import re
+import struct
 import threading
 import time
-from typing import Callable, Generator, Optional
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import redis
+import redis.asyncio
+from bson import json_util
+from pymongo.errors import OperationFailure
+from redis.exceptions import LockError
 from redis.lock import Lock
 
+from .codecs import JSON_OPTIONS, Codec, JSONCodec, get_codec
+from .metrics import CacheStats
+from .negative import get_document_terms, get_query_term, may_match
+from .scheduler import RefreshScheduler
+from .singleflight import SingleFlight
 
-class MongoclassRedisCache:
+logger = logging.getLogger(__name__)
+
+Pipeline = Union[redis.client.Pipeline, redis.asyncio.client.Pipeline]
+
+# The channel the names of changed collections are published on
+INVALIDATION_CHANNEL = "mongoclass:invalidate"
+
+# The codes of the errors raised when a change stream can't be resumed because its
+# resume token fell out of the oplog: CappedPositionLost, ChangeStreamFatalError and
+# ChangeStreamHistoryLost
+HISTORY_LOST_CODES = {136, 280, 286}
+
+# Matches the list names of the shards of a sharded collection
+SHARD_PATTERN = re.compile(r"^mongoclass:\{(.*):\d+\}$")
+
+# A snapshot file is the magic, the size of its JSON header, the header and then a
+# record (the size of the key, the size of the document, the key and the document)
+# for every cached document, see `MongoclassRedisCache.snapshot_to()`
+SNAPSHOT_MAGIC = b"MCSNAP1\n"
+SNAPSHOT_HEADER = struct.Struct(">I")
+SNAPSHOT_RECORD = struct.Struct(">II")
+
+# Both scripts take the keys from `RedisCacheBase._get_write_keys()`. They keep the
+# order list and the documents hash consistent, and while a snapshot is being built,
+# remember what was written so it can be re-applied after the swap. Documents are
+# only written to a collection that has a snapshot (its codec key exists), or the
+# few written since would be read back as the whole collection.
+UPSERT_SCRIPT = f"""
+local building = redis.call('EXISTS', KEYS[3]) == 1
+local cached = #KEYS < 5 or redis.call('EXISTS', KEYS[5]) == 1
+for i = 1, #ARGV, 2 do
+    if cached and redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1]) == 1 then
+        redis.call('RPUSH', KEYS[2], ARGV[i])
+    end
+    if building then
+        redis.call('SADD', KEYS[4], ARGV[i])
+    end
+end
+redis.call('PUBLISH', '{INVALIDATION_CHANNEL}', KEYS[2])
+"""
+
+REMOVE_SCRIPT = f"""
+local building = redis.call('EXISTS', KEYS[3]) == 1
+local removed = 0
+for i = 1, #ARGV do
+    if redis.call('HDEL', KEYS[1], ARGV[i]) == 1 then
+        redis.call('LREM', KEYS[2], 1, ARGV[i])
+        removed = removed + 1
+    end
+    if building then
+        redis.call('SADD', KEYS[4], ARGV[i])
+    end
+end
+redis.call('PUBLISH', '{INVALIDATION_CHANNEL}', KEYS[2])
+return removed
+"""
+
+# The bounded scripts take the keys from `MongoclassRedisCache._get_bounded_keys()`
+# followed by the keys of the entries they read or write, and the keys of those
+# entries (see `.get_id_key()`) as their first arguments. They keep the recency
+# sorted set, the expiries, the entry sizes and the byte total in line with the
+# entries. Entries of evicted documents can't be known in advance so the set script
+# returns them to be deleted by the caller, along with the expired ones.
+BOUNDED_SET_SCRIPT = """
+local ttl = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+if ttl > 0 then
+    redis.call('SET', KEYS[5], ARGV[2], 'PX', ttl)
+    redis.call('ZADD', KEYS[4], now + ttl / 1000, ARGV[1])
+else
+    redis.call('SET', KEYS[5], ARGV[2])
+    redis.call('ZREM', KEYS[4], ARGV[1])
+end
+redis.call('ZADD', KEYS[1], now, ARGV[1])
+local old = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or 0)
+redis.call('HSET', KEYS[2], ARGV[1], #ARGV[2])
+local total = redis.call('INCRBY', KEYS[3], #ARGV[2] - old)
+
+local function forget(member)
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('ZREM', KEYS[4], member)
+    local size = tonumber(redis.call('HGET', KEYS[2], member) or 0)
+    redis.call('HDEL', KEYS[2], member)
+    return redis.call('INCRBY', KEYS[3], -size)
+end
+
+-- Expired entries don't count towards the budget
+local expired = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', now)
+for i = 1, #expired do
+    total = forget(expired[i])
+end
+
+-- Evict the least recently used entries until we are within budget
+local max_entries = tonumber(ARGV[5])
+local max_bytes = tonumber(ARGV[6])
+local evicted = {}
+while (max_entries > 0 and redis.call('ZCARD', KEYS[1]) > max_entries)
+        or (max_bytes > 0 and total > max_bytes) do
+    local victim = redis.call('ZRANGE', KEYS[1], 0, 0)[1]
+    if not victim then
+        break
+    end
+    total = forget(victim)
+    evicted[#evicted + 1] = victim
+end
+return {evicted, expired}
+"""
+
+BOUNDED_GET_SCRIPT = """
+local payload = redis.call('GET', KEYS[5])
+if payload then
+    redis.call('ZADD', KEYS[1], 'XX', ARGV[2], ARGV[1])
+    return payload
+end
+
+-- The entry expired, forget about it
+redis.call('ZREM', KEYS[4], ARGV[1])
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+    local size = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or 0)
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('INCRBY', KEYS[3], -size)
+end
+return false
+"""
+
+BOUNDED_REMOVE_SCRIPT = """
+for i = 1, #ARGV do
+    redis.call('DEL', KEYS[i + 4])
+    redis.call('ZREM', KEYS[4], ARGV[i])
+    if redis.call('ZREM', KEYS[1], ARGV[i]) == 1 then
+        local size = tonumber(redis.call('HGET', KEYS[2], ARGV[i]) or 0)
+        redis.call('HDEL', KEYS[2], ARGV[i])
+        redis.call('INCRBY', KEYS[3], -size)
+    end
+end
+"""
+
+# Both scripts take the keys from `RedisNegativeCache.get_names()`, followed by the
+# names of the sets indexing the queries by a term (see `negative.get_query_term()`).
+# Queries without a term are kept in the unindexed set instead. The add script only
+# remembers a query if the collection wasn't invalidated since it ran, and drops the
+# expired queries and the oldest ones past `max_entries` on the way. Index entries of
+# dropped queries are left to expire.
+NEGATIVE_ADD_SCRIPT = """
+if (tonumber(redis.call('GET', KEYS[3])) or 0) ~= tonumber(ARGV[1]) then
+    return 0
+end
+local function forget(key)
+    redis.call('HDEL', KEYS[2], key)
+    redis.call('SREM', KEYS[4], key)
+end
+
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+for i = 1, #expired do
+    forget(expired[i])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[6])
+redis.call('HSET', KEYS[2], ARGV[6], ARGV[7])
+local index = KEYS[5] or KEYS[4]
+redis.call('SADD', index, ARGV[6])
+local excess = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[5])
+if excess > 0 then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, excess - 1)
+    for i = 1, #oldest do
+        redis.call('ZREM', KEYS[1], oldest[i])
+        forget(oldest[i])
+    end
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+redis.call('PEXPIRE', KEYS[2], ARGV[4])
+redis.call('PEXPIRE', index, ARGV[4])
+return 1
+"""
+
+# Bumps the generation and returns the keys and filters of the queries that are
+# unindexed or indexed by one of the given sets, as a flat list.
+NEGATIVE_CANDIDATES_SCRIPT = """
+redis.call('INCR', KEYS[3])
+local result = {}
+for i = 4, #KEYS do
+    local keys = redis.call('SMEMBERS', KEYS[i])
+    for j = 1, #keys do
+        local query = redis.call('HGET', KEYS[2], keys[j])
+        if query then
+            result[#result + 1] = keys[j]
+            result[#result + 1] = query
+        end
+    end
+end
+return result
+"""
+
+
+class LocalCache:
 
     """
-    A simple cache system that allows you to cache entire mongoclass collections.
+    A size bounded, in-process cache of the mongoclass objects built from a cached collection. Used by `MongoclassRedisCache` in front of Redis when `local_cache_size` is given.
+
+    Every invalidation bumps the generation of a collection, objects loaded under an older generation are never stored so a load racing an invalidation can't bring stale objects back.
+
+    Parameters
+    ----------
+    `max_objects` : int
+        The maximum number of objects held across every collection. The least recently used collections are dropped first, a collection larger than this is never held.
+    `ttl` : float
+        How long in seconds a collection may be held before it is reloaded. Defaults to None which means until invalidated.
+    """
+
+    def __init__(self, max_objects: int, ttl: Optional[float] = None) -> None:
+        self.max_objects = max_objects
+        self.ttl = ttl
+        self.size = 0
+
+        self._entries: "OrderedDict[str, Tuple[float, list]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def generation(self, name: str) -> int:
+        return self._generations.get(name, 0)
+
+    def get(self, name: str) -> Optional[list]:
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+
+            if self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                self._pop(name)
+                return None
+
+            self._entries.move_to_end(name)
+            return entry[1]
+
+    def put(self, name: str, items: list, generation: int) -> bool:
+        if len(items) > self.max_objects:
+            return False
+
+        with self._lock:
+            if self._generations.get(name, 0) != generation:
+                return False
+
+            self._pop(name)
+            while self._entries and self.size + len(items) > self.max_objects:
+                self._pop(next(iter(self._entries)))
+
+            self._entries[name] = (time.monotonic(), items)
+            self.size += len(items)
+            return True
+
+    def invalidate(self, name: str) -> None:
+        with self._lock:
+            self._invalidate(name)
+
+    def clear(self) -> None:
+        with self._lock:
+            for name in list(self._entries):
+                self._invalidate(name)
+
+    def _invalidate(self, name: str) -> None:
+        self._generations[name] = self._generations.get(name, 0) + 1
+        self._pop(name)
+
+    def _pop(self, name: str) -> None:
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class TimedLock(Lock):
+
+    """
+    A Redis lock that reports how long acquiring it took to `on_acquire(acquired, waited)`
     """
 
-    def __init__(self, mongoclass_instance, *args, **kwargs) -> None:
-        self.r = redis.Redis(*args, **kwargs)
+    on_acquire: Optional[Callable[[bool, float], None]] = None
+
+    def acquire(self, *args, **kwargs) -> bool:
+        started = time.monotonic()
+        acquired = super().acquire(*args, **kwargs)
+        if self.on_acquire is not None:
+            self.on_acquire(acquired, time.monotonic() - started)
+        return acquired
+
+
+class RedisCacheBase:
+
+    """
+    The key layout and MongoDB side of the Redis caches, shared by `MongoclassRedisCache` and `AsyncMongoclassRedisCache`.
+    """
+
+    # How long in seconds a snapshot that is being built may live before it gets discarded.
+    BUILD_TIMEOUT = 3600
+    # How long in seconds the lock of a build outlives the last chunk its builder wrote,
+    # so a builder that died only holds up the others this long.
+    BUILD_LOCK_TIMEOUT = 60
+    # How long in seconds to wait for another process to finish building a collection
+    # before building it here as well.
+    BUILD_WAIT_TIMEOUT = 600
+
+    def __init__(self, mongoclass_instance, codec: Optional[Codec] = None) -> None:
         self.mongoclass_instance = mongoclass_instance
+        self.codec = codec or JSONCodec()
+        self.stats = CacheStats()
 
-    def get_list_name(self, database_name: str, collection_name: str) -> str:
+    def get_list_name(
+        self, database_name: str, collection_name: str, subset: Optional[str] = None
+    ) -> str:
+        if subset is not None:
+            return f"mongoclass:{database_name}:{collection_name}:subset:{subset}"
         return f"mongoclass:{database_name}:{collection_name}"
 
+    def get_hash_name(
+        self, database_name: str, collection_name: str, subset: Optional[str] = None
+    ) -> str:
+        return f"{self.get_list_name(database_name, collection_name, subset)}:documents"
+
+    def get_codec_name(
+        self, database_name: str, collection_name: str, subset: Optional[str] = None
+    ) -> str:
+        return f"{self.get_list_name(database_name, collection_name, subset)}:codec"
+
+    def get_options_name(
+        self, database_name: str, collection_name: str, subset: Optional[str] = None
+    ) -> str:
+        return f"{self.get_list_name(database_name, collection_name, subset)}:options"
+
+    def get_sync_name(self, database_name: str, collection_name: str) -> str:
+        return f"{self.get_list_name(database_name, collection_name)}:sync"
+
+    def get_shards_name(self, database_name: str, collection_name: str) -> str:
+        return f"{self.get_list_name(database_name, collection_name)}:shards"
+
+    def get_shard_list_name(
+        self, database_name: str, collection_name: str, shard: int
+    ) -> str:
+        # The braces are a Redis Cluster hash tag, they keep every key of a shard in
+        # the same slot while spreading the shards over the cluster
+        return f"mongoclass:{{{database_name}:{collection_name}:{shard}}}"
+
+    @staticmethod
+    def get_shard(key: Union[str, bytes], shards: int) -> int:
+        """
+        Get the shard a document is stored in from its key, see `.get_id_key()`
+        """
+
+        if isinstance(key, str):
+            key = key.encode()
+        return zlib.crc32(key) % shards
+
+    @staticmethod
+    def to_document(mongoclass_object: object) -> dict:
+        """
+        Convert a mongoclass object into the document that gets cached. Unlike `.as_json()`, this keeps the `_id` of the object.
+        """
+
+        document = mongoclass_object.as_json()
+        if mongoclass_object._mongodb_id is not None:
+            document = {"_id": mongoclass_object._mongodb_id, **document}
+        return document
+
+    @staticmethod
+    def get_id_key(_id: Any) -> str:
+        """
+        Get the key a document is stored under in the cache from its `_id`.
+        """
+
+        return json_util.dumps(_id, json_options=JSON_OPTIONS)
+
+    @staticmethod
+    def _is_legacy(has_codec: int, list_type: bytes, has_hash: int) -> bool:
+        # Caches written before codecs existed are a single list of JSON documents,
+        # without a codec or a document hash. Their documents have no `_id` so they
+        # can't be converted, only rebuilt from the collection.
+        return not has_codec and list_type == b"list" and not has_hash
+
+    @staticmethod
+    def _get_layout(shards: int) -> List[Optional[int]]:
+        # The shards of a collection spread over `shards` shards, or None for the
+        # collection itself
+        return list(range(shards)) or [None]
+
+    def _group_by_part(
+        self, parts: List[Optional[int]], items: Iterable[Tuple[str, Any]]
+    ) -> Dict[Optional[int], list]:
+        groups = {}
+        for key, value in items:
+            part = None if parts == [None] else self.get_shard(key, len(parts))
+            groups.setdefault(part, []).append((key, value))
+        return groups
+
+    def get_bounded_name(self, database_name: str, collection_name: str) -> str:
+        # The hash tag keeps every key of a bounded collection in the same Redis
+        # Cluster slot, so the bounded scripts can touch them together
+        return f"mongoclass:{{{database_name}:{collection_name}}}:bounded"
+
+    def get_entry_name(self, database_name: str, collection_name: str, key: str) -> str:
+        return f"{self.get_bounded_name(database_name, collection_name)}:entry:{key}"
+
+    def _get_bounded_keys(self, database_name: str, collection_name: str) -> List[str]:
+        name = self.get_bounded_name(database_name, collection_name)
+        return [
+            f"{name}:recency",
+            f"{name}:sizes",
+            f"{name}:bytes",
+            f"{name}:expiries",
+        ]
+
+    def _get_script_keys(
+        self, database_name: str, collection_name: str, shard: Optional[int] = None
+    ) -> List[str]:
+        if shard is None:
+            list_name = self.get_list_name(database_name, collection_name)
+        else:
+            list_name = self.get_shard_list_name(database_name, collection_name, shard)
+
+        return [
+            f"{list_name}:documents",
+            list_name,
+            f"{list_name}:building",
+            f"{list_name}:dirty",
+        ]
+
+    def _get_write_keys(
+        self, database_name: str, collection_name: str, shard: Optional[int] = None
+    ) -> List[str]:
+        # Shards only exist once a snapshot was built, and the codec key isn't in
+        # their slot
+        keys = self._get_script_keys(database_name, collection_name, shard)
+        if shard is None:
+            keys.append(self.get_codec_name(database_name, collection_name))
+        return keys
+
+    def _collect_changes(
+        self, mongoclass: object, sync: dict
+    ) -> Optional[Tuple[List[dict], List[Any], dict]]:
+        if b"resume_token" in sync:
+            changes = self._read_change_stream(
+                mongoclass, self._decode_sync_value(sync[b"resume_token"])
+            )
+            if changes is None:
+                return None
+
+            upserts, deletes, token = changes
+            return upserts, deletes, {"resume_token": self._encode_sync_value(token)}
+
+        field = sync[b"field"].decode()
+        latest = self._decode_sync_value(sync[b"value"])
+
+        upserts = []
+        query = {} if latest is None else {field: {"$gte": latest}}
+        for document in self._find_documents(mongoclass, query):
+            upserts.append(document)
+            latest = self._max_watermark(latest, document.get(field))
+
+        return upserts, [], {"value": self._encode_sync_value(latest)}
+
+    def _encode_chunk(
+        self,
+        documents: Iterator[dict],
+        chunk_size: int,
+        watermark: Optional[str],
+        latest: Any,
+    ) -> Tuple[Dict[str, bytes], Any]:
+        chunk = {}
+        for document in itertools.islice(documents, chunk_size):
+            chunk[self.get_id_key(document["_id"])] = self.codec.encode(document)
+
+            if watermark:
+                latest = self._max_watermark(latest, document.get(watermark))
+
+        return chunk, latest
+
+    def _record_lock_wait(
+        self, database_name: str, collection_name: str, acquired: bool, waited: float
+    ) -> None:
+        event = "lock_wait" if acquired else "lock_timeout"
+        self.stats.record(database_name, collection_name, event, waited)
+
+    def _resolve_codec(self, name: Optional[bytes]) -> Codec:
+        if name is None:
+            return self.codec
+
+        name = name.decode()
+        if name == self.codec.name:
+            return self.codec
+        return get_codec(name)
+
+    def _load_keys(
+        self, mongoclass: object, keys: Iterable[bytes]
+    ) -> Tuple[Dict[str, dict], List[str]]:
+        # Fetch the documents of cached keys, also returns the keys that no longer exist
+        ids = [
+            json_util.loads(x, json_options=JSON_OPTIONS)
+            for x in keys
+            if not x.startswith(b"local:")
+        ]
+        if not ids:
+            return {}, []
+
+        documents = {}
+        for document in self._find_documents(mongoclass, {"_id": {"$in": ids}}):
+            documents[self.get_id_key(document["_id"])] = document
+
+        return documents, [x for x in map(self.get_id_key, ids) if x not in documents]
+
+    def _find_existing_keys(self, mongoclass: object) -> Set[bytes]:
+        collection = self._get_collection(mongoclass)
+        if self.mongoclass_instance._engine_used == "pymongo":
+            documents = collection.find({}, {"_id": 1})
+        else:
+            documents = collection.find({})
+
+        return {self.get_id_key(x["_id"]).encode() for x in documents}
+
+    @staticmethod
+    def _max_watermark(latest: Any, value: Any) -> Any:
+        if value is None:
+            return latest
+        if latest is None or value > latest:
+            return value
+        return latest
+
+    @staticmethod
+    def _encode_options(
+        watermark: Optional[str],
+        change_stream: bool,
+        query: Optional[dict] = None,
+        shards: int = 0,
+    ) -> str:
+        # What a snapshot is built from, recorded next to it so a build asking for
+        # something else doesn't settle for it
+        return json_util.dumps(
+            {
+                "watermark": watermark or None,
+                "change_stream": bool(change_stream),
+                "query": query or {"filter": {}, "sort": None, "limit": 0},
+                "shards": shards,
+            },
+            json_options=JSON_OPTIONS,
+        )
+
+    @staticmethod
+    def _decode_options(payload: Optional[bytes]) -> Optional[dict]:
+        if payload is None:
+            return None
+        return json_util.loads(payload, json_options=JSON_OPTIONS)
+
+    def _get_rebuild_args(self, payload: Optional[bytes], defaults: dict) -> dict:
+        # The arguments of the full `.cache()` replacing a refresh that can't be done,
+        # from the options the snapshot was built with or `defaults` if they weren't
+        # recorded
+        options = self._decode_options(payload) or defaults
+        args = {
+            "watermark": options.get("watermark"),
+            "change_stream": options.get("change_stream", False),
+            "shards": options.get("shards", 0),
+        }
+
+        # How the snapshot was written doesn't change what it holds, so it isn't
+        # recorded with the options
+        if defaults.get("chunk_size"):
+            args["chunk_size"] = defaults["chunk_size"]
+        return args
+
+    @staticmethod
+    def _get_build_lock_name(
+        database_name: str, collection_name: str, subset: Optional[str]
+    ) -> str:
+        lock_name = f"lock:{database_name}:{collection_name}"
+        if subset is not None:
+            lock_name = f"{lock_name}:subset:{subset}"
+        return f"{lock_name}:build"
+
+    @staticmethod
+    def _is_stale_snapshot(
+        exists: int, recorded: Optional[bytes], options: Optional[str]
+    ) -> bool:
+        # Whether there is no snapshot, or one built from other options. Any snapshot
+        # will do when no options are given.
+        if not exists:
+            return True
+        return options is not None and recorded != options.encode()
+
+    def _start_sync(
+        self, mongoclass: object, watermark: Optional[str], change_stream: bool
+    ) -> dict:
+        # What `.refresh()` resumes from, the watermark value is added once the
+        # documents are loaded. The resume token is grabbed before loading so no change
+        # can slip through.
+        sync = {}
+        if change_stream:
+            sync["resume_token"] = self._encode_sync_value(
+                self._get_resume_token(mongoclass)
+            )
+        if watermark:
+            sync["field"] = watermark
+        return sync
+
+    @staticmethod
+    def _get_resync_defaults(sync: dict, shards: int, defaults: Optional[dict]) -> dict:
+        # The rebuild defaults of a change stream that can't be resumed anymore
+        field = sync.get(b"field")
+        return {
+            "watermark": field.decode() if field else None,
+            "change_stream": True,
+            "shards": shards,
+            "chunk_size": (defaults or {}).get("chunk_size"),
+        }
+
+    def _encode_documents(
+        self,
+        database_name: str,
+        collection_name: str,
+        documents: Iterable[Tuple[str, dict]],
+        codec: Codec,
+    ) -> List[Tuple[str, bytes]]:
+        payloads = [(key, codec.encode(document)) for key, document in documents]
+        if payloads:
+            self.stats.record_payloads(
+                database_name, collection_name, [len(x) for _, x in payloads]
+            )
+        return payloads
+
+    def _track_writes_to(
+        self,
+        pipe: Pipeline,
+        database_name: str,
+        collection_name: str,
+        shard: Optional[int] = None,
+    ) -> None:
+        # Writes made while a snapshot is built are remembered until the swap
+        _, _, building_name, dirty_name = self._get_script_keys(
+            database_name, collection_name, shard
+        )
+        pipe.set(building_name, 1, ex=self.BUILD_TIMEOUT)
+        pipe.delete(dirty_name)
+
+    def _untrack_writes(
+        self,
+        database_name: str,
+        collection_name: str,
+        pipe: Pipeline,
+        shard: Optional[int] = None,
+    ) -> None:
+        _, _, building_name, dirty_name = self._get_script_keys(
+            database_name, collection_name, shard
+        )
+
+        # The written keys end up second to last in the results of the pipeline
+        pipe.delete(building_name)
+        pipe.smembers(dirty_name)
+        pipe.delete(dirty_name)
+
+    def _add_build_chunk(
+        self,
+        pipe: Pipeline,
+        list_name: str,
+        hash_name: str,
+        build: str,
+        chunk: Dict[str, bytes],
+        first: bool,
+    ) -> None:
+        # Snapshots are built under temporary keys so readers keep seeing the previous
+        # one. The expiry only matters if the builder dies before the swap.
+        temp_list_name = f"{list_name}:build:{build}"
+        temp_hash_name = f"{hash_name}:build:{build}"
+
+        pipe.rpush(temp_list_name, *chunk)
+        pipe.hset(temp_hash_name, mapping=chunk)
+        if first:
+            pipe.expire(temp_list_name, self.BUILD_TIMEOUT)
+            pipe.expire(temp_hash_name, self.BUILD_TIMEOUT)
+
+    def _swap_snapshot(
+        self,
+        pipe: Pipeline,
+        database_name: str,
+        collection_name: str,
+        subset: Optional[str],
+        build: str,
+        count: int,
+        codec_name: str,
+        options: Optional[str],
+    ) -> None:
+        # Queue the swap of the snapshot built with `._add_build_chunk()`, run it in a
+        # transaction so it happens atomically
+        list_name = self.get_list_name(database_name, collection_name, subset)
+        hash_name = self.get_hash_name(database_name, collection_name, subset)
+
+        if count:
+            pipe.rename(f"{list_name}:build:{build}", list_name)
+            pipe.rename(f"{hash_name}:build:{build}", hash_name)
+            pipe.persist(list_name)
+            pipe.persist(hash_name)
+        else:
+            pipe.delete(list_name, hash_name)
+        pipe.set(
+            self.get_codec_name(database_name, collection_name, subset), codec_name
+        )
+        self._set_options(pipe, database_name, collection_name, subset, options)
+        pipe.publish(INVALIDATION_CHANNEL, list_name)
+
+    def _set_sync(
+        self, pipe: Pipeline, database_name: str, collection_name: str, sync: dict
+    ) -> None:
+        sync_name = self.get_sync_name(database_name, collection_name)
+        pipe.delete(sync_name)
+        if sync:
+            pipe.hset(sync_name, mapping=sync)
+
+    def _set_options(
+        self,
+        pipe: Pipeline,
+        database_name: str,
+        collection_name: str,
+        subset: Optional[str],
+        options: Optional[str],
+    ) -> None:
+        options_name = self.get_options_name(database_name, collection_name, subset)
+        if options is None:
+            pipe.delete(options_name)
+        else:
+            pipe.set(options_name, options)
+
+    @staticmethod
+    def _encode_sync_value(value: Any) -> bytes:
+        return JSONCodec().encode({"value": value})
+
+    @staticmethod
+    def _decode_sync_value(payload: bytes) -> Any:
+        return JSONCodec().decode(payload)["value"]
+
+    def _get_collection(self, mongoclass: object):
+        return self.mongoclass_instance.get_db(mongoclass.DATABASE_NAME)[
+            mongoclass.COLLECTION_NAME
+        ]
+
+    def _find_documents(
+        self,
+        mongoclass: object,
+        query: dict,
+        batch_size: int = 0,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        limit: int = 0,
+    ) -> Iterator[dict]:
+        # Raw documents, they are cached as they are so there's no need to build objects
+        collection = self._get_collection(mongoclass)
+        if self.mongoclass_instance._engine_used == "pymongo":
+            return iter(
+                collection.find(query, sort=sort, limit=limit, batch_size=batch_size)
+            )
+        return iter(collection.find(query, sort=sort, limit=limit or None))
+
+    def _get_resume_token(self, mongoclass: object) -> dict:
+        if self.mongoclass_instance._engine_used != "pymongo":
+            raise ValueError("Change streams are only supported by the pymongo engine")
+
+        with self._get_collection(mongoclass).watch() as stream:
+            stream.try_next()
+            return stream.resume_token
+
+    def _read_change_stream(
+        self, mongoclass: object, resume_token: dict
+    ) -> Optional[Tuple[List[dict], List[Any], dict]]:
+        upserts = {}
+        deletes = {}
+
+        try:
+            with self._get_collection(mongoclass).watch(
+                full_document="updateLookup", resume_after=resume_token
+            ) as stream:
+                while True:
+                    change = stream.try_next()
+                    if change is None:
+                        break
+
+                    operation = change["operationType"]
+                    if operation in ("drop", "rename", "dropDatabase", "invalidate"):
+                        return None
+
+                    _id = change["documentKey"]["_id"]
+                    key = self.get_id_key(_id)
+                    document = change.get("fullDocument")
+
+                    # The document may have been deleted before the update was
+                    # looked up
+                    if operation == "delete" or document is None:
+                        upserts.pop(key, None)
+                        deletes[key] = _id
+                    else:
+                        deletes.pop(key, None)
+                        upserts[key] = document
+
+                token = stream.resume_token
+        except OperationFailure as e:
+            if e.code not in HISTORY_LOST_CODES:
+                raise
+
+            logger.warning(
+                "The change stream of %s.%s can't be resumed: %s",
+                mongoclass.DATABASE_NAME,
+                mongoclass.COLLECTION_NAME,
+                e,
+            )
+            return None
+
+        return list(upserts.values()), list(deletes.values()), token
+
+
+class MongoclassRedisCache(RedisCacheBase):
+
+    """
+    A simple cache system that allows you to cache entire mongoclass collections.
+
+    Every cached collection is stored as a list of document ids (to keep the order of the collection) and a hash mapping those ids to the encoded documents, this allows single documents to be inserted, updated and deleted without touching the rest of the cache.
+
+    Refreshing a collection with `.cache()` never exposes a partial collection, the new snapshot is built on the side and swapped in atomically. Collections that change slowly can be kept up to date with `.refresh()` instead, which only fetches the documents that changed.
+
+    Very large collections can be spread over several shards with `.cache(shards=N)`, see `.cache()`
+
+    Parameters
+    ----------
+    `mongoclass_instance` : MongoClassClient
+        The client the cached mongoclasses belong to.
+    `codec` : Codec
+        The codec used to encode documents when (re)building a cache. Defaults to `JSONCodec`. The codec is recorded alongside every cached collection so readers always decode with the codec it was written with. Since payloads may be binary, do not pass `decode_responses=True`.
+    `local_cache_size` : int
+        Keep up to this many already built mongoclass objects in this process, in front of Redis. Every write to a cache is published over Redis pub/sub so the local caches of every process drop the collection. Objects coming from the local cache are shared, treat them as read-only. Defaults to 0 which disables the local cache.
+    `local_cache_ttl` : float
+        How long in seconds a collection may stay in the local cache. Limits staleness if an invalidation is missed (for example while reconnecting). Defaults to None which means until invalidated.
+    `workers` : int
+        How many threads read and write Redis in the background, used to prefetch batches and to load and read the shards of sharded collections in parallel. Defaults to 4.
+    `connection` : redis.Redis
+        An existing connection to use instead of creating one from `*args, **kwargs`
+    `*args, **kwargs` :
+        To be passed onto `redis.Redis()`
+
+    Attributes
+    ----------
+    `scheduler` : RefreshScheduler
+        Runs the periodic re-updates requested with `.cache(every=...)`. Use it to stop them, tune the jitter and backoff or read the refresh timings.
+    `stats` : CacheStats
+        The hit rates, lock wait times, refresh durations and payload sizes of every cached collection. Use `.stats.as_dict()` to export them or `.stats.add_hook()` to forward them as they are recorded.
+    """
+
+    def __init__(
+        self,
+        mongoclass_instance,
+        *args,
+        codec: Optional[Codec] = None,
+        local_cache_size: int = 0,
+        local_cache_ttl: Optional[float] = None,
+        workers: int = 4,
+        connection: Optional[redis.Redis] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(mongoclass_instance, codec)
+        self.r = connection or redis.Redis(*args, **kwargs)
+        self.scheduler = RefreshScheduler()
+        self._flights = SingleFlight()
+        self._building = threading.local()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="mongoclass-io")
+
+        self._upsert_script = self.r.register_script(UPSERT_SCRIPT)
+        self._remove_script = self.r.register_script(REMOVE_SCRIPT)
+        self._bounded_set_script = self.r.register_script(BOUNDED_SET_SCRIPT)
+        self._bounded_get_script = self.r.register_script(BOUNDED_GET_SCRIPT)
+        self._bounded_remove_script = self.r.register_script(BOUNDED_REMOVE_SCRIPT)
+
+        # (database, collection) -> limits of the collections cached with .bound()
+        self.bounds: Dict[Tuple[str, str], dict] = {}
+
+        self.local_cache = None
+        self._pubsub_thread = None
+        if local_cache_size > 0:
+            self.local_cache = LocalCache(local_cache_size, local_cache_ttl)
+
+            pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: self._on_invalidation})
+            self._pubsub_thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def close(self) -> None:
+        """
+        Stop the scheduler, the invalidation listener and the background readers of this cache.
+        """
+
+        self.scheduler.stop()
+        self._executor.shutdown(wait=False)
+        if self._pubsub_thread is not None:
+            self._pubsub_thread.stop()
+            self._pubsub_thread = None
+
+    def _on_invalidation(self, message: dict) -> None:
+        name = message["data"].decode()
+
+        # Writes to a shard invalidate the whole collection
+        match = SHARD_PATTERN.match(name)
+        if match is not None:
+            name = f"mongoclass:{match.group(1)}"
+
+        self.local_cache.invalidate(name)
+
+    def invalidate(
+        self, database_name: str, collection_name: str, subset: Optional[str] = None
+    ) -> None:
+        """
+        Drop a collection (or one of its subsets) from the local cache of this process.
+        """
+
+        if self.local_cache is not None:
+            self.local_cache.invalidate(
+                self.get_list_name(database_name, collection_name, subset)
+            )
+
+    def get_codec(
+        self, database_name: str, collection_name: str, subset: Optional[str] = None
+    ) -> Codec:
+        """
+        Get the codec a cached collection was written with. Falls back to the codec of this cache if nothing was recorded yet.
+        """
+
+        return self._resolve_codec(
+            self.r.get(self.get_codec_name(database_name, collection_name, subset))
+        )
+
+    def get_shards(self, database_name: str, collection_name: str) -> int:
+        """
+        Get how many shards a cached collection is spread over, 0 if it isn't sharded.
+        """
+
+        return int(
+            self.r.get(self.get_shards_name(database_name, collection_name)) or 0
+        )
+
+    def _upgrade_legacy(self, mongoclass: object) -> bool:
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+
+        pipe = self.r.pipeline(transaction=False)
+        pipe.exists(self.get_codec_name(database_name, collection_name))
+        pipe.type(self.get_list_name(database_name, collection_name))
+        pipe.exists(self.get_hash_name(database_name, collection_name))
+        if not self._is_legacy(*pipe.execute()):
+            return False
+
+        logger.warning(
+            "Rebuilding the cache of %s.%s written by an older version of mongoclass",
+            database_name,
+            collection_name,
+        )
+        self.cache(mongoclass)
+        return True
+
+    def _get_parts(
+        self, database_name: str, collection_name: str
+    ) -> List[Optional[int]]:
+        return self._get_layout(self.get_shards(database_name, collection_name))
+
     def get_lock(
         self, database_name: str, collection_name: str, *args, **kwargs
-    ) -> Lock:
-        return self.r.lock(f"lock:{database_name}:{collection_name}", *args, **kwargs)
+    ) -> TimedLock:
+        """
+        Get the lock guarding the rebuilds of a cached collection. The time spent acquiring it is recorded in `.stats`
+        """
+
+        lock = self.r.lock(
+            f"lock:{database_name}:{collection_name}",
+            *args,
+            lock_class=TimedLock,
+            **kwargs,
+        )
+        lock.on_acquire = functools.partial(
+            self._record_lock_wait, database_name, collection_name
+        )
+        return lock
 
     def insert_to_cache(self, mongoclass_object: object) -> None:
         """
@@ -38,31 +1029,319 @@ class MongoclassRedisCache:
         database_name = mongoclass_object.DATABASE_NAME
         collection_name = mongoclass_object.COLLECTION_NAME
 
-        with self.get_lock(database_name, collection_name):
-            serialized = json.dumps(mongoclass_object.as_json())
+        # Objects that were never inserted don't have an id to be stored under
+        if mongoclass_object._mongodb_id is None:
+            key = f"local:{uuid.uuid4().hex}"
+        else:
+            key = self.get_id_key(mongoclass_object._mongodb_id)
 
-            self.r.rpush(self.get_list_name(database_name, collection_name), serialized)
+        if not self.r.exists(self.get_codec_name(database_name, collection_name)):
+            self._upgrade_legacy(type(mongoclass_object))
+
+        codec = self.get_codec(database_name, collection_name)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.set(self.get_codec_name(database_name, collection_name), codec.name)
+        self._upsert_documents(
+            database_name,
+            collection_name,
+            [(key, self.to_document(mongoclass_object))],
+            codec,
+            client=pipe,
+        )
+        pipe.execute()
+        self.invalidate(database_name, collection_name)
 
     def delete_from_cache(
         self, mongoclass: object, filter_func: Callable[[object], bool]
     ) -> bool:
 
-        item = self.get_from_cache(mongoclass, filter_func)
-        if item is None:
+        for key, item in self._iter_cached(mongoclass):
+            if filter_func(item):
+                break
+        else:
             return False
 
         return bool(
-            self.r.lrem(
-                self.get_list_name(
-                    mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME
-                ),
-                1,
-                json.dumps(item.as_json()),
+            self._remove_keys(
+                mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, [key]
+            )
+        )
+
+    def attach(self, mongoclass: object) -> None:
+        """
+        Keep the cache of a mongoclass up to date with every write made through mongoclass. After attaching, `insert`, `save`, `update`, `delete` and `insert_classes` also write the affected documents into the cache, so periodically re-caching the whole collection is no longer needed.
+
+        Writes made outside of mongoclass (or by other applications) are not seen, use `.refresh()` for those.
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance).
+        """
+
+        self.mongoclass_instance.add_write_listener(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, self
+        )
+
+    def detach(self, mongoclass: object) -> None:
+        """
+        Stop writing the writes made to a mongoclass into the cache. See `.attach()`
+        """
+
+        self.mongoclass_instance.remove_write_listener(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, self
+        )
+
+    def on_upsert(
+        self, database_name: str, collection_name: str, documents: List[dict]
+    ) -> None:
+        """
+        Called by the client of an attached mongoclass after documents were inserted or updated.
+        """
+
+        # Bounded entries are reloaded on their next read
+        if (database_name, collection_name) in self.bounds:
+            return self._remove_entries(
+                database_name,
+                collection_name,
+                [self.get_id_key(x["_id"]) for x in documents],
+            )
+
+        self._upsert_documents(
+            database_name,
+            collection_name,
+            [(self.get_id_key(x["_id"]), x) for x in documents],
+            self.get_codec(database_name, collection_name),
+        )
+
+    def on_delete(
+        self, database_name: str, collection_name: str, ids: List[Any]
+    ) -> None:
+        """
+        Called by the client of an attached mongoclass after documents were deleted.
+        """
+
+        if (database_name, collection_name) in self.bounds:
+            return self._remove_entries(
+                database_name, collection_name, [self.get_id_key(x) for x in ids]
+            )
+
+        self._remove_keys(
+            database_name, collection_name, [self.get_id_key(x) for x in ids]
+        )
+
+    def bound(
+        self,
+        mongoclass: object,
+        max_entries: int = 0,
+        max_bytes: int = 0,
+        ttl: Optional[float] = None,
+    ) -> None:
+        """
+        Cache a mongoclass document by document, on demand, instead of caching its whole collection. Documents are loaded into the cache the first time they are read with `.get_by_id()`, and once the cache of the collection exceeds `max_entries` documents or `max_bytes` bytes, the least recently read documents are evicted. Use this for collections that are too large to be cached entirely, only their working set is kept in Redis.
+
+        Every process reading the collection should bound it with the same limits. Attach the mongoclass with `.attach()` to drop the entries of documents written through mongoclass.
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance).
+        `max_entries` : int
+            The maximum number of cached documents. Defaults to 0 which means no limit.
+        `max_bytes` : int
+            The maximum total size in bytes of the cached (encoded) documents. Defaults to 0 which means no limit.
+        `ttl` : float
+            How long in seconds a document stays cached after being loaded. Defaults to None which means until evicted.
+        """
+
+        self.bounds[(mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME)] = {
+            "max_entries": max_entries,
+            "max_bytes": max_bytes,
+            "ttl": ttl,
+        }
+
+    def get_by_id(self, mongoclass: object, _id: Any) -> Optional[object]:
+        """
+        Get a document of a bounded mongoclass from the cache, loading it from the collection if it isn't cached. See `.bound()`
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance).
+        `_id` : Any
+            The `_id` of the document.
+
+        Returns
+        -------
+        `Optional[object]` :
+            A mongoclass object if the document exists else None.
+        """
+
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        limits = self.bounds.get((database_name, collection_name))
+        if limits is None:
+            raise ValueError(
+                f"{database_name}.{collection_name} is not bounded, call .bound() first"
+            )
+
+        key = self.get_id_key(_id)
+        codec = self.get_codec(database_name, collection_name)
+        payload = self._bounded_get_script(
+            [
+                *self._get_bounded_keys(database_name, collection_name),
+                self.get_entry_name(database_name, collection_name, key),
+            ],
+            [key, time.time()],
+        )
+
+        if payload is None:
+            self.stats.record(database_name, collection_name, "miss")
+
+            # Threads missing the same document share a single load
+            payload, _ = self._flights.do(
+                ("document", database_name, collection_name, key),
+                self._load_entry,
+                mongoclass,
+                _id,
+                key,
+                codec,
+                limits,
             )
+            if payload is None:
+                return None
+        else:
+            self.stats.record(database_name, collection_name, "hit")
+
+        return self.mongoclass_instance.map_document(
+            codec.decode(payload), collection_name, database_name
+        )
+
+    def evict(self, mongoclass: object, _id: Any) -> None:
+        """
+        Remove a document of a bounded mongoclass from the cache.
+        """
+
+        self._remove_entries(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, [self.get_id_key(_id)]
         )
 
+    def _load_entry(
+        self, mongoclass: object, _id: Any, key: str, codec: Codec, limits: dict
+    ) -> Optional[bytes]:
+        document = self._get_collection(mongoclass).find_one({"_id": _id})
+        if document is None:
+            return None
+
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        payload = codec.encode(document)
+        ttl = limits["ttl"]
+
+        # The codec and the entries don't share a slot, so no transaction
+        pipe = self.r.pipeline(transaction=False)
+        pipe.set(self.get_codec_name(database_name, collection_name), codec.name)
+        self._bounded_set_script(
+            [
+                *self._get_bounded_keys(database_name, collection_name),
+                self.get_entry_name(database_name, collection_name, key),
+            ],
+            [
+                key,
+                payload,
+                int(ttl * 1000) if ttl else 0,
+                time.time(),
+                limits["max_entries"],
+                limits["max_bytes"],
+            ],
+            pipe,
+        )
+        evicted, expired = pipe.execute()[-1]
+
+        # Expired entries may not have been dropped by Redis yet
+        victims = [*evicted, *expired]
+        if victims:
+            self.r.delete(
+                *[
+                    self.get_entry_name(database_name, collection_name, x.decode())
+                    for x in victims
+                ]
+            )
+
+        self.stats.record_payloads(database_name, collection_name, [len(payload)])
+        if evicted:
+            self.stats.record(database_name, collection_name, "evict", len(evicted))
+        return payload
+
+    def _remove_entries(
+        self, database_name: str, collection_name: str, keys: List[str]
+    ) -> None:
+        if keys:
+            self._bounded_remove_script(
+                [
+                    *self._get_bounded_keys(database_name, collection_name),
+                    *[
+                        self.get_entry_name(database_name, collection_name, x)
+                        for x in keys
+                    ],
+                ],
+                keys,
+            )
+
+    def _upsert_documents(
+        self,
+        database_name: str,
+        collection_name: str,
+        documents: Iterable[Tuple[str, dict]],
+        codec: Codec,
+        client: Optional[redis.client.Redis] = None,
+    ) -> None:
+        payloads = self._encode_documents(
+            database_name, collection_name, documents, codec
+        )
+        if not payloads:
+            return
+
+        parts = self._get_parts(database_name, collection_name)
+        for part, group in self._group_by_part(parts, payloads).items():
+            self._upsert_script(
+                self._get_write_keys(database_name, collection_name, part),
+                list(itertools.chain.from_iterable(group)),
+                client,
+            )
+        if client is None:
+            self.invalidate(database_name, collection_name)
+
+    def _remove_keys(
+        self,
+        database_name: str,
+        collection_name: str,
+        keys: Iterable[str],
+        client: Optional[redis.client.Redis] = None,
+    ) -> int:
+        keys = list(keys)
+        if not keys:
+            return 0
+
+        removed = 0
+        parts = self._get_parts(database_name, collection_name)
+        for part, group in self._group_by_part(parts, [(x, x) for x in keys]).items():
+            result = self._remove_script(
+                self._get_write_keys(database_name, collection_name, part),
+                [x for x, _ in group],
+                client,
+            )
+            if client is None:
+                removed += result
+        if client is None:
+            self.invalidate(database_name, collection_name)
+        return removed
+
     def get_from_cache(
-        self, mongoclass: object, filter_func: Callable[[object], bool]
+        self,
+        mongoclass: object,
+        filter_func: Callable[[object], bool],
+        subset: Optional[str] = None,
     ) -> Optional[object]:
         """
         Get a specific object from the cache.
@@ -73,6 +1352,8 @@ class MongoclassRedisCache:
             The mongoclass class definition (not an instance).
         `filter_func` : Callable[[object], bool]
             A callable that takes an element from the cache as input and returns a boolean value to indicate if it should be returned and finding should be stopped.
+        `subset` : str
+            Look in a subset cached with `.cache(subset=...)` instead of the whole collection.
 
         Returns
         -------
@@ -80,12 +1361,17 @@ class MongoclassRedisCache:
             A mongoclass object if the object was found else None.
         """
 
-        for item in self.get_cached(mongoclass):
+        for item in self.get_cached(mongoclass, subset=subset):
             if filter_func(item):
+                self.stats.record(
+                    mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, "hit"
+                )
                 return item
 
+        self.stats.record(mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, "miss")
+
     def get_cached(
-        self, mongoclass: object, batch_size: int = 500
+        self, mongoclass: object, batch_size: int = 500, subset: Optional[str] = None
     ) -> Generator[object, None, None]:
         """
         Return all cached objects of a mongoclass collection.
@@ -95,7 +1381,9 @@ class MongoclassRedisCache:
         `mongoclass` : object
             The mongoclass class definition (not an instance).
         `batch_size` : int
-            How many objects to load at once.
+            How many objects to load at once. The next batch is read in the background while the current one is being decoded.
+        `subset` : str
+            Return the objects of a subset cached with `.cache(subset=...)` instead of the whole collection, in the order they were cached.
 
         Yields
         ------
@@ -103,32 +1391,210 @@ class MongoclassRedisCache:
             A mongoclass object.
         """
 
-        last_start = 0
-        last_end = batch_size
+        for _, item in self._iter_cached(mongoclass, batch_size, subset):
+            yield item
 
+    def _iter_cached(
+        self, mongoclass: object, batch_size: int = 500, subset: Optional[str] = None
+    ) -> Generator[Tuple[bytes, object], None, None]:
         list_name = self.get_list_name(
-            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, subset
         )
 
-        while True:
-            elements = self.r.lrange(list_name, last_start, last_end)
+        if self.local_cache is not None:
+            items = self.local_cache.get(list_name)
+            self.stats.record(
+                mongoclass.DATABASE_NAME,
+                mongoclass.COLLECTION_NAME,
+                "local_miss" if items is None else "local_hit",
+            )
+
+            # Collections that fit in the local cache are loaded whole, once for
+            # every thread that is missing them at the same time
+            if (
+                items is None
+                and self._count_cached(mongoclass, subset)
+                <= self.local_cache.max_objects
+            ):
+                items, _ = self._flights.do(
+                    ("load", list_name),
+                    self._load_local,
+                    mongoclass,
+                    batch_size,
+                    subset,
+                )
+
+            if items is not None:
+                for item in items:
+                    yield item
+                return
 
-            if not elements:
-                break
+        yield from self._read_cached(mongoclass, batch_size, subset)
+
+    def _load_local(
+        self, mongoclass: object, batch_size: int, subset: Optional[str]
+    ) -> List[Tuple[bytes, object]]:
+        list_name = self.get_list_name(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, subset
+        )
+
+        # Remember the generation before reading so a concurrent invalidation
+        # keeps what we load out of the local cache
+        generation = self.local_cache.generation(list_name)
+        items = list(self._read_cached(mongoclass, batch_size, subset))
+        self.local_cache.put(list_name, items, generation)
+        return items
+
+    def _count_cached(self, mongoclass: object, subset: Optional[str]) -> int:
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        shards = self.get_shards(database_name, collection_name)
+        if subset is not None or not shards:
+            return self.r.llen(
+                self.get_list_name(database_name, collection_name, subset)
+            )
+
+        pipe = self.r.pipeline(transaction=False)
+        for shard in range(shards):
+            pipe.llen(self.get_shard_list_name(database_name, collection_name, shard))
+        return sum(pipe.execute())
+
+    def _read_cached(
+        self, mongoclass: object, batch_size: int, subset: Optional[str]
+    ) -> Generator[Tuple[bytes, object], None, None]:
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        shards = (
+            self.get_shards(database_name, collection_name) if subset is None else 0
+        )
+        if shards:
+            yield from self._read_shards(mongoclass, batch_size, shards)
+            return
+
+        list_name = self.get_list_name(database_name, collection_name, subset)
+        hash_name = self.get_hash_name(database_name, collection_name, subset)
+        codec_name = self.get_codec_name(database_name, collection_name, subset)
+        codec = self.r.get(codec_name)
+        if codec is None and subset is None and self._upgrade_legacy(mongoclass):
+            codec = self.r.get(codec_name)
+        codec = self._resolve_codec(codec)
+
+        batch = self._fetch_batch(list_name, hash_name, 0, batch_size)
+        if subset is None and not any(x for _, x in batch):
+            # Resharded between reading the layout and the list, which is gone now
+            shards = self.get_shards(database_name, collection_name)
+            if shards:
+                yield from self._read_shards(mongoclass, batch_size, shards)
+                return
+
+        start = 0
+        while batch:
+
+            # Read the next batch in the background while this one is decoded. A
+            # short batch means we reached the end of the list.
+            pending = None
+            start += batch_size
+            if len(batch) == batch_size:
+                pending = self._executor.submit(
+                    self._fetch_batch, list_name, hash_name, start, batch_size
+                )
+
+            yield from self._decode_batch(mongoclass, codec, batch)
+            batch = pending.result() if pending is not None else None
 
-            for serialized in elements:
-                deserialized = json.loads(serialized)
+    def _read_shards(
+        self, mongoclass: object, batch_size: int, shards: int
+    ) -> Generator[Tuple[bytes, object], None, None]:
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        codec = self.get_codec(database_name, collection_name)
+        names = [
+            self._get_script_keys(database_name, collection_name, shard)[:2]
+            for shard in range(shards)
+        ]
+
+        # Read a batch of every shard at once, and the next batch of the shards that
+        # have more while the current ones are decoded
+        start = 0
+        pending = [
+            (
+                hash_name,
+                list_name,
+                self._executor.submit(
+                    self._fetch_batch, list_name, hash_name, start, batch_size
+                ),
+            )
+            for hash_name, list_name in names
+        ]
+        while pending:
+            batches = [(h, l, x.result()) for h, l, x in pending]
+
+            # Resharded between reading the layout and the shards
+            if not start and not all(any(x for _, x in y) for _, _, y in batches):
+                current = self.get_shards(database_name, collection_name)
+                if current != shards:
+                    yield from self._read_cached(mongoclass, batch_size, None)
+                    return
 
-                yield self.mongoclass_instance.map_document(
-                    deserialized, mongoclass.COLLECTION_NAME, mongoclass.DATABASE_NAME
+            start += batch_size
+            pending = [
+                (
+                    h,
+                    l,
+                    self._executor.submit(self._fetch_batch, l, h, start, batch_size),
                 )
+                for h, l, batch in batches
+                if len(batch) == batch_size
+            ]
+
+            for _, _, batch in batches:
+                yield from self._decode_batch(mongoclass, codec, batch)
+
+    def _decode_batch(
+        self,
+        mongoclass: object,
+        codec: Codec,
+        batch: List[Tuple[bytes, Optional[bytes]]],
+    ) -> Generator[Tuple[bytes, object], None, None]:
+        for key, serialized in batch:
+            # Removed between reading the order and the documents
+            if serialized is None:
+                continue
 
-            last_start = last_end + 1
-            last_end = last_start + batch_size
+            deserialized = codec.decode(serialized)
+            yield key, self.mongoclass_instance.map_document(
+                deserialized,
+                mongoclass.COLLECTION_NAME,
+                mongoclass.DATABASE_NAME,
+            )
+
+    def _fetch_batch(
+        self, list_name: str, hash_name: str, start: int, batch_size: int
+    ) -> List[Tuple[bytes, Optional[bytes]]]:
+        keys = self.r.lrange(list_name, start, start + batch_size - 1)
+        if not keys:
+            return []
+        return list(zip(keys, self.r.hmget(hash_name, keys)))
 
-    def cache(self, mongoclass: object, every: int = 0) -> None:
+    def cache(
+        self,
+        mongoclass: object,
+        every: int = 0,
+        watermark: Optional[str] = None,
+        change_stream: bool = False,
+        chunk_size: int = 1000,
+        subset: Optional[str] = None,
+        filter: Optional[dict] = None,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        limit: int = 0,
+        shards: int = 0,
+    ) -> None:
         """
-        Cache the contents of a mongoclass collection.
+        Cache the contents of a mongoclass collection, or a named subset of it.
+
+        The raw documents are streamed from the collection and written to Redis in chunks, so neither the whole collection nor its mongoclass objects are ever held in memory.
+
+        Calls made while the same collection is already being cached (by this or another process) wait for that build and use its snapshot instead of running their own, so a cold start of many workers only queries the collection once.
 
         Parameters
         ----------
@@ -138,32 +1604,822 @@ class MongoclassRedisCache:
             Re-update the cache every X seconds. Defaults to 0 which means do not
             re-update. Note that you can always call this .cache() method to
             re-update manually. There are update means of updating such as inserting
-            into the cache and there are methods for that.
+            into the cache and there are methods for that. If `watermark` or
+            `change_stream` is given, the re-updates are done using `.refresh()`.
+            The re-updates are run by `.scheduler`, calling this again replaces the
+            previous schedule of the mongoclass.
+        `watermark` : str
+            A field that is set to an increasing value (such as an `updated_at` datetime or a version number) every time a document is written. When given, the highest value is recorded so `.refresh()` can only fetch the documents that changed since.
+        `change_stream` : bool
+            Record a change stream resume token so `.refresh()` can apply the changes from the collection's change stream. Only supported by the pymongo engine and requires a replica set. Defaults to False.
+        `chunk_size` : int
+            How many documents to fetch and write to Redis at once. Defaults to 1000.
+        `subset` : str
+            Cache only the documents matching `filter`, ordered by `sort` and limited to `limit` documents, as a subset with this name, for example the active users or the top 1000 products by score. Every subset is stored under its own keys and has its own schedule, read it with `.get_cached(subset=...)` and `.get_from_cache(subset=...)`. Subsets are snapshots, they aren't updated by `.attach()` or `.refresh()` so keep them fresh with `every`.
+        `filter` : dict
+            The query selecting the documents of the subset.
+        `sort` : List[Tuple[str, int]]
+            The order of the documents of the subset, as given to `find`.
+        `limit` : int
+            The maximum number of documents of the subset. Defaults to 0 which means no limit.
+        `shards` : int
+            Spread the collection over this many shards, each document going to the shard its `_id` hashes to. Every shard has its own keys so that on Redis Cluster a large collection is spread over the nodes instead of sitting in a single slot, and the shards are loaded and read in parallel by the `workers` threads. Reads of a sharded collection don't keep the order of the collection. Each shard is swapped in atomically but the shards aren't swapped together, so readers may briefly see some shards of the previous snapshot. Defaults to 0 which means a single list and hash.
         """
 
-        # Get information for the key
+        if subset is None and (filter or sort or limit):
+            raise ValueError("Caching part of a collection requires a subset name")
+        if subset is not None and (watermark or change_stream):
+            raise ValueError("Subsets can't be refreshed incrementally")
+        if subset is not None and shards:
+            raise ValueError("Subsets can't be sharded")
+        if shards < 0:
+            raise ValueError("shards must be positive")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        query = {"filter": filter or {}, "sort": sort, "limit": limit}
+        options = self._encode_options(watermark, change_stream, query, shards)
+
+        # Concurrent identical builds of this process share a single build
+        self._flights.do(
+            (
+                "build",
+                mongoclass.DATABASE_NAME,
+                mongoclass.COLLECTION_NAME,
+                subset,
+                options,
+            ),
+            self._build_once,
+            mongoclass,
+            subset,
+            options,
+            self._build,
+            mongoclass,
+            watermark,
+            change_stream,
+            chunk_size,
+            subset,
+            query,
+            shards,
+        )
+
+        if every > 0:
+            if subset is not None:
+                update = functools.partial(
+                    self.cache,
+                    mongoclass,
+                    chunk_size=chunk_size,
+                    subset=subset,
+                    filter=filter,
+                    sort=sort,
+                    limit=limit,
+                )
+            elif watermark or change_stream:
+                update = functools.partial(
+                    self._scheduled_refresh,
+                    mongoclass,
+                    {
+                        "watermark": watermark,
+                        "change_stream": change_stream,
+                        "shards": shards,
+                        "chunk_size": chunk_size,
+                    },
+                )
+            else:
+                update = functools.partial(
+                    self.cache, mongoclass, chunk_size=chunk_size, shards=shards
+                )
+
+            self.scheduler.schedule(mongoclass, every, update, subset)
+            self.scheduler.start()
+
+    def _build_once(
+        self,
+        mongoclass: object,
+        subset: Optional[str],
+        options: Optional[str],
+        function: Callable[..., None],
+        *args,
+    ) -> bool:
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        # Builds of other processes are coalesced through Redis. If one is already
+        # running we wait for it and use its snapshot, unless it failed to produce one
+        # or built it from other `options`. The builder keeps extending the lock while
+        # it writes chunks (see `._extend_build_lock()`).
+        lock = self.r.lock(
+            self._get_build_lock_name(database_name, collection_name, subset),
+            timeout=self.BUILD_LOCK_TIMEOUT,
+        )
+        building = lock.acquire(blocking=False)
+        acquired = building or lock.acquire(blocking_timeout=self.BUILD_WAIT_TIMEOUT)
+        if not acquired:
+            logger.warning(
+                "Gave up waiting for another build of %s.%s",
+                database_name,
+                collection_name,
+            )
+
+        # Without `options` this is a warm up, which only loads a snapshot if nothing
+        # got cached while the lock was being acquired
+        previous = getattr(self._building, "lock", None)
+        self._building.lock = lock if acquired else None
+        try:
+            if (building and options is not None) or self._is_stale(
+                database_name, collection_name, subset, options
+            ):
+                with self.stats.timed(database_name, collection_name, "build"):
+                    function(*args)
+                return True
+            return False
+        finally:
+            self._building.lock = previous
+            if acquired:
+                try:
+                    lock.release()
+                except LockError:
+                    logger.warning(
+                        "The build lock of %s.%s expired before the build finished",
+                        database_name,
+                        collection_name,
+                    )
+
+    def _extend_build_lock(self) -> None:
+        # Called by builds after every chunk they write
+        lock = getattr(self._building, "lock", None)
+        if lock is None:
+            return
+
+        try:
+            lock.extend(self.BUILD_LOCK_TIMEOUT, replace_ttl=True)
+        except LockError:
+            # Another process took over, both builds end up with a full snapshot
+            self._building.lock = None
+
+    def _is_stale(
+        self,
+        database_name: str,
+        collection_name: str,
+        subset: Optional[str],
+        options: Optional[str],
+    ) -> bool:
+        pipe = self.r.pipeline(transaction=False)
+        pipe.exists(self.get_codec_name(database_name, collection_name, subset))
+        pipe.get(self.get_options_name(database_name, collection_name, subset))
+        return self._is_stale_snapshot(*pipe.execute(), options)
+
+    def _build(
+        self,
+        mongoclass: object,
+        watermark: Optional[str],
+        change_stream: bool,
+        chunk_size: int,
+        subset: Optional[str] = None,
+        query: Optional[dict] = None,
+        shards: int = 0,
+    ) -> None:
+        query = query or {"filter": {}, "sort": None, "limit": 0}
+
+        sync = self._start_sync(mongoclass, watermark, change_stream)
+
+        def chunks() -> Generator[Dict[str, bytes], None, None]:
+            latest = None
+            documents = self._find_documents(
+                mongoclass, query["filter"], chunk_size, query["sort"], query["limit"]
+            )
+            while True:
+                chunk, latest = self._encode_chunk(
+                    documents, chunk_size, watermark, latest
+                )
+                if not chunk:
+                    break
+                yield chunk
+
+            if watermark:
+                sync["value"] = self._encode_sync_value(latest)
+
+        self._store(
+            mongoclass,
+            chunks(),
+            sync,
+            subset,
+            shards,
+            options=self._encode_options(watermark, change_stream, query, shards),
+        )
+
+    def _store(
+        self,
+        mongoclass: object,
+        chunks: Iterable[Dict[str, bytes]],
+        sync: dict,
+        subset: Optional[str] = None,
+        shards: int = 0,
+        codec_name: Optional[str] = None,
+        options: Optional[str] = None,
+    ) -> None:
+        # Swap in a snapshot made of the encoded `chunks`. The documents are only
+        # fetched as `chunks` is consumed, and `sync` is read once it's exhausted.
         database_name = mongoclass.DATABASE_NAME
         collection_name = mongoclass.COLLECTION_NAME
+        list_name = self.get_list_name(database_name, collection_name, subset)
+        hash_name = self.get_hash_name(database_name, collection_name, subset)
+        codec_name = codec_name or self.codec.name
+
+        parts = self._get_layout(shards)
+        previous_parts = [None]
+        if subset is None:
+            previous_parts = self._get_parts(database_name, collection_name)
+        if parts != [None] or previous_parts != [None]:
+            return self._store_shards(
+                mongoclass, chunks, sync, parts, previous_parts, codec_name, options
+            )
+
+        # Subsets aren't written through so there are no writes to track
+        if subset is None:
+            self._track_writes(database_name, collection_name)
+        build = uuid.uuid4().hex
+
+        count = 0
+        for chunk in chunks:
+            self._write_build_chunk(list_name, hash_name, build, chunk, not count)
+            count += len(chunk)
+            self.stats.record_payloads(
+                database_name, collection_name, map(len, chunk.values())
+            )
+            self._extend_build_lock()
 
         with self.get_lock(database_name, collection_name):
 
-            # Clear the key before caching
-            self.r.delete(self.get_list_name(database_name, collection_name))
+            pipe = self.r.pipeline(transaction=True)
+            self._swap_snapshot(
+                pipe,
+                database_name,
+                collection_name,
+                subset,
+                build,
+                count,
+                codec_name,
+                options,
+            )
+            if subset is not None:
+                pipe.execute()
+                self.invalidate(database_name, collection_name, subset)
+                return
+
+            self._set_sync(pipe, database_name, collection_name, sync)
+            self._untrack_writes(database_name, collection_name, pipe)
+            written = pipe.execute()[-2]
+            self.invalidate(database_name, collection_name)
+            self.stats.record(database_name, collection_name, "documents", count)
+
+            # Whatever was written during the build may be missing from the snapshot
+            self._reload_keys(mongoclass, written)
+
+    def _store_shards(
+        self,
+        mongoclass: object,
+        chunks: Iterable[Dict[str, bytes]],
+        sync: dict,
+        parts: List[Optional[int]],
+        previous_parts: List[Optional[int]],
+        codec_name: str,
+        options: Optional[str] = None,
+    ) -> None:
+        # Like `._store()` for collections that are, or were until now, sharded
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
 
-            pipe = self.r.pipeline()
-            for obj in mongoclass.find_classes({}):
-                serialized = json.dumps(obj.as_json())
+        # Writes go to the previous layout until the new one is in place
+        tracked = [*parts, *[x for x in previous_parts if x not in parts]]
+        self._track_writes(database_name, collection_name, tracked)
+        build = uuid.uuid4().hex
+        names = {}
+        for part in parts:
+            hash_name, list_name = self._get_script_keys(
+                database_name, collection_name, part
+            )[:2]
+            names[part] = (list_name, hash_name)
 
-                pipe.rpush(
-                    self.get_list_name(database_name, collection_name), serialized
+        counts = dict.fromkeys(parts, 0)
+        for chunk in chunks:
+            groups = self._group_by_part(parts, chunk.items())
+            futures = [
+                self._executor.submit(
+                    self._write_build_chunk,
+                    *names[part],
+                    build,
+                    dict(group),
+                    not counts[part],
                 )
+                for part, group in groups.items()
+            ]
+            for future in futures:
+                future.result()
+            for part, group in groups.items():
+                counts[part] += len(group)
+            self.stats.record_payloads(
+                database_name, collection_name, map(len, chunk.values())
+            )
+            self._extend_build_lock()
+
+        with self.get_lock(database_name, collection_name):
+            # Every shard lives in a single slot so it can be swapped in atomically.
+            # Readers keep using the previous layout until `:shards` is switched.
+            for part, (list_name, hash_name) in names.items():
+                if not counts[part]:
+                    continue
+
+                pipe = self.r.pipeline(transaction=True)
+                pipe.rename(f"{list_name}:build:{build}", list_name)
+                pipe.rename(f"{hash_name}:build:{build}", hash_name)
+                pipe.persist(list_name)
+                pipe.persist(hash_name)
+                pipe.execute()
+
+            shards_name = self.get_shards_name(database_name, collection_name)
+            pipe = self.r.pipeline(transaction=False)
+            pipe.set(self.get_codec_name(database_name, collection_name), codec_name)
+            self._set_options(pipe, database_name, collection_name, None, options)
+            if parts == [None]:
+                pipe.delete(shards_name)
+            else:
+                pipe.set(shards_name, len(parts))
             pipe.execute()
 
-        if every > 0:
+            # Only then the keys of the previous layout, and the empty new shards
+            written = set()
+            for part in tracked:
+                pipe = self.r.pipeline(transaction=True)
+                if part not in parts or not counts[part]:
+                    pipe.delete(
+                        *self._get_script_keys(database_name, collection_name, part)[:2]
+                    )
+                self._untrack_writes(database_name, collection_name, pipe, part)
+                written.update(pipe.execute()[-2])
 
-            def f():
-                while True:
-                    self.cache(mongoclass)
-                    time.sleep(every)
+            pipe = self.r.pipeline(transaction=False)
+            self._set_sync(pipe, database_name, collection_name, sync)
+            pipe.publish(
+                INVALIDATION_CHANNEL,
+                self.get_list_name(database_name, collection_name),
+            )
+            pipe.execute()
+            self.invalidate(database_name, collection_name)
+            self.stats.record(
+                database_name, collection_name, "documents", sum(counts.values())
+            )
+
+            self._reload_keys(mongoclass, written)
+
+    def _write_build_chunk(
+        self,
+        list_name: str,
+        hash_name: str,
+        build: str,
+        chunk: Dict[str, bytes],
+        first: bool,
+    ) -> None:
+        pipe = self.r.pipeline(transaction=False)
+        self._add_build_chunk(pipe, list_name, hash_name, build, chunk, first)
+        pipe.execute()
+
+    def snapshot_to(self, mongoclass: object, path: str, batch_size: int = 500) -> int:
+        """
+        Save the cached documents of a mongoclass collection to a file, so the cache can be warmed up from it with `.warm_from()` after a restart instead of reloading the whole collection.
+
+        The documents are saved as stored in Redis (encoded with the codec of the collection) in a compact binary file, together with the watermark or change stream resume token of the collection. The file is written next to `path` and renamed into place, so a snapshot being written is never read.
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance).
+        `path` : str
+            The file to save the snapshot to.
+        `batch_size` : int
+            How many documents to read from Redis at once. Defaults to 500.
+
+        Returns
+        -------
+        `int` :
+            How many documents were saved.
+        """
+
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        codec_name = self.r.get(self.get_codec_name(database_name, collection_name))
+        if codec_name is None:
+            raise ValueError(f"{database_name}.{collection_name} isn't cached")
+
+        # The watermark is read before the documents so the catch-up of a warm up
+        # can only fetch too much, never too little
+        sync = self.r.hgetall(self.get_sync_name(database_name, collection_name))
+        if not sync:
+            raise ValueError(
+                "Only collections cached with a watermark or change stream can be "
+                "caught up after warming up"
+            )
+
+        shards = self.get_shards(database_name, collection_name)
+        header = json_util.dumps(
+            {
+                "database": database_name,
+                "collection": collection_name,
+                "codec": codec_name.decode(),
+                "shards": shards,
+                "sync": {k.decode(): v.decode() for k, v in sync.items()},
+            }
+        ).encode()
+
+        count = 0
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(SNAPSHOT_MAGIC)
+                f.write(SNAPSHOT_HEADER.pack(len(header)))
+                f.write(header)
+
+                for part in self._get_layout(shards):
+                    hash_name, list_name = self._get_script_keys(
+                        database_name, collection_name, part
+                    )[:2]
+                    for start in itertools.count(0, batch_size):
+                        batch = self._fetch_batch(
+                            list_name, hash_name, start, batch_size
+                        )
+                        for key, serialized in batch:
+                            if serialized is None:
+                                continue
+
+                            f.write(SNAPSHOT_RECORD.pack(len(key), len(serialized)))
+                            f.write(key)
+                            f.write(serialized)
+                            count += 1
+
+                        if len(batch) < batch_size:
+                            break
+
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return count
+
+    def warm_from(self, mongoclass: object, path: str, chunk_size: int = 1000) -> bool:
+        """
+        Warm up the cache of a mongoclass collection from a file saved by `.snapshot_to()`, then catch up with the changes made since the snapshot was taken with `.refresh()`.
+
+        The file is memory mapped and its documents are written to Redis as they are, without decoding them. Nothing is loaded if the collection is already cached, so of many workers starting at once only the first one loads the snapshot.
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance).
+        `path` : str
+            The snapshot file.
+        `chunk_size` : int
+            How many documents to write to Redis at once. Defaults to 1000.
+
+        Returns
+        -------
+        `bool` :
+            Whether the snapshot was loaded.
+        """
+
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        if self.r.exists(self.get_codec_name(database_name, collection_name)):
+            return False
+
+        loaded, _ = self._flights.do(
+            ("build", database_name, collection_name, None, None),
+            self._build_once,
+            mongoclass,
+            None,
+            None,
+            self._warm,
+            mongoclass,
+            path,
+            chunk_size,
+        )
+        if loaded:
+            self.refresh(mongoclass)
+        return loaded
+
+    def _warm(self, mongoclass: object, path: str, chunk_size: int) -> None:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < len(SNAPSHOT_MAGIC):
+                raise ValueError(f"{path} isn't a mongoclass snapshot")
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                if view[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                    raise ValueError(f"{path} isn't a mongoclass snapshot")
+
+                offset = len(SNAPSHOT_MAGIC)
+                (size,) = SNAPSHOT_HEADER.unpack_from(view, offset)
+                offset += SNAPSHOT_HEADER.size
+                header = json_util.loads(view[offset : offset + size])
+                offset += size
+
+                if (header["database"], header["collection"]) != (
+                    mongoclass.DATABASE_NAME,
+                    mongoclass.COLLECTION_NAME,
+                ):
+                    raise ValueError(
+                        f"{path} is a snapshot of "
+                        f"{header['database']}.{header['collection']}"
+                    )
+
+                sync = header["sync"]
+                self._store(
+                    mongoclass,
+                    self._read_snapshot(view, offset, chunk_size),
+                    sync,
+                    shards=header["shards"],
+                    codec_name=header["codec"],
+                    options=self._encode_options(
+                        sync.get("field"),
+                        "resume_token" in sync,
+                        shards=header["shards"],
+                    ),
+                )
+
+    @staticmethod
+    def _read_snapshot(
+        view: mmap.mmap, offset: int, chunk_size: int
+    ) -> Generator[Dict[bytes, bytes], None, None]:
+        chunk = {}
+        while offset < len(view):
+            key_size, size = SNAPSHOT_RECORD.unpack_from(view, offset)
+            offset += SNAPSHOT_RECORD.size
+            key = view[offset : offset + key_size]
+            offset += key_size
+            chunk[key] = view[offset : offset + size]
+            offset += size
+
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = {}
+
+        if chunk:
+            yield chunk
+
+    def refresh(self, mongoclass: object, detect_deletes: bool = False) -> None:
+        """
+        Incrementally update the cache of a mongoclass collection. Only the documents that changed since the last `.cache()` or `.refresh()` are fetched and applied to the cache.
+
+        How the changes are found depends on how the collection was cached:
+
+        - With `change_stream=True`, the changes (including deletes) are read from the collection's change stream. If it can't be resumed anymore (the collection was dropped or renamed, or the recorded resume token fell out of the oplog, for example after warming up from an old snapshot), the collection is rebuilt.
+        - With a `watermark`, the documents whose watermark field is greater or equal to the highest value seen so far are fetched. Deleted documents can't be seen this way, pass `detect_deletes=True` to find them with an `_id` only scan of the collection.
+        - Otherwise, or if the collection isn't cached yet, this falls back to a full `.cache()`
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance).
+        `detect_deletes` : bool
+            Scan the ids of the collection to remove deleted documents from the cache. Defaults to False.
+        """
+
+        with self.stats.timed(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, "refresh"
+        ):
+            self._refresh(mongoclass, detect_deletes)
+
+    def _scheduled_refresh(self, mongoclass: object, defaults: dict) -> None:
+        with self.stats.timed(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, "refresh"
+        ):
+            self._refresh(mongoclass, False, defaults)
+
+    def _refresh(
+        self, mongoclass: object, detect_deletes: bool, defaults: Optional[dict] = None
+    ) -> None:
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        sync_name = self.get_sync_name(database_name, collection_name)
+
+        shards = self.get_shards(database_name, collection_name)
+        sync = self.r.hgetall(sync_name)
+        if not sync or not self.r.exists(
+            self.get_codec_name(database_name, collection_name)
+        ):
+            return self._rebuild(mongoclass, defaults or {"shards": shards})
+
+        parts = self._get_layout(shards)
+        with self.get_lock(database_name, collection_name):
+            self._track_writes(database_name, collection_name, parts)
+            changes = self._collect_changes(mongoclass, sync)
+
+            if changes is not None:
+                upserts, deletes, sync = changes
+
+                self._upsert_documents(
+                    database_name,
+                    collection_name,
+                    [(self.get_id_key(x["_id"]), x) for x in upserts],
+                    self.get_codec(database_name, collection_name),
+                )
+                self._remove_keys(
+                    database_name,
+                    collection_name,
+                    [self.get_id_key(x) for x in deletes],
+                )
+                self.r.hset(sync_name, mapping=sync)
+
+                if detect_deletes:
+                    self._remove_keys(
+                        database_name,
+                        collection_name,
+                        self._find_deleted_keys(mongoclass),
+                    )
+            else:
+                # Don't try to resume from it again if the rebuild fails
+                self.r.hdel(sync_name, "resume_token")
+
+            written = set()
+            for part in parts:
+                pipe = self.r.pipeline(transaction=True)
+                self._untrack_writes(database_name, collection_name, pipe, part)
+                written.update(pipe.execute()[-2])
+            self._reload_keys(mongoclass, written)
+
+        # The collection was dropped or renamed, or its change stream history was
+        # lost, there is nothing to resume from
+        if changes is None:
+            self._rebuild(mongoclass, self._get_resync_defaults(sync, shards, defaults))
+
+    def _rebuild(self, mongoclass: object, defaults: dict) -> None:
+        options_name = self.get_options_name(
+            mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME
+        )
+        self.cache(
+            mongoclass, **self._get_rebuild_args(self.r.get(options_name), defaults)
+        )
+
+    def _reload_keys(self, mongoclass: object, keys: Iterable[bytes]) -> None:
+        documents, missing = self._load_keys(mongoclass, keys)
+        if not documents and not missing:
+            return
+
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+
+        self._upsert_documents(
+            database_name,
+            collection_name,
+            documents.items(),
+            self.get_codec(database_name, collection_name),
+        )
+        self._remove_keys(database_name, collection_name, missing)
+
+    def _track_writes(
+        self,
+        database_name: str,
+        collection_name: str,
+        parts: Optional[List[Optional[int]]] = None,
+    ) -> None:
+        # Shards live in different slots, each is tracked on its own
+        for part in parts or [None]:
+            pipe = self.r.pipeline(transaction=True)
+            self._track_writes_to(pipe, database_name, collection_name, part)
+            pipe.execute()
+
+    def _find_deleted_keys(self, mongoclass: object) -> List[bytes]:
+        database_name = mongoclass.DATABASE_NAME
+        collection_name = mongoclass.COLLECTION_NAME
+        existing = self._find_existing_keys(mongoclass)
+
+        cached = []
+        for part in self._get_parts(database_name, collection_name):
+            cached.extend(
+                self.r.hkeys(
+                    self._get_script_keys(database_name, collection_name, part)[0]
+                )
+            )
+        return [x for x in cached if x not in existing]
+
+
+class RedisNegativeCache:
+
+    """
+    A `NegativeCache` kept in Redis, so every process knows which `find_class` queries found nothing. Pass it to the client as `negative_cache`.
+
+    Parameters
+    ----------
+    `*args, **kwargs` :
+        To be passed onto `redis.Redis()`
+    `ttl` : float
+        How long in seconds a query that found nothing is remembered. Defaults to 5.
+    `max_entries` : int
+        How many queries to remember per collection, the oldest ones are forgotten first. Defaults to 10000.
+    `connection` : redis.Redis
+        Use this connection instead of creating one.
+    """
+
+    def __init__(
+        self,
+        *args,
+        ttl: float = 5,
+        max_entries: int = 10000,
+        connection: Optional[redis.Redis] = None,
+        **kwargs,
+    ) -> None:
+        self.r = connection or redis.Redis(*args, **kwargs)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._add_script = self.r.register_script(NEGATIVE_ADD_SCRIPT)
+        self._candidates_script = self.r.register_script(NEGATIVE_CANDIDATES_SCRIPT)
+
+    def get_names(self, database: str, collection: str) -> List[str]:
+        # The hash tag keeps the keys of a collection in the same Redis Cluster slot
+        name = f"mongoclass:{{{database}:{collection}}}:missing"
+        return [name, f"{name}:queries", f"{name}:generation", f"{name}:unindexed"]
+
+    def get_index_name(
+        self, database: str, collection: str, term: Tuple[str, str]
+    ) -> str:
+        name = self.get_names(database, collection)[0]
+        return f"{name}:index:{json_util.dumps(term)}"
+
+    def generation(self, database: str, collection: str) -> int:
+        return int(self.r.get(self.get_names(database, collection)[2]) or 0)
+
+    def contains(self, database: str, collection: str, key: str) -> bool:
+        expiry = self.r.zscore(self.get_names(database, collection)[0], key)
+        return expiry is not None and expiry > time.time() * 1000
+
+    def lookup(self, database: str, collection: str, key: str) -> Tuple[bool, int]:
+        expiries_name, _, generation_name, _ = self.get_names(database, collection)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.zscore(expiries_name, key)
+        pipe.get(generation_name)
+        expiry, generation = pipe.execute()
+        return (
+            expiry is not None and expiry > time.time() * 1000,
+            int(generation or 0),
+        )
+
+    def add(
+        self, database: str, collection: str, key: str, query: dict, generation: int
+    ) -> bool:
+        now = int(time.time() * 1000)
+        ttl = max(int(self.ttl * 1000), 1)
+        names = self.get_names(database, collection)
+        term = get_query_term(query)
+        if term is not None:
+            names.append(self.get_index_name(database, collection, term))
+
+        return bool(
+            self._add_script(
+                names,
+                [
+                    generation,
+                    now,
+                    now + ttl,
+                    ttl,
+                    self.max_entries,
+                    key,
+                    json_util.dumps(query, json_options=JSON_OPTIONS),
+                ],
+            )
+        )
+
+    def invalidate(
+        self, database: str, collection: str, documents: Iterable[dict]
+    ) -> int:
+        documents = list(documents)
+        names = self.get_names(database, collection)
+        expiries_name, queries_name, _, unindexed_name = names
+
+        # Only the queries indexed by a term of the documents may match them. Queries
+        # added from now on ran before the invalidation and are refused.
+        terms = set().union(*map(get_document_terms, documents))
+        result = self._candidates_script(
+            [
+                *names,
+                *sorted(self.get_index_name(database, collection, x) for x in terms),
+            ]
+        )
+
+        forgotten = [
+            key
+            for key, query in zip(result[::2], result[1::2])
+            if any(
+                may_match(json_util.loads(query, json_options=JSON_OPTIONS), x)
+                for x in documents
+            )
+        ]
+        if forgotten:
+            pipe = self.r.pipeline(transaction=True)
+            pipe.zrem(expiries_name, *forgotten)
+            pipe.hdel(queries_name, *forgotten)
+            pipe.srem(unindexed_name, *forgotten)
+            pipe.execute()
+        return len(forgotten)
 
-            threading.Thread(target=f, daemon=True).start()
+    def clear(self) -> None:
+        for name in self.r.scan_iter("mongoclass:{*}:missing*"):
+            self.r.delete(name)
@@ -1,16 +1,26 @@
 import copy
 import dataclasses
 import functools
-from typing import Callable, List, Optional, Tuple, Union
+import itertools
+import time
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple, Union
 
 import mongita.database
 import mongita.results
 import pymongo.database
 import pymongo.results
+from bson import json_util
 from mongita import MongitaClientDisk, MongitaClientMemory
 from pymongo import MongoClient
 
+from . import pagination, scan
 from .cursor import Cursor
+from .hydration import get_hydrator
+from .indexes import Index, IndexReport, diff_indexes, is_emulated
+from .pagination import Page
+from .profiling import SlowQueryLog
+from .query import Fields, as_filter, filter_args
+from .singleflight import SingleFlight
 
 
 def client_constructor(engine: str, *args, **kwargs):
@@ -30,13 +40,31 @@ def client_constructor(engine: str, *args, **kwargs):
         ----------
         `default_db_name` : str
             The name of the default database.
+        `single_flight` : bool
+            Coalesce identical `find_class` queries that run at the same time, so concurrent lookups of the same document (for example right after a cache expired) share a single database query. Every caller still gets its own object. Note that a lookup may then be answered by a query that started slightly before it. Defaults to False.
+        `negative_cache` : Union[NegativeCache, RedisNegativeCache]
+            Remember the `find_class` queries that found nothing for a short while and answer them with None without querying the database. Inserts and updates made through mongoclass forget the queries they may match. Defaults to None which means every query goes to the database.
+        `slow_query_log` : SlowQueryLog
+            Record the `find_class`, `find_classes`, `count_documents`, `aggregate` and `paginate` queries slower than its threshold. Defaults to None which means queries aren't timed.
         `*args, **kwargs` :
             To be passed onto `MongoClient()` or `MongitaClientDisk()`
         """
 
-        def __init__(self, default_db_name: str = "main", *args, **kwargs) -> None:
+        def __init__(
+            self,
+            default_db_name: str = "main",
+            *args,
+            single_flight: bool = False,
+            negative_cache: Optional[object] = None,
+            slow_query_log: Optional[SlowQueryLog] = None,
+            **kwargs,
+        ) -> None:
             super().__init__(*args, **kwargs)
             self.mapping = {}
+            self.write_listeners = {}
+            self.single_flight = SingleFlight() if single_flight else None
+            self.negative_cache = negative_cache
+            self.slow_query_log = slow_query_log
             self.default_database: Union[
                 pymongo.database.Database, mongita.database.Database
             ] = self[default_db_name]
@@ -79,6 +107,93 @@ def client_constructor(engine: str, *args, **kwargs):
 
             return self[database]
 
+        def add_write_listener(
+            self, database: str, collection: str, listener: object
+        ) -> None:
+            """
+            Register a listener that gets told about every write mongoclass makes to a collection, for example a `MongoclassRedisCache` that keeps its cache up to date.
+
+            Parameters
+            ----------
+            `database` : str
+                The name of the database of the collection.
+            `collection` : str
+                The name of the collection.
+            `listener` : object
+                An object implementing `on_upsert(database, collection, documents)`, called with the new raw documents after an insert or update and `on_delete(database, collection, ids)`, called with the ids of deleted documents.
+            """
+
+            listeners = self.write_listeners.setdefault((database, collection), [])
+            if listener not in listeners:
+                listeners.append(listener)
+
+        def remove_write_listener(
+            self, database: str, collection: str, listener: object
+        ) -> None:
+            """
+            Remove a listener previously registered with `add_write_listener`.
+            """
+
+            listeners = self.write_listeners.get((database, collection), [])
+            if listener in listeners:
+                listeners.remove(listener)
+
+        def get_write_listeners(self, database: str, collection: str) -> List[object]:
+            return self.write_listeners.get((database, collection), [])
+
+        def record_query(
+            self,
+            operation: str,
+            db: Union[pymongo.database.Database, mongita.database.Database],
+            collection: str,
+            query: Any,
+            duration: float,
+            command: Optional[dict] = None,
+        ) -> None:
+            """
+            Tell the `slow_query_log` how long a query took. `command` is the command to explain the query with, if it's slow and the log explains queries.
+            """
+
+            if self.slow_query_log is None:
+                return
+
+            explain = None
+            if command is not None and self._engine_used == "pymongo":
+                explain = functools.partial(
+                    db.command, "explain", command, verbosity="queryPlanner"
+                )
+
+            mapped = self.mapping.get(db.name, {}).get(collection)
+            self.slow_query_log.record(
+                operation,
+                db.name,
+                collection,
+                mapped["constructor"].__name__ if mapped else None,
+                query,
+                duration,
+                explain,
+            )
+
+        def profile_cursor(
+            self,
+            operation: str,
+            db: Union[pymongo.database.Database, mongita.database.Database],
+            collection: str,
+            query: Any,
+            command: Optional[dict] = None,
+            duration: float = 0,
+        ) -> Optional[Callable[[float], None]]:
+            """
+            Get the `profile` of a `Cursor` that tells the `slow_query_log` how long the cursor spent fetching documents, plus `duration`.
+            """
+
+            if self.slow_query_log is None:
+                return None
+
+            return lambda elapsed: self.record_query(
+                operation, db, collection, query, duration + elapsed, command
+            )
+
         def map_document(
             self, data: dict, collection: str, database: str, force_nested: bool = False
         ) -> object:
@@ -130,6 +245,7 @@ def client_constructor(engine: str, *args, **kwargs):
             database: Optional[Union[str, pymongo.database.Database]] = None,
             insert_on_init: bool = False,
             nested: bool = False,
+            indexes: Optional[List[Union[Index, str, List[Tuple[str, Any]]]]] = None,
         ) -> Callable:
             """
             A decorator used to map a dataclass onto a collection.
@@ -147,9 +263,17 @@ def client_constructor(engine: str, *args, **kwargs):
                 This can also be overwritten by setting `_insert=False`
             `nested` : bool
                 Whether this mongoclass has other mongoclasses inside it. Nesting is not automatically determined for performance purposes. Defaults to False.
+            `indexes` : List[Union[Index, str, List[Tuple[str, Any]]]]
+                The indexes of the collection, created by `ensure_indexes()`. Either `Index` objects, field names or lists of `(field, direction)` for compound indexes. Defaults to None which means the indexes of the collection aren't managed.
 
             """
             db = self.__choose_database(database)
+            declared = None
+            if indexes is not None:
+                declared = [Index.from_spec(x) for x in indexes]
+                keys = [tuple(x.keys) for x in declared]
+                if len(set(keys)) != len(keys):
+                    raise ValueError("The same index is declared more than once")
 
             def wrapper(cls):
                 collection_name = collection or cls.__name__.lower()
@@ -159,6 +283,12 @@ def client_constructor(engine: str, *args, **kwargs):
                     COLLECTION_NAME = collection_name
                     DATABASE_NAME = db.name
 
+                    # The fields to build typed queries with, see `query.Fields`
+                    q = Fields(cls, nested=nested)
+
+                    # The declared indexes, see `MongoClassClient.ensure_indexes()`
+                    INDEXES = declared
+
                     # pylint:disable=no-self-argument
                     def __init__(this, *args, **kwargs) -> None:
                         # MongodDB Attributes
@@ -191,10 +321,26 @@ def client_constructor(engine: str, *args, **kwargs):
                         `InsertOneResult`
                         """
 
+                        document = this.as_json()
                         res = this._mongodb_db[this._mongodb_collection].insert_one(
-                            this.as_json(), *args, **kwargs
+                            document, *args, **kwargs
                         )
                         this._mongodb_id = res.inserted_id
+                        self.forget_missing(
+                            this._mongodb_db.name,
+                            this._mongodb_collection,
+                            [{"_id": res.inserted_id, **document}],
+                        )
+
+                        for listener in self.get_write_listeners(
+                            this._mongodb_db.name, this._mongodb_collection
+                        ):
+                            listener.on_upsert(
+                                this._mongodb_db.name,
+                                this._mongodb_collection,
+                                [{"_id": res.inserted_id, **document}],
+                            )
+
                         return res
 
                     def update(
@@ -224,18 +370,49 @@ def client_constructor(engine: str, *args, **kwargs):
 
                         return_new = kwargs.pop("return_new", True)
 
-                        res = this._mongodb_db[this._mongodb_collection].update_one(
+                        collection = this._mongodb_db[this._mongodb_collection]
+                        listeners = self.get_write_listeners(
+                            this._mongodb_db.name, this._mongodb_collection
+                        )
+                        res = collection.update_one(
                             {"_id": this._mongodb_id}, operation, *args, **kwargs
                         )
+
                         return_value = this
-                        if return_new:
+                        if return_new or listeners:
                             _id = this._mongodb_id or res.upserted_id
                             if _id:
-                                return_value = self.find_class(
-                                    this._mongodb_collection,
-                                    {"_id": _id},
-                                    database=this._mongodb_db,
-                                )
+                                # Not through find_class, single-flight could hand back a
+                                # read that started before the update
+                                new = collection.find_one({"_id": _id})
+                                if new is not None:
+                                    new = self.map_document(
+                                        new,
+                                        this._mongodb_collection,
+                                        this._mongodb_db.name,
+                                    )
+                                if return_new:
+                                    return_value = new
+                                if new is not None:
+                                    self.forget_missing(
+                                        this._mongodb_db.name,
+                                        this._mongodb_collection,
+                                        [{"_id": _id, **new.as_json()}],
+                                    )
+
+                                for listener in listeners:
+                                    if new is None:
+                                        listener.on_delete(
+                                            this._mongodb_db.name,
+                                            this._mongodb_collection,
+                                            [_id],
+                                        )
+                                    else:
+                                        listener.on_upsert(
+                                            this._mongodb_db.name,
+                                            this._mongodb_collection,
+                                            [{"_id": _id, **new.as_json()}],
+                                        )
 
                         return (res, return_value)
 
@@ -300,10 +477,26 @@ def client_constructor(engine: str, *args, **kwargs):
                         `DeleteResult`
                         """
 
-                        return this._mongodb_db[this._mongodb_collection].delete_one(
+                        res = this._mongodb_db[this._mongodb_collection].delete_one(
                             {"_id": this._mongodb_id}, *args, **kwargs
                         )
 
+                        # Nothing to tell about if the document was already gone, an
+                        # unacknowledged delete may have deleted it though
+                        if res.acknowledged and not res.deleted_count:
+                            return res
+
+                        for listener in self.get_write_listeners(
+                            this._mongodb_db.name, this._mongodb_collection
+                        ):
+                            listener.on_delete(
+                                this._mongodb_db.name,
+                                this._mongodb_collection,
+                                [this._mongodb_id],
+                            )
+
+                        return res
+
                     @staticmethod
                     def count_documents(*args, **kwargs) -> int:
                         """
@@ -319,7 +512,20 @@ def client_constructor(engine: str, *args, **kwargs):
                         `int`
                         """
 
-                        return db[collection_name].count_documents(*args, **kwargs)
+                        args, kwargs = filter_args(args, kwargs)
+                        started = time.monotonic()
+                        count = db[collection_name].count_documents(*args, **kwargs)
+
+                        query = args[0] if args else kwargs.get("filter")
+                        self.record_query(
+                            "count_documents",
+                            db,
+                            collection_name,
+                            query,
+                            time.monotonic() - started,
+                            {"count": collection_name, "query": query or {}},
+                        )
+                        return count
 
                     @staticmethod
                     def find_class(
@@ -365,17 +571,72 @@ def client_constructor(engine: str, *args, **kwargs):
                                 mongita.database.Database,
                             ]
                         ] = None,
+                        into: Optional[type] = None,
+                        raw: bool = False,
+                        batch_size: Optional[int] = None,
                         **kwargs,
                     ) -> Cursor:
+                        """
+                        Run an aggregation pipeline on this collection. By default, every output document is mapped back to this mongoclass, which only works for pipelines keeping the shape of the documents. Use `into` or `raw` for the output of stages such as `$group` and `$project`.
+
+                        Parameters
+                        ----------
+                        `*args, **kwargs` :
+                            To be passed onto `Collection.aggregate`, such as `allowDiskUse=True` for large pipelines.
+                        `database` : Union[str, Database]
+                            The database to use. Defaults to the default database.
+                        `into` : type
+                            A dataclass to build the output documents into. The fields are read by a hydrator compiled once per dataclass, other keys are ignored. Defaults to None.
+                        `raw` : bool
+                            Yield the output documents as they are. Defaults to False.
+                        `batch_size` : int
+                            How many documents each batch fetched from the server holds. Defaults to None which means the server default.
+
+                        Returns
+                        -------
+                        `Cursor`:
+                            A cursor over the output documents.
+                        """
+
+                        if into is not None and raw:
+                            raise ValueError("Pass either into or raw, not both")
+                        if batch_size is not None:
+                            kwargs["batchSize"] = batch_size
+
+                        mapping_function = self.map_document
+                        document_class = Inner
+                        if raw:
+                            mapping_function = lambda data, *_: data
+                            document_class = None
+                        elif into is not None:
+                            hydrator = get_hydrator(into)
+                            mapping_function = lambda data, *_: hydrator(data)
+                            document_class = into
+
                         db = self.choose_database(database)
+                        started = time.monotonic()
                         query = db[collection_name].aggregate(*args, **kwargs)
 
+                        pipeline = args[0] if args else kwargs.get("pipeline")
                         return Cursor(
                             query,
-                            self.map_document,
+                            mapping_function,
                             collection_name,
                             db.name,
                             self._engine_used,
+                            self.profile_cursor(
+                                "aggregate",
+                                db,
+                                collection_name,
+                                pipeline,
+                                {
+                                    "aggregate": collection_name,
+                                    "pipeline": pipeline,
+                                    "cursor": {},
+                                },
+                                time.monotonic() - started,
+                            ),
+                            document_class,
                         )
 
                     @staticmethod
@@ -391,8 +652,49 @@ def client_constructor(engine: str, *args, **kwargs):
                         pre_call: Optional[Callable] = None,
                         page: int,
                         size: int,
+                        with_total: bool = False,
+                        estimate_above: int = 0,
                         **kwargs,
-                    ) -> Cursor:
+                    ) -> Union[Cursor, Page]:
+                        """
+                        Get a page of this class using skip and limit.
+
+                        Parameters
+                        ----------
+                        `*args, **kwargs` :
+                            To be passed onto `find`.
+                        `database` : Union[str, Database]
+                            The database to use. Defaults to the default database.
+                        `pre_call` : Callable
+                            Called with the cursor before the page is selected, to sort it for example.
+                        `page` : int
+                            The page, starting at 1.
+                        `size` : int
+                            The number of documents of a page.
+                        `with_total` : bool
+                            Also count the documents matching the query, see `MongoClassClient.paginate_with_total()`. Defaults to False.
+                        `estimate_above` : int
+                            With `with_total`, stop counting at this many documents, see `MongoClassClient.paginate_with_total()`. Defaults to 0 which means count them all.
+
+                        Returns
+                        -------
+                        `Union[Cursor, Page]` :
+                            The cursor of the page, or the page and the total if `with_total` is True.
+                        """
+
+                        args, kwargs = filter_args(args, kwargs)
+                        if with_total:
+                            return self.paginate_with_total(
+                                collection_name,
+                                *args,
+                                database=database,
+                                pre_call=pre_call,
+                                page=page,
+                                size=size,
+                                estimate_above=estimate_above,
+                                **kwargs,
+                            )
+
                         skip = (page - 1) * size
 
                         cursor = self.find_classes(
@@ -402,10 +704,78 @@ def client_constructor(engine: str, *args, **kwargs):
                         if pre_call:
                             cursor = pre_call(cursor)
 
+                        query = args[0] if args else kwargs.get("filter")
+                        cursor.profile = self.profile_cursor(
+                            "paginate",
+                            self.choose_database(database),
+                            collection_name,
+                            query,
+                            {"find": collection_name, "filter": query or {}},
+                        )
                         results = cursor.skip(skip).limit(size)
 
                         return results
 
+                    @staticmethod
+                    def paginate_after(
+                        filter: Optional[dict] = None,
+                        *,
+                        database: Optional[
+                            Union[
+                                str,
+                                pymongo.database.Database,
+                                mongita.database.Database,
+                            ]
+                        ] = None,
+                        after: Optional[str] = None,
+                        size: int,
+                        sort: Optional[List[Tuple[str, int]]] = None,
+                        **kwargs,
+                    ) -> Page:
+                        """
+                        Get a page of this class using keyset pagination, see `MongoClassClient.paginate_after()`.
+                        """
+
+                        return self.paginate_after(
+                            collection_name,
+                            filter,
+                            database=database,
+                            after=after,
+                            size=size,
+                            sort=sort,
+                            **kwargs,
+                        )
+
+                    @staticmethod
+                    def scan_parallel(
+                        filter: Optional[dict] = None,
+                        *,
+                        database: Optional[
+                            Union[
+                                str,
+                                pymongo.database.Database,
+                                mongita.database.Database,
+                            ]
+                        ] = None,
+                        partitions: int = 4,
+                        workers: Optional[int] = None,
+                        callback: Optional[Callable[[list], None]] = None,
+                        batch_size: int = 1000,
+                    ) -> Union[Iterator[object], int]:
+                        """
+                        Scan this class with several threads at once, see `MongoClassClient.scan_parallel()`.
+                        """
+
+                        return self.scan_parallel(
+                            collection_name,
+                            filter,
+                            database=database,
+                            partitions=partitions,
+                            workers=workers,
+                            callback=callback,
+                            batch_size=batch_size,
+                        )
+
                     @staticmethod
                     def find_classes(
                         *args,
@@ -501,6 +871,64 @@ def client_constructor(engine: str, *args, **kwargs):
 
             return wrapper
 
+        def ensure_indexes(self, dry_run: bool = False) -> IndexReport:
+            """
+            Create the indexes declared on the mongoclasses with `indexes=[...]` that don't exist yet. The existing indexes of each collection are compared with the declared ones and the missing ones are created by a single `create_indexes` call. Indexes are never dropped or rebuilt, differences that creating an index can't fix are reported as drift and logged as warnings.
+
+            Mongita only supports indexes on a single key without options, which are created one at a time. The other declared indexes are reported as unsupported.
+
+            Parameters
+            ----------
+            `dry_run` : bool
+                Only report what would be created, without creating anything. Defaults to False.
+
+            Returns
+            -------
+            `IndexReport` :
+                The created indexes and the drift.
+            """
+
+            report = IndexReport()
+            for database, collections in self.mapping.items():
+                for collection, info in collections.items():
+                    declared = info["constructor"].INDEXES
+                    if declared is None:
+                        continue
+
+                    coll = self[database][collection]
+                    if self._engine_used == "pymongo":
+                        existing = coll.index_information()
+                    else:
+                        # Mongita gives a list of single index dicts
+                        existing = {
+                            k: v for x in coll.index_information() for k, v in x.items()
+                        }
+                        unsupported = [x for x in declared if not is_emulated(x)]
+                        for index in unsupported:
+                            report.unsupported.append(
+                                {
+                                    "database": database,
+                                    "collection": collection,
+                                    **index.as_dict(),
+                                }
+                            )
+                        declared = [x for x in declared if is_emulated(x)]
+
+                    missing = diff_indexes(
+                        database, collection, declared, existing, report
+                    )
+                    if missing and not dry_run:
+                        if self._engine_used == "pymongo":
+                            coll.create_indexes([x.to_model() for x in missing])
+                        else:
+                            for index in missing:
+                                coll.create_index(index.keys)
+                    report.created.extend(
+                        {"database": database, "collection": collection, **x.as_dict()}
+                        for x in missing
+                    )
+            return report
+
         def find_class(
             self,
             collection: str,
@@ -531,11 +959,86 @@ def client_constructor(engine: str, *args, **kwargs):
             """
 
             db = self.__choose_database(database)
-            query = db[collection].find_one(*args, **kwargs)
+            args, kwargs = filter_args(args, kwargs)
+            key = self.__get_query_key(args, kwargs)
+
+            negative_cache = self.negative_cache if key is not None else None
+            if negative_cache is not None:
+                missing, generation = negative_cache.lookup(db.name, collection, key)
+                if missing:
+                    return
+
+            started = time.monotonic()
+            if self.single_flight is None:
+                query = db[collection].find_one(*args, **kwargs)
+            else:
+                query = self.__find_one_shared(db, collection, key, args, kwargs)
+
+            query_filter = args[0] if args else kwargs.get("filter")
+            if query_filter is not None and not isinstance(query_filter, dict):
+                query_filter = {"_id": query_filter}
+            self.record_query(
+                "find_class",
+                db,
+                collection,
+                query_filter,
+                time.monotonic() - started,
+                {"find": collection, "filter": query_filter or {}, "limit": 1},
+            )
+
             if not query:
+                if negative_cache is not None:
+                    negative_cache.add(
+                        db.name, collection, key, query_filter or {}, generation
+                    )
                 return
             return self.map_document(query, collection, db.name)
 
+        @staticmethod
+        def __get_query_key(args: tuple, kwargs: dict) -> Optional[str]:
+            try:
+                return json_util.dumps([args, kwargs])
+            except TypeError:
+                # Not a plain query (a session for example)
+                return None
+
+        def __find_one_shared(
+            self,
+            db: Union[pymongo.database.Database, mongita.database.Database],
+            collection: str,
+            key: Optional[str],
+            args: tuple,
+            kwargs: dict,
+        ) -> Optional[dict]:
+            if key is None:
+                return db[collection].find_one(*args, **kwargs)
+
+            query, _ = self.single_flight.do(
+                (db.name, collection, key), db[collection].find_one, *args, **kwargs
+            )
+
+            # Mapping consumes the document, leave the shared one untouched
+            return copy.deepcopy(query)
+
+        def forget_missing(
+            self, database: str, collection: str, documents: Iterable[dict]
+        ) -> None:
+            """
+            Tell the `negative_cache` that raw documents were written to a collection, so the queries they may match are no longer answered with None. Inserts and updates made through mongoclass do this on their own, call it after writing to a collection some other way.
+
+            Parameters
+            ----------
+            `database` : str
+                The name of the database of the collection.
+            `collection` : str
+                The name of the collection.
+            `documents` : Iterable[dict]
+                The written raw documents, including their `_id`.
+            """
+
+            if self.negative_cache is not None:
+                self.negative_cache.invalidate(database, collection, documents)
+
         def find_classes(
             self,
             collection: str,
@@ -566,12 +1069,305 @@ def client_constructor(engine: str, *args, **kwargs):
             """
 
             db = self.__choose_database(database)
+            args, kwargs = filter_args(args, kwargs)
             query = db[collection].find(*args, **kwargs)
+            query_filter = args[0] if args else kwargs.get("filter")
             cursor = Cursor(
-                query, self.map_document, collection, db.name, self._engine_used
+                query,
+                self.map_document,
+                collection,
+                db.name,
+                self._engine_used,
+                self.profile_cursor(
+                    "find_classes",
+                    db,
+                    collection,
+                    query_filter,
+                    {"find": collection, "filter": query_filter or {}},
+                ),
+                self.mapping.get(db.name, {}).get(collection, {}).get("constructor"),
             )
             return cursor
 
+        def paginate_with_total(
+            self,
+            collection: str,
+            filter: Optional[dict] = None,
+            *,
+            database: Optional[
+                Union[str, pymongo.database.Database, mongita.database.Database]
+            ] = None,
+            pre_call: Optional[Callable] = None,
+            page: int,
+            size: int,
+            estimate_above: int = 0,
+            **kwargs,
+        ) -> Page:
+            """
+            Get a page of documents as mongoclasses and how many documents match the query in total.
+
+            On pymongo, both are fetched by a single `$facet` aggregation so the query only runs once. The page then has to fit in a single 16MB document. When `pre_call` or `find` options other than `sort` are given, and on mongita, the page and the count are queried separately.
+
+            Parameters
+            ----------
+            `collection` : str
+                The collection to use.
+            `filter` : dict
+                The query selecting the documents to paginate.
+            `database` : Union[str, Database]
+                The database to use. Defaults to the default database.
+            `pre_call` : Callable
+                Called with the cursor before the page is selected.
+            `page` : int
+                The page, starting at 1.
+            `size` : int
+                The number of documents of a page.
+            `estimate_above` : int
+                Stop counting at this many documents, for queries matching too many documents to count them on every page. Past it, the total of a query without filter is the estimated count of the collection and that of a filtered query is `estimate_above`, and the `exact_total` of the page is False. Only used on pymongo. Defaults to 0 which means count them all.
+            `**kwargs` :
+                Keyword arguments to pass onto `find`.
+
+            Returns
+            -------
+            `Page` :
+                The mongoclasses of the page and the total.
+            """
+
+            db = self.__choose_database(database)
+            filter = as_filter(filter) or {}
+            skip = (page - 1) * size
+            pymongo_used = self._engine_used == "pymongo"
+            command = {"find": collection, "filter": filter}
+            started = time.monotonic()
+
+            if pymongo_used and pre_call is None and set(kwargs) <= {"sort"}:
+                stages = [{"$skip": skip}, {"$limit": size}]
+                if kwargs.get("sort"):
+                    stages.insert(0, {"$sort": dict(kwargs["sort"])})
+                count_stages = [{"$count": "count"}]
+                if estimate_above:
+                    count_stages.insert(0, {"$limit": estimate_above})
+
+                pipeline = [
+                    {"$match": filter},
+                    {"$facet": {"documents": stages, "total": count_stages}},
+                ]
+                command = {"aggregate": collection, "pipeline": pipeline, "cursor": {}}
+                result = next(db[collection].aggregate(pipeline))
+                items = [
+                    self.map_document(x, collection, db.name)
+                    for x in result["documents"]
+                ]
+                total = result["total"][0]["count"] if result["total"] else 0
+            else:
+                cursor = self.find_classes(collection, filter, database=db, **kwargs)
+                if pre_call:
+                    cursor = pre_call(cursor)
+                cursor.profile = None
+                items = list(cursor[skip : skip + size])
+
+                if pymongo_used and estimate_above:
+                    total = db[collection].count_documents(filter, limit=estimate_above)
+                else:
+                    total = db[collection].count_documents(filter)
+            self.record_query(
+                "paginate", db, collection, filter, time.monotonic() - started, command
+            )
+
+            if pymongo_used and estimate_above and total >= estimate_above:
+                if not filter:
+                    total = db[collection].estimated_document_count()
+                return Page(items, total=total, exact_total=False)
+            return Page(items, total=total)
+
+        def paginate_after(
+            self,
+            collection: str,
+            filter: Optional[dict] = None,
+            *,
+            database: Optional[
+                Union[str, pymongo.database.Database, mongita.database.Database]
+            ] = None,
+            after: Optional[str] = None,
+            size: int,
+            sort: Optional[List[Tuple[str, int]]] = None,
+            **kwargs,
+        ) -> Page:
+            """
+            Get a page of documents as mongoclasses using keyset (seek) pagination. Instead of skipping the documents of the previous pages, the page starts right after the position given by `after` in `sort`, so deep pages cost as much as the first one.
+
+            Notes
+            -----
+            - The sort always ends with `_id` so every document has a unique position. Sort on fields that are set on every document, a sort with an index covering it and `_id` is the fastest.
+            - On mongita, which doesn't support `$or`, only the first sort key is filtered on by the engine and the rest of the position is checked while reading.
+
+            Parameters
+            ----------
+            `collection` : str
+                The collection to use.
+            `filter` : dict
+                The query selecting the documents to paginate.
+            `database` : Union[str, Database]
+                The database to use. Defaults to the default database.
+            `after` : str
+                The `next_token` or `previous_token` of a page. Defaults to None which means the first page.
+            `size` : int
+                The maximum number of documents of the page.
+            `sort` : List[Tuple[str, int]]
+                The order of the documents, as given to `find`. Defaults to `_id` ascending.
+            `**kwargs` :
+                Keyword arguments to pass onto `find`.
+
+            Returns
+            -------
+            `Page` :
+                The mongoclasses of the page with the tokens of the next and previous pages.
+            """
+
+            db = self.__choose_database(database)
+            sort = pagination.normalize_sort(sort)
+            filter = as_filter(filter) or {}
+
+            values, backwards = None, False
+            if after is not None:
+                values, backwards = pagination.decode_token(after, sort)
+            query_sort = [(k, -d) for k, d in sort] if backwards else sort
+            started = time.monotonic()
+
+            # One more document than needed tells whether there is another page
+            if values is None:
+                documents = list(
+                    db[collection].find(
+                        filter, sort=query_sort, limit=size + 1, **kwargs
+                    )
+                )
+            elif self._engine_used == "pymongo":
+                seek = pagination.seek_filter(sort, values, backwards)
+                documents = list(
+                    db[collection].find(
+                        {"$and": [filter, seek]} if filter else seek,
+                        sort=query_sort,
+                        limit=size + 1,
+                        **kwargs,
+                    )
+                )
+            else:
+                key, direction = sort[0]
+                query = dict(filter)
+                if key not in query and values[0] is not None:
+                    operator = "$gte" if (direction == 1) != backwards else "$lte"
+                    query[key] = {operator: values[0]}
+
+                cursor = db[collection].find(query, sort=query_sort, **kwargs)
+                documents = list(
+                    itertools.islice(
+                        (
+                            x
+                            for x in cursor
+                            if pagination.is_after(sort, x, values, backwards)
+                        ),
+                        size + 1,
+                    )
+                )
+
+            self.record_query(
+                "paginate",
+                db,
+                collection,
+                filter,
+                time.monotonic() - started,
+                {"find": collection, "filter": filter, "sort": dict(query_sort)},
+            )
+
+            has_more = len(documents) > size
+            documents = documents[:size]
+            if backwards:
+                documents.reverse()
+
+            next_token = previous_token = None
+            if documents:
+                if has_more or backwards:
+                    next_token = pagination.encode_token(sort, documents[-1], False)
+                if has_more if backwards else after is not None:
+                    previous_token = pagination.encode_token(sort, documents[0], True)
+
+            items = [self.map_document(x, collection, db.name) for x in documents]
+            return Page(items, next_token, previous_token)
+
+        def scan_parallel(
+            self,
+            collection: str,
+            filter: Optional[dict] = None,
+            *,
+            database: Optional[
+                Union[str, pymongo.database.Database, mongita.database.Database]
+            ] = None,
+            partitions: int = 4,
+            workers: Optional[int] = None,
+            callback: Optional[Callable[[list], None]] = None,
+            batch_size: int = 1000,
+        ) -> Union[Iterator[object], int]:
+            """
+            Scan the documents of a collection as mongoclasses with several threads at once, for jobs going over a whole collection. The documents are split into `_id` ranges of about the same size, found with `$bucketAuto` on pymongo and by reading the `_id` of the matching documents on mongita, and each range is read and mapped by a thread of its own.
+
+            Without `callback`, an iterator over the mongoclasses is returned. They come in no particular order, and breaking out of the iteration stops the scan. With `callback`, it's called with every batch of mongoclasses from the scanning threads, so it has to be thread-safe, and the number of scanned documents is returned once the scan is over.
+
+            Parameters
+            ----------
+            `collection` : str
+                The collection to scan.
+            `filter` : dict
+                The query selecting the documents to scan. Defaults to None which means every document.
+            `database` : Union[str, Database]
+                The database to use. Defaults to the default database.
+            `partitions` : int
+                How many `_id` ranges to split the documents into. Defaults to 4.
+            `workers` : int
+                How many threads scan the ranges. Defaults to None which means one per range.
+            `callback` : Callable[[list], None]
+                Called with every batch of mongoclasses instead of yielding them. Defaults to None.
+            `batch_size` : int
+                How many mongoclasses each batch holds. Defaults to 1000.
+
+            Returns
+            -------
+            `Union[Iterator[object], int]` :
+                The mongoclasses, or the number of scanned documents with `callback`.
+            """
+
+            if partitions < 1 or batch_size < 1:
+                raise ValueError("partitions and batch_size must be at least 1")
+
+            db = self.__choose_database(database)
+            filter = as_filter(filter) or {}
+            boundaries = scan.get_boundaries(
+                db[collection], filter, partitions, self._engine_used
+            )
+            filters = scan.partition_filters(filter, boundaries)
+
+            def read(query: dict, emit: Callable[[list], None]) -> int:
+                cursor = db[collection].find(query)
+                if self._engine_used == "pymongo":
+                    cursor = cursor.batch_size(batch_size)
+
+                count = 0
+                batch = []
+                for data in cursor:
+                    batch.append(self.map_document(data, collection, db.name))
+                    if len(batch) >= batch_size:
+                        emit(batch)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    emit(batch)
+                    count += len(batch)
+                return count
+
+            workers = workers or len(filters)
+            if callback is None:
+                return scan.iter_partitions(read, filters, workers)
+            return scan.run_partitions(read, filters, workers, callback)
+
         def insert_classes(
             self, mongoclasses: Union[object, List[object]], *args, **kwargs
         ) -> Union[
@@ -616,9 +1412,27 @@ def client_constructor(engine: str, *args, **kwargs):
                 mongoclasses[0]._mongodb_collection,
                 mongoclasses[0]._mongodb_db,
             )
-            insert_result = database[collection].insert_many(
-                [x.as_json() for x in mongoclasses], *args, **kwargs
+            documents = [x.as_json() for x in mongoclasses]
+            insert_result = database[collection].insert_many(documents, *args, **kwargs)
+            self.forget_missing(
+                database.name,
+                collection,
+                [
+                    {"_id": _id, **document}
+                    for _id, document in zip(insert_result.inserted_ids, documents)
+                ],
             )
+
+            for listener in self.get_write_listeners(database.name, collection):
+                listener.on_upsert(
+                    database.name,
+                    collection,
+                    [
+                        {"_id": _id, **document}
+                        for _id, document in zip(insert_result.inserted_ids, documents)
+                    ],
+                )
+
             if kwargs.get("ordered"):
                 return insert_result
 
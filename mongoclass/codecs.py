@@ -0,0 +1,153 @@
+import abc
+import zlib
+from typing import Dict, Type
+
+import bson
+from bson import json_util
+
+JSON_OPTIONS = json_util.JSONOptions(
+    json_mode=json_util.JSONMode.RELAXED, tz_aware=False
+)
+
+
+class Codec(abc.ABC):
+
+    """
+    Base class of the codecs used by `MongoclassRedisCache` to turn documents into the payloads stored in Redis and back.
+
+    Subclasses must define a unique `name`, this is the name that gets recorded alongside a cached collection so readers know how to decode it.
+    """
+
+    name = ""
+
+    @abc.abstractmethod
+    def encode(self, document: dict) -> bytes:
+        """
+        Encode a document into a payload.
+
+        Parameters
+        ----------
+        `document` : dict
+            The raw document to encode.
+
+        Returns
+        -------
+        `bytes` :
+            The encoded payload.
+        """
+
+    @abc.abstractmethod
+    def decode(self, payload: bytes) -> dict:
+        """
+        Decode a payload back into a document.
+
+        Parameters
+        ----------
+        `payload` : bytes
+            A payload previously returned by `.encode()`
+
+        Returns
+        -------
+        `dict` :
+            The decoded document.
+        """
+
+
+class JSONCodec(Codec):
+
+    """
+    Encode documents as MongoDB extended JSON (relaxed mode). Unlike plain `json`, this round-trips `ObjectId`, `datetime`, `bytes` and the other BSON types.
+
+    Documents that only contain plain JSON types are encoded like a compact `json.dumps` would. Caches written before codecs existed were laid out differently though, they are rebuilt from their collection the first time they are read or written.
+    """
+
+    name = "json"
+
+    def encode(self, document: dict) -> bytes:
+        return json_util.dumps(
+            document, json_options=JSON_OPTIONS, separators=(",", ":")
+        ).encode()
+
+    def decode(self, payload: bytes) -> dict:
+        return json_util.loads(payload, json_options=JSON_OPTIONS)
+
+
+class BSONCodec(Codec):
+
+    """
+    Encode documents as BSON using the `bson` package that ships with pymongo. This is usually the fastest codec and supports every type MongoDB does.
+    """
+
+    name = "bson"
+
+    def encode(self, document: dict) -> bytes:
+        return bson.encode(document)
+
+    def decode(self, payload: bytes) -> dict:
+        return bson.decode(payload)
+
+
+class ZlibCodec(Codec):
+
+    """
+    Wrap another codec and compress its payloads with zlib once they are larger than `threshold` bytes.
+
+    Every payload is prefixed with a single byte marking whether it was compressed, so small and large payloads can live in the same cache.
+
+    Parameters
+    ----------
+    `codec` : Codec
+        The codec used to encode the documents before compressing them.
+    `threshold` : int
+        The minimum size in bytes a payload must have before it gets compressed. Defaults to 1024.
+    `level` : int
+        The zlib compression level. Defaults to 6.
+    """
+
+    RAW = b"\x00"
+    COMPRESSED = b"\x01"
+
+    def __init__(self, codec: Codec, threshold: int = 1024, level: int = 6) -> None:
+        self.codec = codec
+        self.threshold = threshold
+        self.level = level
+        self.name = f"zlib+{codec.name}"
+
+    def encode(self, document: dict) -> bytes:
+        payload = self.codec.encode(document)
+        if len(payload) < self.threshold:
+            return self.RAW + payload
+        return self.COMPRESSED + zlib.compress(payload, self.level)
+
+    def decode(self, payload: bytes) -> dict:
+        marker, data = payload[:1], payload[1:]
+        if marker == self.COMPRESSED:
+            data = zlib.decompress(data)
+        return self.codec.decode(data)
+
+
+CODECS: Dict[str, Type[Codec]] = {JSONCodec.name: JSONCodec, BSONCodec.name: BSONCodec}
+
+
+def get_codec(name: str) -> Codec:
+    """
+    Get a codec from the name it was recorded with.
+
+    Parameters
+    ----------
+    `name` : str
+        The name of the codec, for example `"bson"` or `"zlib+json"`.
+
+    Returns
+    -------
+    `Codec` :
+        A codec able to decode payloads written by the codec with that name.
+    """
+
+    if name.startswith("zlib+"):
+        return ZlibCodec(get_codec(name[len("zlib+") :]))
+
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown codec '{name}'") from None
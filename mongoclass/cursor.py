@@ -1,7 +1,18 @@
-from typing import Callable, Union
+import array
+import csv
+import datetime
+import io
+import itertools
+import time
+import typing
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Union
 
 import mongita.cursor
 import pymongo.cursor
+from bson import json_util
+
+from .codecs import JSON_OPTIONS
+from .pagination import get_field
 
 
 class Cursor:
@@ -12,6 +23,8 @@ class Cursor:
         collection_name: str,
         database_name: str,
         engine_used: str,
+        profile: Optional[Callable[[float], None]] = None,
+        document_class: Optional[type] = None,
     ) -> None:
         self.internal_cursor = cursor
         self.mapping_function = mapping_function
@@ -19,28 +32,341 @@ class Cursor:
         self.database_name = database_name
         self.engine_used = engine_used
 
+        # Called with the time spent fetching documents once the cursor is exhausted
+        self.profile = profile
+
+        # The dataclass the documents are mapped into, its annotations type columns
+        self.document_class = document_class
+
+        # The skip and limit given so far, to turn indexes and slices into new ones
+        self._skip = 0
+        self._limit = 0
+
+        # Mongita skips before filtering unsorted queries, so its slices skip here
+        self._offset = 0
+        self._empty = False
+
     def map_data(self, data: dict):
         return self.mapping_function(data, self.collection_name, self.database_name)
 
     def __iter__(self):
-        for data in self.internal_cursor:
+        for data in self._documents():
             yield self.map_data(data)
 
+    def _documents(self) -> Iterator[dict]:
+        if self._empty:
+            return
+
+        documents = itertools.islice(self.internal_cursor, self._offset, None)
+        if self.profile is None:
+            yield from documents
+            return
+
+        elapsed = 0.0
+        while True:
+            started = time.monotonic()
+            data = next(documents, None)
+            elapsed += time.monotonic() - started
+            if data is None:
+                self.profile(elapsed)
+                return
+            yield data
+
     def __next__(self):
+        if self._empty:
+            raise StopIteration
+
+        while self._offset:
+            next(self.internal_cursor)
+            self._offset -= 1
+
         data = next(self.internal_cursor)
         return self.map_data(data)
 
     def __getitem__(self, index):
-        return self.internal_cursor[index]
+        """
+        Get the mongoclass at `index`, or a new cursor of the mongoclasses in a slice. Both are turned into a skip and limit, so only the documents asked for are fetched.
+        """
+
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("Cursor slices don't support steps")
+            start = index.start or 0
+            if start < 0 or (index.stop is not None and index.stop < 0):
+                raise IndexError("Cursor slices can't be negative")
+            return self._slice(start, index.stop)
+
+        if index < 0:
+            raise IndexError("Cursor indexes can't be negative")
+
+        for item in self._slice(index, index + 1):
+            return item
+        raise IndexError("Cursor index out of range")
+
+    def _slice(self, start: int, stop: Optional[int]) -> "Cursor":
+        if self._limit:
+            stop = self._limit if stop is None else min(stop, self._limit)
+
+        cursor = self.clone()
+        cursor._skip = self._skip + start
+        cursor._limit = 0 if stop is None else stop - start
+        if stop is not None and stop <= start:
+            cursor._empty = True
+        elif self.engine_used == "pymongo":
+            cursor.internal_cursor = cursor.internal_cursor.skip(cursor._skip).limit(
+                cursor._limit
+            )
+        else:
+            cursor._offset = cursor._skip
+            cursor.internal_cursor = cursor.internal_cursor.skip(0)
+            if cursor._limit:
+                cursor.internal_cursor = cursor.internal_cursor.limit(
+                    cursor._skip + cursor._limit
+                )
+        return cursor
+
+    def first(self):
+        """
+        Get the first mongoclass of the cursor, or None if it's empty. Only a single document is fetched.
+        """
+
+        for item in self._slice(0, 1):
+            return item
+        return None
+
+    def one(self):
+        """
+        Get the only mongoclass of the cursor. Raises a ValueError if it has none or more than one.
+        """
+
+        items = list(self._slice(0, 2))
+        if len(items) != 1:
+            found = "more than one" if items else "none"
+            raise ValueError(f"Expected one document, found {found}")
+        return items[0]
+
+    def explain(self) -> dict:
+        """
+        Get the query plan of the cursor, to check which indexes it uses. Only supported by the pymongo engine.
+        """
+
+        if self.engine_used != "pymongo":
+            raise ValueError("explain() is only supported by the pymongo engine")
+        return self.internal_cursor.explain()
+
+    def export_jsonl(
+        self,
+        fp: IO,
+        buffer_size: int = 1 << 16,
+        batch_size: Optional[int] = None,
+    ) -> int:
+        """
+        Write the raw documents of the cursor to a file as JSON lines, in MongoDB extended JSON (relaxed mode) so `ObjectId`, `datetime` and the other BSON types round-trip. Documents are streamed from the driver without being mapped into mongoclasses, and written in chunks, so memory use doesn't grow with the number of documents.
+
+        Parameters
+        ----------
+        `fp` : IO
+            The file-like object to write to, either text or binary. Binary files get UTF-8.
+        `buffer_size` : int
+            How many characters to buffer before writing them. Defaults to 64KiB.
+        `batch_size` : int
+            How many documents each batch fetched from the server holds, only used by pymongo. Defaults to None which means the driver default.
+
+        Returns
+        -------
+        `int` :
+            The number of exported documents.
+        """
+
+        write = self._get_writer(fp)
+        self._set_batch_size(batch_size)
+
+        count = 0
+        chunk: List[str] = []
+        buffered = 0
+        for data in self._documents():
+            line = json_util.dumps(data, json_options=JSON_OPTIONS) + "\n"
+            chunk.append(line)
+            buffered += len(line)
+            count += 1
+            if buffered >= buffer_size:
+                write("".join(chunk))
+                chunk.clear()
+                buffered = 0
+
+        if chunk:
+            write("".join(chunk))
+        return count
+
+    def export_csv(
+        self,
+        fp: IO,
+        fields: Optional[List[str]] = None,
+        buffer_size: int = 1 << 16,
+        batch_size: Optional[int] = None,
+    ) -> int:
+        """
+        Write fields of the raw documents of the cursor to a file as CSV, with a header row. Documents are streamed from the driver without being mapped into mongoclasses, and written in chunks, so memory use doesn't grow with the number of documents.
+
+        Missing values are written as empty cells, `ObjectId` as their hex string, `datetime` in ISO 8601 and embedded documents and arrays in MongoDB extended JSON.
+
+        Parameters
+        ----------
+        `fp` : IO
+            The file-like object to write to, either text or binary. Binary files get UTF-8. Text files should be opened with `newline=""`, as for `csv.writer`.
+        `fields` : List[str]
+            The (dotted) fields to export, in order. Defaults to None which means the fields of the first document.
+        `buffer_size` : int
+            How many characters to buffer before writing them. Defaults to 64KiB.
+        `batch_size` : int
+            How many documents each batch fetched from the server holds, only used by pymongo. Defaults to None which means the driver default.
+
+        Returns
+        -------
+        `int` :
+            The number of exported documents.
+        """
+
+        write = self._get_writer(fp)
+        self._set_batch_size(batch_size)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        count = 0
+        for data in self._documents():
+            if fields is None:
+                fields = list(data)
+            if count == 0:
+                writer.writerow(fields)
+
+            writer.writerow([_format_csv_value(get_field(data, x)) for x in fields])
+            count += 1
+            if buffer.tell() >= buffer_size:
+                write(buffer.getvalue())
+                buffer.seek(0)
+                buffer.truncate()
+
+        if count == 0 and fields is not None:
+            writer.writerow(fields)
+        if buffer.tell():
+            write(buffer.getvalue())
+        return count
+
+    def to_columns(
+        self,
+        fields: List[str],
+        output: str = "list",
+        batch_size: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Get fields of the raw documents of the cursor as columns, one per field, without building a mongoclass per document. Meant for analytics over many documents, such as the `x`, `y` and `z` of positions.
+
+        With `array` and `numpy`, the columns of the fields annotated as `int`, `float` or `bool` on the mongoclass are typed: `array.array` of `q`, `d` or `b`, or NumPy arrays of `int64`, `float64` or `bool`. `Optional[int]` and `Optional[float]` fields are `float` columns, with NaN for missing values. Missing values in `int` and `bool` columns raise a ValueError. Other fields are lists, or NumPy arrays of objects.
+
+        Parameters
+        ----------
+        `fields` : List[str]
+            The (dotted) fields to extract.
+        `output` : str
+            `list` for lists, `array` for typed `array.array` columns or `numpy` for NumPy arrays, NumPy having to be installed. Defaults to `list`.
+        `batch_size` : int
+            How many documents each batch fetched from the server holds, only used by pymongo. Defaults to None which means the driver default.
+
+        Returns
+        -------
+        `Dict[str, Any]` :
+            The column of every field.
+        """
+
+        if output not in ("list", "array", "numpy"):
+            raise ValueError(f"Invalid output '{output}'")
+        numpy = None
+        if output == "numpy":
+            try:
+                import numpy  # pylint:disable=import-outside-toplevel
+            except ImportError as e:
+                raise ValueError("to_columns(output='numpy') needs numpy") from e
+
+        typecodes = {}
+        if output != "list":
+            typecodes = _get_typecodes(self.document_class, fields)
+
+        columns = {
+            x: array.array(typecodes[x]) if x in typecodes else [] for x in fields
+        }
+        getters = [
+            (
+                columns[x].append,
+                x,
+                "." in x,
+                typecodes.get(x) == "d",
+            )
+            for x in fields
+        ]
+
+        self._set_batch_size(batch_size)
+        nan = float("nan")
+        for data in self._documents():
+            for append, field, dotted, nullable in getters:
+                value = get_field(data, field) if dotted else data.get(field)
+                if value is None and nullable:
+                    value = nan
+                try:
+                    append(value)
+                except TypeError as e:
+                    raise ValueError(
+                        f"Field '{field}' has the value {value!r} in document "
+                        f"{data.get('_id')!r}, which doesn't fit its column"
+                    ) from e
+
+        if numpy is not None:
+            for field, column in columns.items():
+                if field not in typecodes:
+                    # Filled one by one so lists stay values instead of dimensions
+                    columns[field] = numpy.empty(len(column), dtype=object)
+                    for i, value in enumerate(column):
+                        columns[field][i] = value
+                elif typecodes[field] == "b":
+                    columns[field] = numpy.frombuffer(column, dtype=numpy.int8).astype(
+                        bool
+                    )
+                else:
+                    columns[field] = numpy.frombuffer(
+                        column,
+                        dtype=numpy.int64 if typecodes[field] == "q" else numpy.float64,
+                    )
+        return columns
+
+    @staticmethod
+    def _get_writer(fp: IO) -> Callable[[str], None]:
+        # Anything that isn't known to be binary is written to as text, such as
+        # the wrappers of tempfile
+        mode = getattr(fp, "mode", "")
+        if isinstance(fp, (io.RawIOBase, io.BufferedIOBase)) or (
+            isinstance(mode, str) and "b" in mode
+        ):
+            return lambda text: fp.write(text.encode("utf-8"))
+        return fp.write
+
+    def _set_batch_size(self, batch_size: Optional[int]) -> None:
+        if batch_size is not None and self.engine_used == "pymongo":
+            self.internal_cursor = self.internal_cursor.batch_size(batch_size)
 
     def clone(self):
-        return Cursor(
+        cursor = Cursor(
             self.internal_cursor.clone(),
             self.mapping_function,
             self.collection_name,
             self.database_name,
             self.engine_used,
+            self.profile,
+            self.document_class,
         )
+        cursor._skip = self._skip
+        cursor._limit = self._limit
+        cursor._offset = self._offset
+        cursor._empty = self._empty
+        return cursor
 
     def close(self):
         self.internal_cursor.close()
@@ -51,10 +377,12 @@ class Cursor:
 
     def limit(self, limit):
         self.internal_cursor = self.internal_cursor.limit(limit)
+        self._limit = limit
         return self
 
     def skip(self, skip):
         self.internal_cursor = self.internal_cursor.skip(skip)
+        self._skip = skip
         return self
 
     def max(self, spec):
@@ -68,3 +396,38 @@ class Cursor:
     def where(self, code):
         self.internal_cursor = self.internal_cursor.where(code)
         return self
+
+
+def _format_csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json_util.dumps(value, json_options=JSON_OPTIONS)
+    # ObjectId, numbers and booleans
+    return str(value)
+
+
+def _get_typecodes(cls: Optional[type], fields: List[str]) -> Dict[str, str]:
+    # The array typecodes of the fields annotated with a number type
+    if cls is None:
+        return {}
+    try:
+        hints = typing.get_type_hints(cls)
+    except Exception:  # pylint:disable=broad-except
+        hints = getattr(cls, "__annotations__", {})
+
+    typecodes = {}
+    for field in fields:
+        annotation = hints.get(field)
+        if annotation in (Optional[float], Optional[int]) or annotation is float:
+            # Missing values are NaN, which only floats have
+            typecodes[field] = "d"
+        elif annotation is bool:
+            typecodes[field] = "b"
+        elif annotation is int:
+            typecodes[field] = "q"
+    return typecodes
@@ -0,0 +1,88 @@
+import dataclasses
+import threading
+import typing
+from typing import Any, Callable, Dict
+
+# The compiled hydrators, see `get_hydrator()`
+HYDRATORS: Dict[type, Callable[[dict], Any]] = {}
+_lock = threading.Lock()
+
+
+def get_hydrator(cls: type) -> Callable[[dict], Any]:
+    """
+    Get the function turning a raw document into an instance of the dataclass `cls`, compiled on first use.
+
+    The hydrator is generated source code calling the constructor with every field read straight from the document, so no field lookups happen per document. Keys that aren't fields are ignored, missing fields take their default and a missing field without default raises a ValueError. Fields annotated with a dataclass, or a list of them, are hydrated as well. When `cls` is a mongoclass, `_id` becomes its `_mongodb_id`.
+    """
+
+    hydrator = HYDRATORS.get(cls)
+    if hydrator is None:
+        with _lock:
+            hydrator = HYDRATORS.get(cls)
+            if hydrator is None:
+                hydrator = HYDRATORS[cls] = compile_hydrator(cls)
+    return hydrator
+
+
+def _hydrate(cls: type, value: Any) -> Any:
+    # Anything but a document (None, an already built object...) is kept as is
+    if isinstance(value, dict):
+        # Nested mongoclasses are stored with their data under "data"
+        if "_nest_collection" in value:
+            value = value["data"]
+        return get_hydrator(cls)(value)
+    return value
+
+
+def _get_type_hints(cls: type) -> Dict[str, Any]:
+    try:
+        return typing.get_type_hints(cls)
+    except Exception:  # pylint:disable=broad-except
+        # Unresolvable forward references, nested dataclasses stay raw
+        return {}
+
+
+def compile_hydrator(cls: type) -> Callable[[dict], Any]:
+    if not dataclasses.is_dataclass(cls):
+        raise ValueError(f"Can't hydrate {cls!r}, it isn't a dataclass")
+
+    hints = _get_type_hints(cls)
+    namespace = {"cls": cls, "hydrate": _hydrate}
+    arguments = []
+    for i, field in enumerate(dataclasses.fields(cls)):
+        if not field.init:
+            continue
+
+        if field.default is not dataclasses.MISSING:
+            namespace[f"default_{i}"] = field.default
+            value = f"doc.get({field.name!r}, default_{i})"
+        elif field.default_factory is not dataclasses.MISSING:
+            namespace[f"factory_{i}"] = field.default_factory
+            value = f"doc[{field.name!r}] if {field.name!r} in doc else factory_{i}()"
+        else:
+            value = f"doc[{field.name!r}]"
+
+        annotation = hints.get(field.name)
+        if typing.get_origin(annotation) is list:
+            annotation = (typing.get_args(annotation) or [None])[0]
+            if dataclasses.is_dataclass(annotation):
+                namespace[f"type_{i}"] = annotation
+                value = f"[hydrate(type_{i}, x) for x in ({value}) or []]"
+        elif dataclasses.is_dataclass(annotation):
+            namespace[f"type_{i}"] = annotation
+            value = f"hydrate(type_{i}, {value})"
+        arguments.append(f"{field.name}=({value})")
+
+    # Mongoclasses keep the _id of their document
+    if hasattr(cls, "COLLECTION_NAME"):
+        arguments.append('_mongodb_id=doc.get("_id")')
+
+    source = (
+        "def hydrate_document(doc):\n"
+        "    try:\n"
+        f"        return cls({', '.join(arguments)})\n"
+        "    except KeyError as e:\n"
+        f"        raise ValueError(f'Missing field {{e}} to build {cls.__name__}') from e\n"
+    )
+    exec(source, namespace)  # pylint:disable=exec-used
+    return namespace["hydrate_document"]
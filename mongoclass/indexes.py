@@ -0,0 +1,212 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pymongo import IndexModel
+
+logger = logging.getLogger(__name__)
+
+Keys = List[Tuple[str, Any]]
+
+
+def normalize_keys(keys: Union[str, Keys]) -> Keys:
+    """
+    Get the keys of an index as a list of `(field, direction)`, a single field name being an ascending index on it.
+    """
+
+    if isinstance(keys, str):
+        keys = [(keys, 1)]
+
+    normalized = []
+    for key in keys:
+        field, direction = (key, 1) if isinstance(key, str) else key
+        # Servers report the directions of some indexes as floats
+        if isinstance(direction, float) and direction.is_integer():
+            direction = int(direction)
+        normalized.append((field, direction))
+
+    if not normalized:
+        raise ValueError("An index needs at least one key")
+    return normalized
+
+
+class Index:
+
+    """
+    An index declared on a mongoclass with `@client.mongoclass(indexes=[...])`, created by `MongoClassClient.ensure_indexes()`. Plain field names and lists of `(field, direction)` can be declared as well, for ascending and compound indexes without options.
+
+    Parameters
+    ----------
+    `keys` : Union[str, List[Tuple[str, Any]]]
+        The field of the index, or its `(field, direction)` pairs for a compound index.
+    `unique` : bool
+        Reject documents with the same values as another one. Defaults to False.
+    `sparse` : bool
+        Only index the documents that have the indexed fields. Defaults to False.
+    `expire_after` : int
+        Make this a TTL index, removing documents this many seconds after the date in the indexed field. Defaults to None.
+    `name` : str
+        The name of the index. Defaults to the name MongoDB would give it, such as `email_1`.
+    """
+
+    def __init__(
+        self,
+        keys: Union[str, Keys],
+        unique: bool = False,
+        sparse: bool = False,
+        expire_after: Optional[int] = None,
+        name: Optional[str] = None,
+    ) -> None:
+        self.keys = normalize_keys(keys)
+        self.unique = unique
+        self.sparse = sparse
+        self.expire_after = expire_after
+        self.name = name or "_".join(f"{k}_{d}" for k, d in self.keys)
+
+        if expire_after is not None and len(self.keys) > 1:
+            raise ValueError("TTL indexes can only have a single key")
+
+    @classmethod
+    def from_spec(cls, spec: Union["Index", str, Keys]) -> "Index":
+        if isinstance(spec, Index):
+            return spec
+        return cls(spec)
+
+    @property
+    def options(self) -> dict:
+        """
+        The options of the index that differ from the defaults, named as in `index_information()`.
+        """
+
+        options = {}
+        if self.unique:
+            options["unique"] = True
+        if self.sparse:
+            options["sparse"] = True
+        if self.expire_after is not None:
+            options["expireAfterSeconds"] = self.expire_after
+        return options
+
+    def to_model(self) -> IndexModel:
+        return IndexModel(self.keys, name=self.name, **self.options)
+
+    def as_dict(self) -> dict:
+        return {"name": self.name, "key": self.keys, **self.options}
+
+
+def get_options(info: dict) -> dict:
+    """
+    Get the options of an existing index from `index_information()`, as in `Index.options`.
+    """
+
+    options = {}
+    if info.get("unique"):
+        options["unique"] = True
+    if info.get("sparse"):
+        options["sparse"] = True
+    if info.get("expireAfterSeconds") is not None:
+        options["expireAfterSeconds"] = info["expireAfterSeconds"]
+    return options
+
+
+def is_emulated(index: Index) -> bool:
+    """
+    Whether mongita can create an index, which it only does for a single ascending or descending key without options.
+    """
+
+    return len(index.keys) == 1 and index.keys[0][1] in (1, -1) and not index.options
+
+
+class IndexReport:
+
+    """
+    What `MongoClassClient.ensure_indexes()` did. Entries are dicts with the `database`, `collection` and `name` of the index.
+
+    Parameters
+    ----------
+    `created` : List[dict]
+        The declared indexes that were missing and got created, or would have been with `dry_run`.
+    `drift` : List[dict]
+        The differences between the declared and the existing indexes that can't be fixed by creating an index, with a `reason`, the `declared` index and the `existing` one. Existing indexes whose keys or options differ from their declaration are `changed` and indexes that exist but weren't declared are `undeclared`. Neither is dropped.
+    `unsupported` : List[dict]
+        The declared indexes the engine can't create, compound, unique, sparse and TTL indexes on mongita.
+    """
+
+    def __init__(self) -> None:
+        self.created: List[dict] = []
+        self.drift: List[dict] = []
+        self.unsupported: List[dict] = []
+
+    def add_drift(
+        self,
+        database: str,
+        collection: str,
+        reason: str,
+        declared: Optional[Index],
+        existing: Optional[Tuple[str, dict]],
+    ) -> None:
+        name = declared.name if declared is not None else existing[0]
+        logger.warning("Index %s on %s.%s is %s", name, database, collection, reason)
+        self.drift.append(
+            {
+                "database": database,
+                "collection": collection,
+                "name": name,
+                "reason": reason,
+                "declared": declared.as_dict() if declared is not None else None,
+                "existing": (
+                    {
+                        "name": existing[0],
+                        "key": normalize_keys(existing[1]["key"]),
+                        **get_options(existing[1]),
+                    }
+                    if existing is not None
+                    else None
+                ),
+            }
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "created": self.created,
+            "drift": self.drift,
+            "unsupported": self.unsupported,
+        }
+
+
+def diff_indexes(
+    database: str,
+    collection: str,
+    declared: List[Index],
+    existing: Dict[str, dict],
+    report: IndexReport,
+) -> List[Index]:
+    """
+    Compare the declared indexes of a collection with its existing ones from `index_information()`, record the drift in `report` and get the indexes that have to be created.
+    """
+
+    existing = {k: v for k, v in existing.items() if k != "_id_"}
+    by_keys = {tuple(normalize_keys(v["key"])): k for k, v in existing.items()}
+
+    missing = []
+    matched = set()
+    for index in declared:
+        name = by_keys.get(tuple(index.keys))
+        if name is None and index.name in existing:
+            name = index.name
+
+        if name is None:
+            missing.append(index)
+            continue
+
+        matched.add(name)
+        info = existing[name]
+        if (
+            normalize_keys(info["key"]) != index.keys
+            or get_options(info) != index.options
+        ):
+            report.add_drift(database, collection, "changed", index, (name, info))
+
+    for name, info in existing.items():
+        if name not in matched:
+            report.add_drift(database, collection, "undeclared", None, (name, info))
+    return missing
@@ -0,0 +1,241 @@
+import contextlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, Generator, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# hook(name, event, value), see `CacheStats.add_hook()`
+Hook = Callable[[str, str, float], None]
+
+
+class CollectionStats:
+
+    """
+    The metrics a `CacheStats` records for a single cached collection.
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.local_hits = 0
+        self.local_misses = 0
+
+        self.lock_waits = 0
+        self.lock_timeouts = 0
+        self.lock_wait_total = 0.0
+        self.lock_wait_max = 0.0
+
+        self.builds = 0
+        self.build_errors = 0
+        self.build_duration_total = 0.0
+        self.last_build_duration: Optional[float] = None
+
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.refresh_duration_total = 0.0
+        self.last_refresh_duration: Optional[float] = None
+
+        self.payloads = 0
+        self.payload_bytes = 0
+        self.max_payload_bytes = 0
+        self.documents: Optional[int] = None
+        self.evictions = 0
+
+    def record(self, event: str, value: float) -> None:
+        if event == "hit":
+            self.hits += 1
+        elif event == "miss":
+            self.misses += 1
+        elif event == "local_hit":
+            self.local_hits += 1
+        elif event == "local_miss":
+            self.local_misses += 1
+        elif event in ("lock_wait", "lock_timeout"):
+            if event == "lock_wait":
+                self.lock_waits += 1
+            else:
+                self.lock_timeouts += 1
+            self.lock_wait_total += value
+            self.lock_wait_max = max(self.lock_wait_max, value)
+        elif event in ("build", "build_error"):
+            self.builds += 1
+            self.build_errors += event == "build_error"
+            self.build_duration_total += value
+            self.last_build_duration = value
+        elif event in ("refresh", "refresh_error"):
+            self.refreshes += 1
+            self.refresh_errors += event == "refresh_error"
+            self.refresh_duration_total += value
+            self.last_refresh_duration = value
+        elif event == "documents":
+            self.documents = int(value)
+        elif event == "evict":
+            self.evictions += int(value)
+        else:
+            raise ValueError(f"Unknown event '{event}'")
+
+    def record_payloads(self, sizes: List[int]) -> None:
+        self.payloads += len(sizes)
+        self.payload_bytes += sum(sizes)
+        self.max_payload_bytes = max(self.max_payload_bytes, *sizes)
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        local_lookups = self.local_hits + self.local_misses
+        acquires = self.lock_waits + self.lock_timeouts
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "local_hits": self.local_hits,
+            "local_misses": self.local_misses,
+            "local_hit_rate": self.local_hits / local_lookups
+            if local_lookups
+            else None,
+            "lock_waits": self.lock_waits,
+            "lock_timeouts": self.lock_timeouts,
+            "average_lock_wait": self.lock_wait_total / acquires if acquires else None,
+            "max_lock_wait": self.lock_wait_max,
+            "builds": self.builds,
+            "build_errors": self.build_errors,
+            "last_build_duration": self.last_build_duration,
+            "average_build_duration": self.build_duration_total / self.builds
+            if self.builds
+            else None,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "last_refresh_duration": self.last_refresh_duration,
+            "average_refresh_duration": self.refresh_duration_total / self.refreshes
+            if self.refreshes
+            else None,
+            "payloads": self.payloads,
+            "payload_bytes": self.payload_bytes,
+            "average_payload_bytes": self.payload_bytes / self.payloads
+            if self.payloads
+            else None,
+            "max_payload_bytes": self.max_payload_bytes,
+            "documents": self.documents,
+            "evictions": self.evictions,
+        }
+
+
+class CacheStats:
+
+    """
+    Hit rates, lock wait times, refresh durations and payload sizes of a Redis cache, recorded per collection.
+
+    The events are:
+
+    - `hit` / `miss`: `get_from_cache()` found / didn't find an object, or `get_by_id()` was / wasn't served from the cache.
+    - `local_hit` / `local_miss`: a collection was / wasn't served from the local cache.
+    - `lock_wait` / `lock_timeout`: seconds spent acquiring / failing to acquire the lock of a collection.
+    - `build` / `build_error`: seconds a `cache()` took / took before failing.
+    - `refresh` / `refresh_error`: seconds a `refresh()` took / took before failing.
+    - `payload_bytes`: bytes of the documents encoded by a single write.
+    - `documents`: how many documents the last `cache()` stored.
+    - `evict`: how many documents of a bounded collection were evicted to stay within its limits.
+    """
+
+    def __init__(self) -> None:
+        self.collections: Dict[str, CollectionStats] = {}
+        self.hooks: List[Hook] = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Hook) -> None:
+        """
+        Call `hook(name, event, value)` every time an event is recorded, `name` being `"database.collection"`. Hooks are called from the thread that recorded the event so they should be fast, exceptions they raise are logged and ignored.
+
+        Parameters
+        ----------
+        `hook` : Callable[[str, str, float], None]
+            The hook to add.
+        """
+
+        with self._lock:
+            self.hooks = [*self.hooks, hook]
+
+    def remove_hook(self, hook: Hook) -> None:
+        with self._lock:
+            self.hooks = [x for x in self.hooks if x is not hook]
+
+    def record(
+        self, database_name: str, collection_name: str, event: str, value: float = 1
+    ) -> None:
+        """
+        Record an event of a collection, see the class docstring for the events.
+        """
+
+        name = f"{database_name}.{collection_name}"
+        with self._lock:
+            self._get(name).record(event, value)
+        self._call_hooks(name, event, value)
+
+    def record_payloads(
+        self, database_name: str, collection_name: str, sizes: Iterable[int]
+    ) -> None:
+        """
+        Record the sizes in bytes of documents that were encoded for a collection.
+        """
+
+        sizes = list(sizes)
+        if not sizes:
+            return
+
+        name = f"{database_name}.{collection_name}"
+        with self._lock:
+            self._get(name).record_payloads(sizes)
+        self._call_hooks(name, "payload_bytes", sum(sizes))
+
+    @contextlib.contextmanager
+    def timed(
+        self, database_name: str, collection_name: str, event: str
+    ) -> Generator[None, None, None]:
+        """
+        Record how long the block took as `event`, or as `{event}_error` if it raised.
+        """
+
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            self.record(
+                database_name,
+                collection_name,
+                f"{event}_error",
+                time.monotonic() - started,
+            )
+            raise
+
+        self.record(database_name, collection_name, event, time.monotonic() - started)
+
+    def as_dict(self) -> Dict[str, dict]:
+        """
+        Export the metrics as a plain dict keyed by `"database.collection"`.
+        """
+
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self.collections.items()}
+
+    def reset(self) -> None:
+        """
+        Forget every recorded metric. Hooks are kept.
+        """
+
+        with self._lock:
+            self.collections = {}
+
+    def _get(self, name: str) -> CollectionStats:
+        stats = self.collections.get(name)
+        if stats is None:
+            stats = self.collections[name] = CollectionStats()
+        return stats
+
+    def _call_hooks(self, name: str, event: str, value: float) -> None:
+        for hook in self.hooks:
+            try:
+                hook(name, event, value)
+            except Exception:  # pylint:disable=broad-except
+                logger.exception("Metrics hook %r failed", hook)
@@ -0,0 +1,223 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from bson import json_util
+
+# Returned by `_get_field()` for fields a document doesn't have, and for fields
+# that can't be looked up without the query engine (through arrays)
+MISSING = object()
+UNKNOWN = object()
+
+
+def may_match(query: dict, document: dict) -> bool:
+    """
+    Whether a raw document may match a `find` query. Only equality conditions are checked, operators and paths through arrays are assumed to match so a document that exists is never reported as not matching.
+
+    Parameters
+    ----------
+    `query` : dict
+        The filter of the query.
+    `document` : dict
+        The raw document.
+
+    Returns
+    -------
+    `bool` :
+        False if the document certainly doesn't match the query.
+    """
+
+    for field, condition in query.items():
+        if field.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(
+            str(x).startswith("$") for x in condition
+        ):
+            continue
+
+        value = _get_field(document, field)
+        if value is UNKNOWN:
+            continue
+        if value is MISSING:
+            if condition is None:
+                continue
+            return False
+        if value == condition or (isinstance(value, list) and condition in value):
+            continue
+        return False
+
+    return True
+
+
+def get_query_term(query: dict) -> Optional[Tuple[str, str]]:
+    """
+    Get an equality condition of a `find` query as a `(field, value)` term, preferring `_id`. Every document the query may match (see `may_match()`) has this term among its `get_document_terms()`, so remembered queries can be looked up by the terms of a written document.
+
+    Parameters
+    ----------
+    `query` : dict
+        The filter of the query.
+
+    Returns
+    -------
+    `Optional[Tuple[str, str]]` :
+        The term, or None if the query has no equality condition on a top level field with a plain value.
+    """
+
+    for field in sorted(query, key=lambda x: x != "_id"):
+        if field.startswith("$") or "." in field:
+            continue
+
+        value = _get_term_value(query[field])
+        if value is not None:
+            return field, value
+    return None
+
+
+def get_document_terms(document: dict) -> Set[Tuple[str, str]]:
+    """
+    Get the `(field, value)` terms of the top level fields of a raw document, and of the items of its top level arrays.
+    """
+
+    terms = set()
+    for field, value in document.items():
+        for item in value if isinstance(value, list) else [value]:
+            item = _get_term_value(item)
+            if item is not None:
+                terms.add((field, item))
+    return terms
+
+
+def _get_term_value(value: Any) -> Optional[str]:
+    # Conditions on None, documents and arrays may match in other ways than equality
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return json_util.dumps(value)
+
+
+def _get_field(document: dict, path: str) -> Any:
+    value = document
+    for part in path.split("."):
+        if isinstance(value, list):
+            return UNKNOWN
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+
+class NegativeCache:
+
+    """
+    Remember for a short while which `find_class` queries found nothing, so looking up the same missing document over and over (retries, bots probing ids) doesn't query the database every time. Pass it to the client as `negative_cache`.
+
+    The remembered queries of a collection are forgotten as soon as a document that may match them is inserted or updated through mongoclass. Writes made elsewhere are only seen once the queries expire, keep `ttl` short.
+
+    Parameters
+    ----------
+    `ttl` : float
+        How long in seconds a query that found nothing is remembered. Defaults to 5.
+    `max_entries` : int
+        How many queries to remember per collection, the least recently used ones are forgotten first. Defaults to 10000.
+    """
+
+    def __init__(self, ttl: float = 5, max_entries: int = 10000) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[Tuple[str, str], OrderedDict] = {}
+        self._generations: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def generation(self, database: str, collection: str) -> int:
+        """
+        Get the generation of a collection, which changes every time the collection is invalidated. Take it before running a query and pass it to `.add()`, so a miss that raced with a write isn't remembered.
+        """
+
+        with self._lock:
+            return self._generations.get((database, collection), 0)
+
+    def lookup(self, database: str, collection: str, key: str) -> Tuple[bool, int]:
+        """
+        Get both `.contains()` and `.generation()` at once.
+        """
+
+        return (
+            self.contains(database, collection, key),
+            self.generation(database, collection),
+        )
+
+    def contains(self, database: str, collection: str, key: str) -> bool:
+        """
+        Whether the query `key` of a collection is remembered to find nothing.
+        """
+
+        with self._lock:
+            entries = self._entries.get((database, collection))
+            entry = entries.get(key) if entries is not None else None
+            if entry is None:
+                return False
+
+            if entry[0] <= time.monotonic():
+                del entries[key]
+                return False
+
+            entries.move_to_end(key)
+            return True
+
+    def add(
+        self, database: str, collection: str, key: str, query: dict, generation: int
+    ) -> bool:
+        """
+        Remember that the query `key` of a collection, filtering with `query`, found nothing.
+
+        Returns
+        -------
+        `bool` :
+            Whether it was remembered, which it isn't if the collection was invalidated since `generation` was taken.
+        """
+
+        name = (database, collection)
+        with self._lock:
+            if self._generations.get(name, 0) != generation:
+                return False
+
+            entries = self._entries.setdefault(name, OrderedDict())
+            entries[key] = (time.monotonic() + self.ttl, query)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            return True
+
+    def invalidate(
+        self, database: str, collection: str, documents: Iterable[dict]
+    ) -> int:
+        """
+        Forget the queries of a collection that the written raw `documents` may match.
+
+        Returns
+        -------
+        `int` :
+            How many queries were forgotten.
+        """
+
+        documents = list(documents)
+        name = (database, collection)
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+            entries = self._entries.get(name, {})
+            forgotten = [
+                key
+                for key, (_, query) in entries.items()
+                if any(may_match(query, x) for x in documents)
+            ]
+            for key in forgotten:
+                del entries[key]
+            return len(forgotten)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+            self._generations = {}
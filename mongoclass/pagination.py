@@ -0,0 +1,147 @@
+import base64
+import binascii
+from typing import Any, Iterator, List, Optional, Tuple
+
+from bson import json_util
+
+from .codecs import JSON_OPTIONS
+
+Sort = List[Tuple[str, int]]
+
+
+class Page:
+
+    """
+    A page of mongoclasses, as returned by `paginate_after()` and `paginate(with_total=True)`.
+
+    Parameters
+    ----------
+    `items` : List[object]
+        The mongoclasses of the page.
+    `next_token` : str
+        The token of the next page, to be passed as `after`. None on the last page.
+    `previous_token` : str
+        The token of the previous page, to be passed as `after`. None on the first page.
+    `total` : int
+        How many documents match the query in total, if counted.
+    `exact_total` : bool
+        Whether `total` was counted exactly or estimated.
+    """
+
+    def __init__(
+        self,
+        items: List[object],
+        next_token: Optional[str] = None,
+        previous_token: Optional[str] = None,
+        total: Optional[int] = None,
+        exact_total: bool = True,
+    ) -> None:
+        self.items = items
+        self.next_token = next_token
+        self.previous_token = previous_token
+        self.total = total
+        self.exact_total = exact_total
+
+    def __iter__(self) -> Iterator[object]:
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def as_dict(self) -> dict:
+        return {
+            "items": self.items,
+            "next_token": self.next_token,
+            "previous_token": self.previous_token,
+            "total": self.total,
+            "exact_total": self.exact_total,
+        }
+
+
+def normalize_sort(sort: Optional[Sort]) -> Sort:
+    """
+    Get the sort of a keyset pagination, which always ends with `_id` so every document has a unique position.
+    """
+
+    sort = [(key, direction) for key, direction in (sort or [])]
+    for _, direction in sort:
+        if direction not in (1, -1):
+            raise ValueError("Sort directions must be 1 or -1")
+    if "_id" not in [key for key, _ in sort]:
+        sort.append(("_id", 1))
+    return sort
+
+
+def encode_token(sort: Sort, document: dict, backwards: bool) -> str:
+    """
+    Get the opaque token of the position of a raw document in a sort.
+    """
+
+    payload = {
+        "sort": sort,
+        "values": [get_field(document, key) for key, _ in sort],
+        "backwards": backwards,
+    }
+    data = json_util.dumps(payload, json_options=JSON_OPTIONS, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_token(token: str, sort: Sort) -> Tuple[List[Any], bool]:
+    """
+    Get the sort values and the direction of a token from `encode_token()`.
+    """
+
+    try:
+        data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json_util.loads(data, json_options=JSON_OPTIONS)
+        token_sort = [(key, direction) for key, direction in payload["sort"]]
+        values, backwards = payload["values"], payload["backwards"]
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid pagination token") from e
+
+    if token_sort != sort:
+        raise ValueError("The pagination token was made for another sort")
+    return values, backwards
+
+
+def get_field(document: dict, path: str) -> Any:
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def seek_filter(sort: Sort, values: List[Any], backwards: bool) -> dict:
+    """
+    Get the filter selecting the documents after the position `values` in `sort`, or before it if `backwards`.
+    """
+
+    clauses = []
+    for i, (key, direction) in enumerate(sort):
+        clause = {k: v for (k, _), v in zip(sort[:i], values[:i])}
+        clause[key] = {"$gt" if (direction == 1) != backwards else "$lt": values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def is_after(
+    sort: Sort, document: dict, values: List[Any], backwards: bool = False
+) -> bool:
+    """
+    Whether a raw document comes after the position `values` in `sort`, or before it if `backwards`. Used where the engine can't run `seek_filter()`.
+    """
+
+    for (key, direction), value in zip(sort, values):
+        current = get_field(document, key)
+        if current == value:
+            continue
+
+        # Missing values sort first, as they do in MongoDB
+        greater = (current is not None, current) > (value is not None, value)
+        return greater == ((direction == 1) != backwards)
+    return False
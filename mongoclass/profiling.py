@@ -0,0 +1,184 @@
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# hook(slow_query), see `SlowQueryLog.add_hook()`
+Hook = Callable[["SlowQuery"], None]
+
+
+def query_shape(query: Any) -> Any:
+    """
+    Get the shape of a query, the query with every value replaced by `"?"`. Queries that only differ by their values have the same shape, and no data ends up in the logs.
+
+    >>> query_shape({"age": {"$gt": 30}, "$or": [{"country": "PH"}, {"vip": True}]})
+    {'age': {'$gt': '?'}, '$or': [{'country': '?'}, {'vip': '?'}]}
+    """
+
+    if isinstance(query, dict):
+        return {k: query_shape(v) for k, v in query.items()}
+    if isinstance(query, list) and query and all(isinstance(x, dict) for x in query):
+        return [query_shape(x) for x in query]
+    return "?"
+
+
+class SlowQuery:
+
+    """
+    A query recorded by a `SlowQueryLog`.
+    """
+
+    def __init__(
+        self,
+        operation: str,
+        database_name: str,
+        collection_name: str,
+        class_name: Optional[str],
+        shape: Any,
+        duration: float,
+        explain: Optional[dict] = None,
+    ) -> None:
+        self.operation = operation
+        self.database_name = database_name
+        self.collection_name = collection_name
+        self.class_name = class_name
+        self.shape = shape
+        self.duration = duration
+        self.explain = explain
+
+    def as_dict(self) -> dict:
+        return {
+            "operation": self.operation,
+            "database": self.database_name,
+            "collection": self.collection_name,
+            "class": self.class_name,
+            "shape": self.shape,
+            "duration": self.duration,
+            "explain": self.explain,
+        }
+
+
+class SlowQueryLog:
+
+    """
+    Record the queries of a client that take longer than a threshold, to spot missing indexes before they turn into latency incidents. Pass it to the client as `slow_query_log`.
+
+    `find_class`, `find_classes`, `count_documents`, `aggregate` and `paginate` are timed. Cursors are timed while they are fetching documents, and recorded once they are exhausted. Every slow query is logged as a warning and kept in `.entries`.
+
+    Parameters
+    ----------
+    `threshold` : float
+        The duration in seconds above which a query is recorded. Defaults to 0.1.
+    `explain` : bool
+        Also record the query plan of slow queries, which runs an `explain` command for each of them. Only supported by the pymongo engine, mongita queries are timed only. Defaults to False.
+    `max_entries` : int
+        How many slow queries to keep, the oldest ones are dropped first. Defaults to 100.
+    """
+
+    def __init__(
+        self, threshold: float = 0.1, explain: bool = False, max_entries: int = 100
+    ) -> None:
+        self.threshold = threshold
+        self.explain = explain
+        self.entries: deque = deque(maxlen=max_entries)
+        self.hooks: List[Hook] = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Hook) -> None:
+        """
+        Call `hook(slow_query)` every time a slow query is recorded. Hooks are called from the thread that ran the query, exceptions they raise are logged and ignored.
+        """
+
+        with self._lock:
+            self.hooks = [*self.hooks, hook]
+
+    def remove_hook(self, hook: Hook) -> None:
+        with self._lock:
+            self.hooks = [x for x in self.hooks if x is not hook]
+
+    def record(
+        self,
+        operation: str,
+        database_name: str,
+        collection_name: str,
+        class_name: Optional[str],
+        query: Any,
+        duration: float,
+        explain: Optional[Callable[[], dict]] = None,
+    ) -> Optional[SlowQuery]:
+        """
+        Record a query if it's slower than the threshold.
+
+        Parameters
+        ----------
+        `operation` : str
+            What ran the query, `find_class` for example.
+        `database_name` : str
+            The database of the query.
+        `collection_name` : str
+            The collection of the query.
+        `class_name` : str
+            The name of the mongoclass of the collection, if any.
+        `query` : Any
+            The filter or pipeline of the query, only its shape is kept.
+        `duration` : float
+            How long the query took in seconds.
+        `explain` : Callable[[], dict]
+            Get the query plan, only called if the query is slow and `explain` is set.
+
+        Returns
+        -------
+        `Optional[SlowQuery]` :
+            The recorded query, None if it wasn't slow.
+        """
+
+        if duration < self.threshold:
+            return None
+
+        plan = None
+        if self.explain and explain is not None:
+            try:
+                plan = explain()
+            except Exception:  # pylint:disable=broad-except
+                logger.exception("Explaining a slow %s failed", operation)
+
+        entry = SlowQuery(
+            operation,
+            database_name,
+            collection_name,
+            class_name,
+            query_shape(query if query is not None else {}),
+            duration,
+            plan,
+        )
+        with self._lock:
+            self.entries.append(entry)
+
+        logger.warning(
+            "Slow %s on %s.%s took %.3fs: %s",
+            operation,
+            database_name,
+            collection_name,
+            duration,
+            entry.shape,
+        )
+        for hook in self.hooks:
+            try:
+                hook(entry)
+            except Exception:  # pylint:disable=broad-except
+                logger.exception("Slow query hook %r failed", hook)
+        return entry
+
+    def as_list(self) -> List[dict]:
+        """
+        Export the recorded slow queries as plain dicts, oldest first.
+        """
+
+        with self._lock:
+            return [x.as_dict() for x in self.entries]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
@@ -0,0 +1,394 @@
+import abc
+import dataclasses
+import typing
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+
+def _matches_type(annotation: Any, value: Any) -> bool:
+    # Only plain classes, Optional/Union and generic containers are checked, any
+    # other annotation (forward references, TypeVars...) accepts everything
+    if value is None or annotation is Any:
+        return True
+
+    origin = typing.get_origin(annotation)
+    if origin is Union:
+        return any(_matches_type(x, value) for x in typing.get_args(annotation))
+    if origin is not None:
+        if origin in (list, set, frozenset, tuple):
+            # Equality on an array field matches the arrays containing the value
+            args = typing.get_args(annotation)
+            return isinstance(value, origin) or bool(
+                args and _matches_type(args[0], value)
+            )
+        return not isinstance(origin, type) or isinstance(value, origin)
+
+    if annotation is float:
+        return isinstance(value, (int, float))
+    if isinstance(annotation, type):
+        return isinstance(value, annotation)
+    return True
+
+
+class Param:
+
+    """
+    A placeholder for a value given when a `CompiledQuery` is called.
+
+    >>> query = (User.q.age > Param("min_age")).compile()
+    >>> User.find_classes(query(min_age=30))
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"Param({self.name!r})"
+
+
+class Expression(abc.ABC):
+
+    """
+    Base class of the query expressions built from `Field`. Combine expressions with `&` (and), `|` (or) and `~` (nor). As `&` and `|` bind tighter than comparisons, wrap comparisons in parentheses: `(User.q.age > 30) & (User.q.country == "PH")`.
+    """
+
+    def __and__(self, other: "Expression") -> "Expression":
+        return And([*_flatten(self, And), *_flatten(other, And)])
+
+    def __or__(self, other: "Expression") -> "Expression":
+        return Or([*_flatten(self, Or), *_flatten(other, Or)])
+
+    def __invert__(self) -> "Expression":
+        return Not(self)
+
+    def __bool__(self) -> bool:
+        raise TypeError("Combine query expressions with & and | instead of and/or")
+
+    @abc.abstractmethod
+    def to_filter(self) -> dict:
+        """
+        Get the Mongo filter of the expression. Parameters are left in as `Param` objects, use `.compile()` for expressions with parameters.
+        """
+
+    @abc.abstractmethod
+    def conditions(self) -> List["Condition"]:
+        """
+        Get the conditions the expression is made of.
+        """
+
+    def compile(self) -> "CompiledQuery":
+        """
+        Compile the expression into a query that builds its filter for given parameter values, see `CompiledQuery`.
+        """
+
+        return CompiledQuery(self)
+
+
+def _flatten(expression: Expression, kind: type) -> List[Expression]:
+    if not isinstance(expression, Expression):
+        raise TypeError(f"Can't combine a query expression with {expression!r}")
+    if isinstance(expression, kind):
+        return expression.expressions
+    return [expression]
+
+
+class Condition(Expression):
+
+    """
+    A condition on a single field, such as `User.q.age > 30`.
+    """
+
+    def __init__(self, field: "Field", operator: Optional[str], value: Any) -> None:
+        self.field = field
+        self.operator = operator
+        self.value = value
+
+        if not isinstance(value, Param):
+            field.check(operator, value)
+
+    def to_filter(self) -> dict:
+        if self.operator is None:
+            return {self.field.path: self.value}
+        return {self.field.path: {self.operator: self.value}}
+
+    def conditions(self) -> List["Condition"]:
+        return [self]
+
+
+class And(Expression):
+    def __init__(self, expressions: List[Expression]) -> None:
+        self.expressions = expressions
+
+    def to_filter(self) -> dict:
+        filters = [x.to_filter() for x in self.expressions]
+
+        # Conditions on different fields are merged into a single document, which
+        # is how a hand-written filter would look like
+        merged = {}
+        for item in filters:
+            if any(k in merged or k.startswith("$") for k in item):
+                return {"$and": filters}
+            merged.update(item)
+        return merged
+
+    def conditions(self) -> List[Condition]:
+        return [y for x in self.expressions for y in x.conditions()]
+
+
+class Or(Expression):
+    def __init__(self, expressions: List[Expression]) -> None:
+        self.expressions = expressions
+
+    def to_filter(self) -> dict:
+        return {"$or": [x.to_filter() for x in self.expressions]}
+
+    def conditions(self) -> List[Condition]:
+        return [y for x in self.expressions for y in x.conditions()]
+
+
+class Not(Expression):
+    def __init__(self, expression: Expression) -> None:
+        self.expression = expression
+
+    def to_filter(self) -> dict:
+        return {"$nor": [self.expression.to_filter()]}
+
+    def conditions(self) -> List[Condition]:
+        return self.expression.conditions()
+
+
+class Field:
+
+    """
+    A field of a mongoclass, as returned by `Mongoclass.q.<field>`. Comparing it builds a `Condition`.
+
+    Parameters
+    ----------
+    `path` : str
+        The (dotted) path of the field in the documents.
+    `annotation` : Any
+        The annotation of the field, values are checked against it.
+    """
+
+    def __init__(self, path: str, annotation: Any = Any) -> None:
+        self.path = path
+        self.annotation = annotation
+
+    def __repr__(self) -> str:
+        return f"Field({self.path!r})"
+
+    # Comparisons build conditions, so fields can't be hashed
+    __hash__ = None  # type: ignore
+
+    def __eq__(self, value: Any) -> Condition:  # type: ignore
+        return Condition(self, None, value)
+
+    def __ne__(self, value: Any) -> Condition:  # type: ignore
+        return Condition(self, "$ne", value)
+
+    def __gt__(self, value: Any) -> Condition:
+        return Condition(self, "$gt", value)
+
+    def __ge__(self, value: Any) -> Condition:
+        return Condition(self, "$gte", value)
+
+    def __lt__(self, value: Any) -> Condition:
+        return Condition(self, "$lt", value)
+
+    def __le__(self, value: Any) -> Condition:
+        return Condition(self, "$lte", value)
+
+    def in_(self, values: Union[Iterable[Any], Param]) -> Condition:
+        return Condition(self, "$in", _as_list(values))
+
+    def not_in(self, values: Union[Iterable[Any], Param]) -> Condition:
+        return Condition(self, "$nin", _as_list(values))
+
+    def exists(self, exists: bool = True) -> Condition:
+        return Condition(Field(self.path), "$exists", exists)
+
+    def __getattr__(self, name: str) -> "Field":
+        # Fields of nested dataclasses
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(Fields(self.annotation, self.path), name)
+
+    def check(self, operator: Optional[str], value: Any) -> None:
+        """
+        Raise a TypeError if `value` can't be compared with this field using `operator`.
+        """
+
+        values = value if operator in ("$in", "$nin") else [value]
+        for item in values:
+            if not _matches_type(self.annotation, item):
+                raise TypeError(
+                    f"Field '{self.path}' is annotated as {self.annotation!r}, "
+                    f"got {item!r}"
+                )
+
+
+def _as_list(values: Union[Iterable[Any], Param]) -> Union[List[Any], Param]:
+    if isinstance(values, Param):
+        return values
+    if isinstance(values, (str, bytes, dict)):
+        raise TypeError("in_() and not_in() take an iterable of values")
+    return list(values)
+
+
+class Fields:
+
+    """
+    The fields of a mongoclass, generated from `dataclasses.fields`. Available as `Mongoclass.q`, accessing a field that doesn't exist raises an AttributeError instead of silently matching nothing.
+
+    >>> User.find_classes((User.q.age > 30) & User.q.country.in_(["PH", "US"]))
+    """
+
+    def __init__(self, cls: type, prefix: str = "", nested: bool = False) -> None:
+        if not dataclasses.is_dataclass(cls):
+            raise AttributeError(f"Field '{prefix}' has no fields")
+
+        hints = _get_type_hints(cls)
+        self._prefix = prefix
+        self._fields: Dict[str, Field] = {}
+        for field in dataclasses.fields(cls):
+            annotation = hints.get(field.name, field.type)
+            path = f"{prefix}.{field.name}" if prefix else field.name
+
+            # Nested mongoclasses are stored under "data", see `as_json()`
+            if nested and hasattr(annotation, "COLLECTION_NAME"):
+                self._fields[field.name] = _NestedField(path, annotation)
+            else:
+                self._fields[field.name] = Field(path, annotation)
+
+        if not prefix:
+            self._fields["_id"] = Field("_id")
+
+    def __getattr__(self, name: str) -> Field:
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        field = self._fields.get(name)
+        if field is None:
+            raise AttributeError(
+                f"'{name}' is not a field, the fields are: {', '.join(self._fields)}"
+            )
+        return field
+
+    def __getitem__(self, name: str) -> Field:
+        return getattr(self, name)
+
+    def __iter__(self):
+        return iter(self._fields.values())
+
+    def __dir__(self) -> List[str]:
+        return list(self._fields)
+
+
+class _NestedField(Field):
+    def __getattr__(self, name: str) -> Field:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(Fields(self.annotation, f"{self.path}.data", True), name)
+
+
+def _get_type_hints(cls: type) -> Dict[str, Any]:
+    try:
+        return typing.get_type_hints(cls)
+    except Exception:  # pylint:disable=broad-except
+        # Unresolvable forward references, fall back to the raw annotations
+        return {}
+
+
+class CompiledQuery:
+
+    """
+    A query expression compiled once and turned into filters for given parameter values, for queries that run over and over with different values. The parts of the filter without parameters (a large `$in` list for example) are built once and shared by every filter.
+
+    >>> by_country = (User.q.country == Param("country")).compile()
+    >>> User.find_classes(by_country(country="PH"))
+
+    Parameters
+    ----------
+    `expression` : Expression
+        The expression to compile.
+    """
+
+    def __init__(self, expression: Expression) -> None:
+        self.filter = expression.to_filter()
+        self.params: Dict[str, Tuple[Field, Optional[str]]] = {}
+        for condition in expression.conditions():
+            if isinstance(condition.value, Param):
+                self.params[condition.value.name] = (
+                    condition.field,
+                    condition.operator,
+                )
+
+        self._dynamic = set()
+        self._find_dynamic(self.filter)
+
+    def __call__(self, **params) -> dict:
+        """
+        Get the filter for the given parameter values.
+        """
+
+        missing = set(self.params) - set(params)
+        unknown = set(params) - set(self.params)
+        if missing or unknown:
+            raise ValueError(
+                f"Missing parameters {sorted(missing)}, unknown parameters "
+                f"{sorted(unknown)}"
+            )
+
+        for name, value in params.items():
+            field, operator = self.params[name]
+            if operator in ("$in", "$nin"):
+                value = params[name] = _as_list(value)
+            field.check(operator, value)
+        return self._bind(self.filter, params)
+
+    def _find_dynamic(self, node: Any) -> bool:
+        if isinstance(node, Param):
+            return True
+
+        children = []
+        if isinstance(node, dict):
+            children = list(node.values())
+        elif isinstance(node, list):
+            children = node
+
+        dynamic = False
+        for child in children:
+            dynamic = self._find_dynamic(child) or dynamic
+        if dynamic:
+            self._dynamic.add(id(node))
+        return dynamic
+
+    def _bind(self, node: Any, params: dict) -> Any:
+        if isinstance(node, Param):
+            return params[node.name]
+        if id(node) not in self._dynamic:
+            return node
+        if isinstance(node, dict):
+            return {k: self._bind(v, params) for k, v in node.items()}
+        return [self._bind(x, params) for x in node]
+
+
+def as_filter(query: Any) -> Any:
+    """
+    Get the filter of a query expression, anything else is returned as is.
+    """
+
+    if isinstance(query, Expression):
+        return query.to_filter()
+    return query
+
+
+def filter_args(args: tuple, kwargs: dict) -> Tuple[tuple, dict]:
+    """
+    Turn the query expression given as the filter of `find` like arguments into its filter.
+    """
+
+    if args:
+        return (as_filter(args[0]), *args[1:]), kwargs
+    if "filter" in kwargs:
+        return args, {**kwargs, "filter": as_filter(kwargs["filter"])}
+    return args, kwargs
@@ -0,0 +1,142 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List
+
+# read(filter, emit) scans the documents of a partition, handing batches of
+# mongoclasses to emit(batch), and returns how many documents it read
+Read = Callable[[dict, Callable[[list], None]], int]
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class _Failure:
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+def sample_boundaries(ids: List[Any], partitions: int) -> List[Any]:
+    """
+    Get the `_id` boundaries splitting sorted `ids` into `partitions` ranges of about the same size.
+    """
+
+    step = len(ids) / partitions
+    boundaries = []
+    for i in range(1, partitions):
+        boundary = ids[int(step * i)] if ids else None
+        if boundary is not None and boundary not in boundaries[-1:]:
+            boundaries.append(boundary)
+    return boundaries
+
+
+def get_boundaries(
+    collection: Any, query: dict, partitions: int, engine_used: str
+) -> List[Any]:
+    """
+    Get the `_id` boundaries splitting the documents of a collection matching `query` into `partitions` ranges of about the same size. Pymongo asks the server with `$bucketAuto`, mongita reads the `_id` of the matching documents.
+    """
+
+    if partitions <= 1:
+        return []
+
+    if engine_used == "pymongo":
+        buckets = collection.aggregate(
+            [
+                {"$match": query},
+                {"$bucketAuto": {"groupBy": "$_id", "buckets": partitions}},
+            ],
+            allowDiskUse=True,
+        )
+        return [x["_id"]["min"] for x in buckets][1:]
+
+    ids = sorted(x["_id"] for x in collection.find(query))
+    return sample_boundaries(ids, partitions)
+
+
+def partition_filters(query: dict, boundaries: List[Any]) -> List[dict]:
+    """
+    Get the filters of the `_id` ranges between `boundaries`, each also matching `query`. The first and last ranges are open so documents inserted during the scan still fall into one.
+    """
+
+    filters = []
+    for low, high in zip([None, *boundaries], [*boundaries, None]):
+        bounds = {}
+        if low is not None:
+            bounds["$gte"] = low
+        if high is not None:
+            bounds["$lt"] = high
+
+        if not bounds:
+            filters.append(query)
+        elif "_id" in query:
+            filters.append({"$and": [query, {"_id": bounds}]})
+        else:
+            filters.append({**query, "_id": bounds})
+    return filters
+
+
+def run_partitions(
+    read: Read, filters: List[dict], workers: int, callback: Callable[[list], None]
+) -> int:
+    """
+    Read every partition on a pool of `workers` threads, handing the batches to `callback` from those threads. Returns how many documents were read, the first error of a partition is raised once every partition is done.
+    """
+
+    with ThreadPoolExecutor(workers, thread_name_prefix="mongoclass-scan") as executor:
+        futures = [executor.submit(read, x, callback) for x in filters]
+        return sum(x.result() for x in futures)
+
+
+def iter_partitions(read: Read, filters: List[dict], workers: int) -> Iterator[Any]:
+    """
+    Read every partition on a pool of `workers` threads and yield the mongoclasses as their batches come in, in no particular order. At most two batches per worker wait to be consumed, and the remaining reads are stopped if the iteration stops early.
+    """
+
+    results: queue.Queue = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def emit(batch: list) -> None:
+        if not put(batch):
+            raise _Stopped
+
+    def run(query: dict) -> None:
+        if stop.is_set():
+            return
+        try:
+            read(query, emit)
+        except _Stopped:
+            return
+        except BaseException as e:  # pylint:disable=broad-except
+            put(_Failure(e))
+        put(_DONE)
+
+    executor = ThreadPoolExecutor(workers, thread_name_prefix="mongoclass-scan")
+    for query in filters:
+        executor.submit(run, query)
+
+    try:
+        remaining = len(filters)
+        while remaining:
+            item = results.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, _Failure):
+                raise item.error
+            else:
+                yield from item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
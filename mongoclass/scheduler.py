@@ -0,0 +1,233 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshJob:
+
+    """
+    A periodic refresh managed by a `RefreshScheduler`, also holds the timing metrics of that refresh.
+    """
+
+    def __init__(self, name: str, every: float, function: Callable[[], None]) -> None:
+        self.name = name
+        self.every = every
+        self.function = function
+
+        self.next_run = 0.0
+        self.running = False
+        self.failures = 0
+
+        self.runs = 0
+        self.errors = 0
+        self.skipped = 0
+        self.last_run: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.total_duration = 0.0
+        self.last_error: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "every": self.every,
+            "running": self.running,
+            "runs": self.runs,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "consecutive_failures": self.failures,
+            "last_run": self.last_run,
+            "last_duration": self.last_duration,
+            "average_duration": self.total_duration / self.runs if self.runs else None,
+            "last_error": self.last_error,
+        }
+
+
+class RefreshScheduler:
+
+    """
+    Run the periodic refreshes of many mongoclasses from a single thread.
+
+    Runs start every `every` seconds (plus or minus some jitter so refreshes of different processes don't line up). A run that is due while the previous run of the same mongoclass is still going is skipped. After a failure the next run is delayed exponentially, up to `max_backoff` seconds.
+
+    Parameters
+    ----------
+    `jitter` : float
+        The fraction of the interval the start of a run may randomly be moved by. Defaults to 0.1
+    `max_backoff` : float
+        The maximum delay in seconds between runs of a failing refresh. Never shorter than its interval. Defaults to 300.
+    `workers` : int
+        How many refreshes may run at the same time. Defaults to 4.
+    """
+
+    def __init__(
+        self, jitter: float = 0.1, max_backoff: float = 300, workers: int = 4
+    ) -> None:
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.workers = workers
+
+        self.jobs: Dict[Tuple[str, str, Optional[str]], RefreshJob] = {}
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def schedule(
+        self,
+        mongoclass: object,
+        every: float,
+        function: Callable[[], None],
+        subset: Optional[str] = None,
+    ) -> None:
+        """
+        Run `function` every `every` seconds. Scheduling a mongoclass (or subset) that is already scheduled replaces its previous schedule.
+
+        Parameters
+        ----------
+        `mongoclass` : object
+            The mongoclass class definition (not an instance) the refresh belongs to.
+        `every` : float
+            The interval in seconds.
+        `function` : Callable[[], None]
+            The refresh to run.
+        `subset` : str
+            The name of the cached subset of the mongoclass the refresh belongs to, if any. Subsets are scheduled separately from their mongoclass.
+        """
+
+        key = (mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, subset)
+
+        with self._condition:
+            job = self.jobs.get(key)
+            if job is None:
+                name = f"{key[0]}.{key[1]}"
+                if subset is not None:
+                    name = f"{name}:{subset}"
+                job = self.jobs[key] = RefreshJob(name, every, function)
+
+            job.every = every
+            job.function = function
+            job.next_run = time.monotonic() + self._delay(every)
+            self._condition.notify()
+
+    def unschedule(self, mongoclass: object, subset: Optional[str] = None) -> None:
+        """
+        Stop refreshing a mongoclass (or one of its subsets). A run that is already going is not interrupted.
+        """
+
+        key = (mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME, subset)
+        with self._condition:
+            self.jobs.pop(key, None)
+            self._condition.notify()
+
+    def start(self) -> None:
+        """
+        Start the scheduler thread. Does nothing if it is already running.
+        """
+
+        with self._condition:
+            if self._thread is not None:
+                return
+
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="mongoclass-refresh"
+            )
+            self._thread = threading.Thread(
+                target=self._run, name="mongoclass-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        """
+        Stop the scheduler thread. The schedules are kept so the scheduler can be started again.
+
+        Parameters
+        ----------
+        `wait` : bool
+            Whether to wait for the refreshes that are currently running to finish. Defaults to True.
+        """
+
+        with self._condition:
+            thread, executor = self._thread, self._executor
+            if thread is None:
+                return
+
+            self._stopping = True
+            self._thread = None
+            self._executor = None
+            self._condition.notify()
+
+        thread.join()
+        executor.shutdown(wait=wait)
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Get the timing metrics of every scheduled refresh, keyed by `"database.collection"` (or `"database.collection:subset"`).
+        """
+
+        with self._condition:
+            return {job.name: job.as_dict() for job in self.jobs.values()}
+
+    def _delay(self, every: float) -> float:
+        return max(every + random.uniform(-self.jitter, self.jitter) * every, 0)
+
+    def _run(self) -> None:
+        with self._condition:
+            while not self._stopping:
+                now = time.monotonic()
+                for job in list(self.jobs.values()):
+                    if job.next_run > now:
+                        continue
+
+                    if job.running:
+                        job.skipped += 1
+                        job.next_run = now + self._delay(job.every)
+                        continue
+
+                    job.running = True
+                    job.next_run = now + self._delay(job.every)
+                    self._executor.submit(self._execute, job)
+
+                timeout = None
+                if self.jobs:
+                    timeout = min(x.next_run for x in self.jobs.values()) - now
+                self._condition.wait(max(timeout, 0) if timeout is not None else None)
+
+    def _execute(self, job: RefreshJob) -> None:
+        started = time.monotonic()
+        error = None
+        try:
+            job.function()
+        except Exception as e:  # pylint:disable=broad-except
+            logger.exception("Refreshing %s failed", job.name)
+            error = e
+
+        duration = time.monotonic() - started
+        with self._condition:
+            job.running = False
+            job.runs += 1
+            job.last_run = time.time()
+            job.last_duration = duration
+            job.total_duration += duration
+
+            if error is None:
+                job.failures = 0
+                job.last_error = None
+            else:
+                job.errors += 1
+                job.failures += 1
+                job.last_error = repr(error)
+
+                backoff = min(
+                    job.every * 2**job.failures, max(self.max_backoff, job.every)
+                )
+                job.next_run = started + backoff
+                self._condition.notify()
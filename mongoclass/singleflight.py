@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+
+    """
+    Coalesce concurrent identical calls. While a call for a key is running, other callers asking for the same key wait for it and share its result (or exception) instead of running their own.
+
+    Only calls that overlap are coalesced, nothing is kept once a call finishes.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(
+        self, key: Hashable, function: Callable[..., Any], *args, **kwargs
+    ) -> Tuple[Any, bool]:
+        """
+        Call `function(*args, **kwargs)` unless a call for `key` is already running, in which case wait for that call instead.
+
+        Parameters
+        ----------
+        `key` : Hashable
+            What identifies identical calls.
+        `function` : Callable
+            The function to call.
+        `*args, **kwargs` :
+            To be passed onto `function`
+
+        Returns
+        -------
+        `Tuple[Any, bool]` :
+            The result and whether it came from (and is therefore shared with) another caller. Callers that mutate the result should copy shared results first.
+        """
+
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = self._calls[key] = Future()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key)
+            future.set_exception(e)
+            raise
+
+        self._finish(key)
+        future.set_result(result)
+        return result, False
+
+    def _finish(self, key: Hashable) -> None:
+        # Forget the call before handing out its result, so callers arriving from
+        # now on start a new call instead of getting a result that may be stale
+        with self._lock:
+            del self._calls[key]
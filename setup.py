@@ -2,6 +2,10 @@ from distutils.core import setup
 from pathlib import Path
 
 install_requires = ["dnspython==2.2.1", "mongita==1.1.1"]
+extras_require = {
+    "redis": ["redis>=4.2"],
+    "test": ["redis>=4.2", "fakeredis>=2.0"],
+}
 long_description = (Path(__file__).parent / "README.md").read_text()
 
 setup(
@@ -16,6 +20,7 @@ setup(
     download_url="https://github.com/bossauh/mongoclass/archive/refs/tags/v_16.tar.gz",
     keywords=["pymongo", "orm"],
     install_requires=install_requires,
+    extras_require=extras_require,
     long_description=long_description,
     long_description_content_type="text/markdown",
 )
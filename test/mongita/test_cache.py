@@ -0,0 +1,824 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import fakeredis
+
+from mongoclass.async_cache import AsyncMongoclassRedisCache
+from mongoclass.cache import MongoclassRedisCache, RedisNegativeCache
+
+from .. import utils
+
+ENGINE = "mongita_disk"
+
+
+def wait_for(condition, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        utils.drop_database()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        utils.drop_database()
+
+    def setUp(self) -> None:
+        self.server = fakeredis.FakeServer()
+
+    def create_cache(self, client, **kwargs) -> MongoclassRedisCache:
+        cache = MongoclassRedisCache(
+            client, connection=fakeredis.FakeRedis(server=self.server), **kwargs
+        )
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_cache(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "cached_user")
+        users = [
+            User("John Howard", "john@gmail.com", 8771),
+            User("Tony Stark", "tonystark@gmail.com", 8080),
+        ]
+        client.insert_classes(users)
+
+        cache = self.create_cache(client)
+        cache.cache(User)
+        self.assertEqual(list(cache.get_cached(User)), users)
+
+        tony = cache.get_from_cache(User, lambda x: x.phone == 8080)
+        self.assertEqual(tony, users[1])
+        self.assertEqual(tony._mongodb_id, users[1]._mongodb_id)
+
+        bruce = User("Bruce Banner", "bruce@gmail.com", 1234, _insert=True)
+        cache.insert_to_cache(bruce)
+        self.assertTrue(cache.delete_from_cache(User, lambda x: x.phone == 8771))
+        self.assertFalse(cache.delete_from_cache(User, lambda x: x.phone == 8771))
+        self.assertEqual(list(cache.get_cached(User)), [users[1], bruce])
+
+    def test_swap(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "swap_user")
+        client.insert_classes([User(f"User {x}", "x@gmail.com", x) for x in range(30)])
+
+        cache = self.create_cache(client)
+        cache.cache(User)
+        list_name = cache.get_list_name(User.DATABASE_NAME, "swap_user")
+        hash_name = cache.get_hash_name(User.DATABASE_NAME, "swap_user")
+
+        # Another process keeps reading while the collection is rebuilt in chunks
+        reader = self.create_cache(client)
+        seen = []
+        stop = threading.Event()
+
+        def read() -> None:
+            while not stop.is_set():
+                exists = reader.r.exists(list_name, hash_name)
+                seen.append((exists, len(list(reader.get_cached(User)))))
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        try:
+            for _ in range(5):
+                cache.cache(User, chunk_size=7)
+        finally:
+            stop.set()
+            thread.join()
+
+        # It never saw the keys missing or a partial collection
+        self.assertTrue(seen)
+        self.assertEqual(set(seen), {(2, 30)})
+
+    def test_legacy(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "legacy_user")
+        Position = utils.create_class("position", client, "legacy_position")
+        users = [User(f"User {x}", "x@gmail.com", x) for x in range(3)]
+        client.insert_classes(users)
+        position = Position(1, 2, 3, _insert=True)
+
+        # Caches used to be a list of JSON documents
+        cache = self.create_cache(client)
+        for mongoclass, items in ((User, users), (Position, [position])):
+            cache.r.rpush(
+                cache.get_list_name(
+                    mongoclass.DATABASE_NAME, mongoclass.COLLECTION_NAME
+                ),
+                *[json.dumps(x.as_json()) for x in items],
+            )
+
+        # They are rebuilt when they are first read or written
+        self.assertEqual(list(cache.get_cached(User)), users)
+        self.assertEqual(
+            cache.get_codec(User.DATABASE_NAME, "legacy_user").name, "json"
+        )
+        other = Position(4, 5, 6, _insert=True)
+        cache.insert_to_cache(other)
+        self.assertEqual(list(cache.get_cached(Position)), [position, other])
+
+    def test_write_through(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "write_through_user")
+
+        cache = self.create_cache(client)
+        cache.cache(User)
+        cache.attach(User)
+
+        john = User("John Howard", "john@gmail.com", 8771, _insert=True)
+        self.assertEqual(list(cache.get_cached(User)), [john])
+
+        john.country = "PH"
+        john.save()
+        self.assertEqual(list(cache.get_cached(User))[0].country, "PH")
+
+        users = [User("Tony Stark", "tony@gmail.com", 8080)]
+        client.insert_classes(users)
+        self.assertEqual(list(cache.get_cached(User)), [john, *users])
+
+        john.delete()
+        self.assertEqual(list(cache.get_cached(User)), users)
+
+        cache.detach(User)
+        User("Bruce Banner", "bruce@gmail.com", 1234, _insert=True)
+        self.assertEqual(list(cache.get_cached(User)), users)
+
+    def test_write_through_update(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "write_through_update_user")
+        tony = User("Tony Stark", "tony@gmail.com", 8080, _insert=True)
+
+        cache = self.create_cache(client)
+        cache.cache(User)
+        cache.attach(User)
+
+        # Updates write the document as it is after the update
+        _, new = tony.update({"$inc": {"phone": 1}})
+        self.assertEqual(new.phone, 8081)
+        self.assertEqual(list(cache.get_cached(User)), [new])
+        tony.update({"$set": {"country": "PH"}}, return_new=False)
+        cached = list(cache.get_cached(User))
+        self.assertEqual((cached[0].phone, cached[0].country), (8081, "PH"))
+
+        # Documents deleted elsewhere are dropped by their next update
+        client.default_database["write_through_update_user"].delete_one(
+            {"_id": tony._mongodb_id}
+        )
+        tony.update({"$set": {"country": "US"}})
+        self.assertEqual(list(cache.get_cached(User)), [])
+
+        bruce = User("Bruce Banner", "bruce@gmail.com", 1234, _insert=True)
+        self.assertEqual(list(cache.get_cached(User)), [bruce])
+        bruce.delete()
+        self.assertEqual(list(cache.get_cached(User)), [])
+
+    def test_write_through_before_cache(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "write_through_unbuilt_user")
+        client.insert_classes([User(f"User {x}", "x@gmail.com", x) for x in range(5)])
+
+        # Writes don't start a cache of their own before the collection is cached
+        cache = self.create_cache(client)
+        cache.attach(User)
+        User("New User", "new@gmail.com", 5, _insert=True)
+        self.assertEqual(list(cache.get_cached(User)), [])
+
+        cache.cache(User)
+        User("Newer User", "newer@gmail.com", 6, _insert=True)
+        self.assertEqual(len(list(cache.get_cached(User))), 7)
+
+    def test_chunk_size(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "chunk_user")
+        users = [User(f"User {x}", "x@gmail.com", x) for x in range(6)]
+        client.insert_classes(users)
+
+        cache = self.create_cache(client)
+        with self.assertRaises(ValueError):
+            cache.cache(User, chunk_size=0)
+
+        # One document per chunk, an exact multiple, a remainder and a single chunk
+        sync_name = cache.get_sync_name(User.DATABASE_NAME, "chunk_user")
+        for chunk_size in (1, 3, 4, 6, 10):
+            cache.cache(User, watermark="phone", chunk_size=chunk_size)
+            self.assertEqual(list(cache.get_cached(User)), users)
+            self.assertEqual(
+                cache._decode_sync_value(cache.r.hget(sync_name, "value")), 5
+            )
+
+            cache.cache(User, chunk_size=chunk_size, shards=2)
+            self.assertEqual(
+                sorted(cache.get_cached(User), key=lambda x: x.phone), users
+            )
+
+        # Scheduled builds, and refreshes falling back to one, use the same chunks
+        chunk_sizes = []
+        build = cache._build
+        cache._build = lambda *args: chunk_sizes.append(args[3]) or build(*args)
+        self.addCleanup(cache.scheduler.unschedule, User)
+        key = (User.DATABASE_NAME, "chunk_user", None)
+        cache.cache(User, every=60, chunk_size=2)
+        cache.scheduler.jobs[key].function()
+        cache.cache(User, every=60, watermark="phone", chunk_size=3)
+        cache.r.delete(sync_name)
+        cache.scheduler.jobs[key].function()
+        self.assertEqual(chunk_sizes, [2, 2, 3, 3])
+        self.assertEqual(list(cache.get_cached(User)), users)
+
+    def test_local_cache(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "local_cached_user")
+        john = User("John Howard", "john@gmail.com", 8771, _insert=True)
+
+        # Two caches sharing a Redis server act like two processes
+        first = self.create_cache(client, local_cache_size=100)
+        second = self.create_cache(client, local_cache_size=100)
+        first.cache(User)
+
+        cached = list(first.get_cached(User))
+        self.assertEqual(cached, [john])
+        self.assertEqual(first.local_cache.size, 1)
+
+        # Served from the process without going to Redis
+        self.assertIs(list(first.get_cached(User))[0], cached[0])
+
+        # Writes of the other process are published and drop the local cache
+        tony = User("Tony Stark", "tony@gmail.com", 8080, _insert=True)
+        second.insert_to_cache(tony)
+        self.assertTrue(wait_for(lambda: first.local_cache.size == 0))
+        self.assertEqual(list(first.get_cached(User)), [john, tony])
+
+        second.delete_from_cache(User, lambda x: x.phone == 8771)
+        self.assertTrue(wait_for(lambda: list(first.get_cached(User)) == [tony]))
+
+        # So do refreshes
+        list(second.get_cached(User))
+        first.cache(User)
+        self.assertTrue(wait_for(lambda: second.local_cache.size == 0))
+
+    def test_local_cache_bounded(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "bounded_user")
+        Position = utils.create_class("position", client, "bounded_position")
+
+        client.insert_classes([User(f"User {x}", "x@gmail.com", x) for x in range(5)])
+        client.insert_classes([Position(x, x, x) for x in range(3)])
+
+        cache = self.create_cache(client, local_cache_size=4)
+        cache.cache(User)
+        cache.cache(Position)
+
+        # Too large to be held
+        self.assertEqual(len(list(cache.get_cached(User))), 5)
+        self.assertEqual(cache.local_cache.size, 0)
+
+        self.assertEqual(len(list(cache.get_cached(Position))), 3)
+        self.assertEqual(cache.local_cache.size, 3)
+
+        # Collections that fit are loaded whole, even when only partially read
+        cache.local_cache.clear()
+        cache.get_from_cache(Position, lambda x: x.x == 0)
+        self.assertEqual(cache.local_cache.size, 3)
+
+    def test_stats(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "stats_user")
+        client.insert_classes([User(f"User {x}", "x@gmail.com", x) for x in range(3)])
+
+        cache = self.create_cache(client)
+        cache.cache(User)
+        cache.get_from_cache(User, lambda x: x.phone == 1)
+        cache.get_from_cache(User, lambda x: x.phone == 10)
+
+        stats = cache.stats.as_dict()[f"{User.DATABASE_NAME}.stats_user"]
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+        self.assertEqual(stats["builds"], 1)
+        self.assertEqual(stats["lock_waits"], 1)
+        self.assertEqual(stats["payloads"], 3)
+        self.assertEqual(stats["documents"], 3)
+
+    def test_build_single_flight(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "single_flight_user")
+        User("John Howard", "john@gmail.com", 8771, _insert=True)
+
+        cache = self.create_cache(client)
+        cache.cache(User)
+
+        # Another process is building the same collection
+        lock = fakeredis.FakeRedis(server=self.server).lock(
+            f"lock:{User.DATABASE_NAME}:single_flight_user:build"
+        )
+        lock.acquire()
+        thread = threading.Thread(target=cache.cache, args=(User,))
+        thread.start()
+        time.sleep(0.2)
+        self.assertTrue(thread.is_alive())
+
+        # Its snapshot is used instead of building another one
+        lock.release()
+        thread.join()
+        stats = cache.stats.as_dict()[f"{User.DATABASE_NAME}.single_flight_user"]
+        self.assertEqual(stats["builds"], 1)
+
+        # Unless it was built with another layout
+        lock.acquire()
+        thread = threading.Thread(
+            target=cache.cache, args=(User,), kwargs={"watermark": "phone", "shards": 2}
+        )
+        thread.start()
+        time.sleep(0.2)
+        lock.release()
+        thread.join()
+        stats = cache.stats.as_dict()[f"{User.DATABASE_NAME}.single_flight_user"]
+        self.assertEqual(stats["builds"], 2)
+        self.assertEqual(cache.get_shards(User.DATABASE_NAME, "single_flight_user"), 2)
+        sync = cache.r.hgetall(
+            cache.get_sync_name(User.DATABASE_NAME, "single_flight_user")
+        )
+        self.assertEqual(sync[b"field"], b"phone")
+
+    def test_build_lock_timeout(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "build_lock_user")
+        User("John Howard", "john@gmail.com", 8771, _insert=True)
+
+        cache = self.create_cache(client)
+        cache.BUILD_WAIT_TIMEOUT = 0.2
+        lock_name = f"lock:{User.DATABASE_NAME}:build_lock_user:build"
+
+        # Another process is stuck building the same collection
+        lock = fakeredis.FakeRedis(server=self.server).lock(lock_name, timeout=30)
+        lock.acquire()
+        cache.cache(User)
+        self.assertEqual(len(list(cache.get_cached(User))), 1)
+
+        # A build only holds the lock for a short while unless it extends it
+        lock.release()
+        ttls = []
+        function = lambda: ttls.append(cache.r.pttl(lock_name))
+        self.assertTrue(cache._build_once(User, None, "options", function))
+        self.assertTrue(0 < ttls[0] <= cache.BUILD_LOCK_TIMEOUT * 1000)
+        self.assertFalse(cache.r.exists(lock_name))
+
+    def test_bounded(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "bounded_lru_user")
+        users = [User(f"User {x}", "x@gmail.com", x) for x in range(5)]
+        client.insert_classes(users)
+
+        cache = self.create_cache(client)
+        with self.assertRaises(ValueError):
+            cache.get_by_id(User, users[0]._mongodb_id)
+
+        cache.bound(User, max_entries=3)
+        cache.attach(User)
+        for user in users[:3]:
+            self.assertEqual(cache.get_by_id(User, user._mongodb_id), user)
+        self.assertIsNone(cache.get_by_id(User, "unknown"))
+
+        # Reading the first user makes the second one the least recently used
+        cache.get_by_id(User, users[0]._mongodb_id)
+        cache.get_by_id(User, users[3]._mongodb_id)
+
+        recency, *_ = cache._get_bounded_keys(User.DATABASE_NAME, "bounded_lru_user")
+        cached = {
+            cache.get_id_key(x._mongodb_id).encode()
+            for x in (users[0], users[2], users[3])
+        }
+        self.assertEqual(set(cache.r.zrange(recency, 0, -1)), cached)
+
+        stats = cache.stats.as_dict()[f"{User.DATABASE_NAME}.bounded_lru_user"]
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 5)
+        self.assertEqual(stats["evictions"], 1)
+
+        # Writes drop the entries of the written documents
+        users[0].country = "PH"
+        users[0].save()
+        self.assertEqual(cache.get_by_id(User, users[0]._mongodb_id).country, "PH")
+
+    def test_bounded_bytes(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "bounded_bytes_user")
+        users = [User(f"User {x}", "x@gmail.com", x) for x in range(5)]
+        client.insert_classes(users)
+
+        cache = self.create_cache(client)
+        size = len(cache.codec.encode(cache.to_document(users[0])))
+        cache.bound(User, max_bytes=size * 2, ttl=0.1)
+        for user in users:
+            cache.get_by_id(User, user._mongodb_id)
+
+        recency, sizes, total, expiries = cache._get_bounded_keys(
+            User.DATABASE_NAME, "bounded_bytes_user"
+        )
+        self.assertEqual(cache.r.zcard(recency), 2)
+        self.assertEqual(int(cache.r.get(total)), size * 2)
+
+        # Expired entries are reloaded
+        time.sleep(0.2)
+        self.assertEqual(cache.get_by_id(User, users[4]._mongodb_id), users[4])
+        stats = cache.stats.as_dict()[f"{User.DATABASE_NAME}.bounded_bytes_user"]
+        self.assertEqual(stats["misses"], 6)
+
+        # The expired entries were forgotten instead of being evicted
+        self.assertEqual(cache.r.zcard(recency), 1)
+        self.assertEqual(int(cache.r.get(total)), size)
+        self.assertEqual(stats["evictions"], 3)
+
+        cache.evict(User, users[3]._mongodb_id)
+        cache.evict(User, users[4]._mongodb_id)
+        self.assertEqual(cache.r.zcard(recency), 0)
+        self.assertEqual(cache.r.zcard(expiries), 0)
+        self.assertEqual(cache.r.hlen(sizes), 0)
+        self.assertEqual(int(cache.r.get(total)), 0)
+        self.assertFalse(
+            cache.r.exists(
+                *[
+                    cache.get_entry_name(
+                        User.DATABASE_NAME,
+                        "bounded_bytes_user",
+                        cache.get_id_key(x._mongodb_id),
+                    )
+                    for x in users
+                ]
+            )
+        )
+
+    def test_subset(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "subset_user")
+        users = [
+            User(f"User {x}", "x@gmail.com", x, "PH" if x % 2 else "US")
+            for x in range(6)
+        ]
+        client.insert_classes(users)
+
+        cache = self.create_cache(client, local_cache_size=100)
+        with self.assertRaises(ValueError):
+            cache.cache(User, filter={"country": "PH"})
+        with self.assertRaises(ValueError):
+            cache.cache(User, subset="ph", watermark="phone")
+
+        cache.cache(User)
+        cache.cache(
+            User,
+            subset="top_ph",
+            filter={"country": "PH"},
+            sort=[("phone", -1)],
+            limit=2,
+        )
+        self.assertEqual(list(cache.get_cached(User)), users)
+        self.assertEqual(
+            list(cache.get_cached(User, subset="top_ph")), [users[5], users[3]]
+        )
+        self.assertIsNone(
+            cache.get_from_cache(User, lambda x: x.phone == 1, subset="top_ph")
+        )
+        self.assertEqual(
+            cache.get_from_cache(User, lambda x: x.phone == 3, subset="top_ph"),
+            users[3],
+        )
+
+        # Every subset has its own schedule
+        cache.cache(User, every=60, subset="us", filter={"country": "US"})
+        cache.cache(User, every=60)
+        self.assertEqual(
+            set(cache.scheduler.stats()),
+            {
+                f"{User.DATABASE_NAME}.subset_user",
+                f"{User.DATABASE_NAME}.subset_user:us",
+            },
+        )
+        self.assertEqual(len(list(cache.get_cached(User, subset="us"))), 3)
+
+    def test_sharded(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "sharded_user")
+        users = [User(f"User {x}", "x@gmail.com", x) for x in range(20)]
+        client.insert_classes(users)
+
+        cache = self.create_cache(client, local_cache_size=100)
+        with self.assertRaises(ValueError):
+            cache.cache(User, subset="x", filter={"phone": 1}, shards=2)
+
+        cache.cache(User)
+        cache.cache(User, shards=4)
+        database_name = User.DATABASE_NAME
+        self.assertEqual(cache.get_shards(database_name, "sharded_user"), 4)
+        self.assertFalse(
+            cache.r.exists(cache.get_list_name(database_name, "sharded_user"))
+        )
+        lengths = [
+            cache.r.llen(cache.get_shard_list_name(database_name, "sharded_user", x))
+            for x in range(4)
+        ]
+        self.assertEqual(sum(lengths), 20)
+        self.assertGreater(min(lengths), 0)
+
+        key = lambda x: x.phone
+        self.assertEqual(sorted(cache.get_cached(User, batch_size=2), key=key), users)
+        self.assertEqual(sorted(cache.get_cached(User), key=key), users)
+        self.assertEqual(cache.get_from_cache(User, lambda x: x.phone == 7), users[7])
+
+        # Writes go to the shard of the document and invalidate the local cache
+        cache.attach(User)
+        new = User("New User", "new@gmail.com", 20, _insert=True)
+        users[3].delete()
+        expected = [x for x in users if x.phone != 3] + [new]
+        self.assertEqual(sorted(cache.get_cached(User), key=key), expected)
+
+        # Going back to a single list removes the shards
+        cache.cache(User)
+        self.assertEqual(cache.get_shards(database_name, "sharded_user"), 0)
+        self.assertEqual(list(cache.get_cached(User)), expected)
+        self.assertFalse(
+            any(
+                cache.r.exists(
+                    cache.get_shard_list_name(database_name, "sharded_user", x)
+                )
+                for x in range(4)
+            )
+        )
+
+    def test_reshard(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "reshard_user")
+        client.insert_classes([User(f"User {x}", "x@gmail.com", x) for x in range(200)])
+
+        cache = self.create_cache(client)
+        cache.cache(User)
+
+        # Another process keeps reading while the collection is sharded and back
+        reader = self.create_cache(client)
+        seen = []
+        stop = threading.Event()
+
+        def read() -> None:
+            while not stop.is_set():
+                seen.append(len(list(reader.get_cached(User))))
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        try:
+            for _ in range(5):
+                cache.cache(User, shards=4)
+                cache.cache(User)
+        finally:
+            stop.set()
+            thread.join()
+
+        self.assertTrue(seen)
+        self.assertEqual(set(seen), {200})
+
+    def test_snapshot(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "snapshot_user")
+        users = [User(f"User {x}", "x@gmail.com", x) for x in range(5)]
+        client.insert_classes(users)
+
+        cache = self.create_cache(client)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "users.snapshot")
+        with self.assertRaises(ValueError):
+            cache.snapshot_to(User, path)
+        cache.cache(User)
+        with self.assertRaises(ValueError):
+            cache.snapshot_to(User, path)
+
+        cache.cache(User, watermark="phone", shards=2)
+        self.assertEqual(cache.snapshot_to(User, path, batch_size=2), 5)
+
+        # A restarted worker warms up from the snapshot and only catches up with the
+        # documents written since
+        users.append(User("User 5", "x@gmail.com", 5, _insert=True))
+        self.server = fakeredis.FakeServer()
+        warm = self.create_cache(client)
+        self.assertTrue(warm.warm_from(User, path, chunk_size=2))
+        self.assertFalse(warm.warm_from(User, path))
+        self.assertEqual(warm.get_shards(User.DATABASE_NAME, "snapshot_user"), 2)
+        self.assertEqual(sorted(warm.get_cached(User), key=lambda x: x.phone), users)
+
+        # A worker that checked before the other one was done finds the collection
+        # cached once it holds the lock
+        other = self.create_cache(client)
+        self.assertFalse(
+            other._build_once(User, None, None, other._warm, User, path, 2)
+        )
+        stats = other.stats.as_dict().get(f"{User.DATABASE_NAME}.snapshot_user", {})
+        self.assertFalse(stats.get("builds"))
+
+        Position = utils.create_class("position", client, "snapshot_position")
+        with self.assertRaises(ValueError):
+            warm.warm_from(Position, path)
+        with open(path, "wb") as f:
+            f.write(b"not a snapshot")
+        with self.assertRaises(ValueError):
+            self.create_cache(client).warm_from(Position, path)
+
+    def test_refresh(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "refresh_user")
+        users = [User(f"User {x}", "x@gmail.com", x) for x in range(3)]
+        client.insert_classes(users)
+
+        cache = self.create_cache(client)
+        cache.cache(User, watermark="phone", shards=2)
+
+        # Only the documents past the watermark are fetched
+        users.append(User("User 3", "x@gmail.com", 3, _insert=True))
+        cache.refresh(User)
+        key = lambda x: x.phone
+        self.assertEqual(sorted(cache.get_cached(User), key=key), users)
+
+        # Without its watermark, the collection is rebuilt the way it was cached
+        database_name = User.DATABASE_NAME
+        sync_name = cache.get_sync_name(database_name, "refresh_user")
+        cache.r.delete(sync_name)
+        cache.refresh(User)
+        self.assertEqual(cache.r.hget(sync_name, "field"), b"phone")
+        self.assertEqual(cache.get_shards(database_name, "refresh_user"), 2)
+        self.assertEqual(sorted(cache.get_cached(User), key=key), users)
+
+        # Deletes aren't seen through the watermark
+        users.pop(0).delete()
+        cache.refresh(User)
+        self.assertEqual(len(list(cache.get_cached(User))), 4)
+        cache.refresh(User, detect_deletes=True)
+        self.assertEqual(sorted(cache.get_cached(User), key=key), users)
+
+    def test_change_stream(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "change_stream_user")
+
+        cache = self.create_cache(client)
+        with self.assertRaises(ValueError):
+            cache.cache(User, change_stream=True)
+
+    def test_negative_cache(self) -> None:
+        negative_cache = RedisNegativeCache(
+            ttl=60, connection=fakeredis.FakeRedis(server=self.server)
+        )
+        client = utils.create_client(ENGINE, negative_cache=negative_cache)
+        User = utils.create_class("user", client, "negative_user")
+
+        self.assertIsNone(User.find_class({"phone": 8771}))
+        self.assertIsNone(User.find_class({"phone": 1234}))
+
+        # Every process shares the misses
+        other = RedisNegativeCache(connection=fakeredis.FakeRedis(server=self.server))
+        self.assertEqual(other.generation(User.DATABASE_NAME, "negative_user"), 0)
+        self.assertEqual(other.invalidate(User.DATABASE_NAME, "negative_user", []), 0)
+
+        client.default_database["negative_user"].insert_one(
+            {"name": "Tony Stark", "email": "tonystark@gmail.com", "phone": 1234}
+        )
+        self.assertIsNone(User.find_class({"phone": 1234}))
+
+        john = User("John Howard", "john@gmail.com", 8771, _insert=True)
+        self.assertEqual(User.find_class({"phone": 8771}), john)
+        self.assertIsNone(User.find_class({"phone": 1234}))
+
+        other.clear()
+        self.assertIsNotNone(User.find_class({"phone": 1234}))
+
+        # Writes only look at the queries indexed by one of their fields, and at the
+        # queries that have no plain equality to be indexed by
+        self.assertIsNone(User.find_class({"phone": 1}))
+        self.assertIsNone(User.find_class({"phone": 2}))
+        self.assertIsNone(User.find_class({"phone": {"$gt": 10000}}))
+        names = other.get_names(User.DATABASE_NAME, "negative_user")
+        generation = other.generation(User.DATABASE_NAME, "negative_user")
+        for key in other.r.zrange(names[0], 0, -1):
+            self.assertEqual(
+                other.lookup(User.DATABASE_NAME, "negative_user", key),
+                (True, generation),
+            )
+        self.assertEqual(
+            other.invalidate(User.DATABASE_NAME, "negative_user", [{"phone": 2}]), 2
+        )
+        self.assertIsNone(User.find_class({"phone": 1}))
+        User("Bruce Banner", "bruce@gmail.com", 1, _insert=True)
+        self.assertIsNotNone(User.find_class({"phone": 1}))
+
+
+class TestAsyncCache(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        utils.drop_database()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        utils.drop_database()
+
+    async def test_cache(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "async_cached_user")
+        users = [User(f"User {x}", "x@gmail.com", x) for x in range(7)]
+        client.insert_classes(users)
+
+        server = fakeredis.FakeServer()
+        cache = AsyncMongoclassRedisCache(
+            client, connection=fakeredis.FakeAsyncRedis(server=server)
+        )
+        self.addAsyncCleanup(cache.close)
+
+        with self.assertRaises(ValueError):
+            await cache.cache(User, chunk_size=0)
+        await cache.cache(User, chunk_size=2)
+        cached = [x async for x in cache.get_cached(User, batch_size=3)]
+        self.assertEqual(cached, users)
+
+        user = await cache.get_from_cache(User, lambda x: x.phone == 4)
+        self.assertEqual(user._mongodb_id, users[4]._mongodb_id)
+
+        self.assertTrue(await cache.delete_from_cache(User, lambda x: x.phone == 0))
+        await cache.insert_to_cache(users[0])
+        cached = [x async for x in cache.get_cached(User)]
+        self.assertEqual(cached, [*users[1:], users[0]])
+
+        # Caches that used to be a list of JSON documents are rebuilt
+        await cache.r.rpush(
+            cache.get_list_name(User.DATABASE_NAME, "async_legacy_user"),
+            *[json.dumps(x.as_json()) for x in users],
+        )
+        Legacy = utils.create_class("user", client, "async_legacy_user")
+        client.insert_classes([Legacy(x.name, x.email, x.phone) for x in users])
+        legacy = [x async for x in cache.get_cached(Legacy)]
+        self.assertEqual([x.phone for x in legacy], [x.phone for x in users])
+
+        # Both caches share the same layout
+        sync_cache = MongoclassRedisCache(
+            client, connection=fakeredis.FakeRedis(server=server)
+        )
+        self.addCleanup(sync_cache.close)
+        self.assertEqual(list(sync_cache.get_cached(User)), cached)
+
+        # Sharded collections are only supported by MongoclassRedisCache
+        sync_cache.cache(User, shards=2)
+        with self.assertRaises(ValueError):
+            await cache.cache(User)
+        with self.assertRaises(ValueError):
+            await cache.refresh(User)
+        with self.assertRaises(ValueError):
+            await cache.insert_to_cache(users[0])
+        with self.assertRaises(ValueError):
+            [x async for x in cache.get_cached(User)]
+
+    async def test_build_single_flight(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "async_single_flight_user")
+        User("John Howard", "john@gmail.com", 8771, _insert=True)
+
+        server = fakeredis.FakeServer()
+        cache = AsyncMongoclassRedisCache(
+            client, connection=fakeredis.FakeAsyncRedis(server=server)
+        )
+        self.addAsyncCleanup(cache.close)
+        await cache.cache(User)
+
+        # Another process is building the same collection, its snapshot is used
+        lock = fakeredis.FakeAsyncRedis(server=server).lock(
+            f"lock:{User.DATABASE_NAME}:async_single_flight_user:build"
+        )
+        await lock.acquire()
+        task = asyncio.ensure_future(cache.cache(User))
+        await asyncio.sleep(0.2)
+        self.assertFalse(task.done())
+        await lock.release()
+        await task
+        stats = cache.stats.as_dict()[f"{User.DATABASE_NAME}.async_single_flight_user"]
+        self.assertEqual(stats["builds"], 1)
+
+        # Which is recorded with the same options as by MongoclassRedisCache
+        sync_cache = MongoclassRedisCache(
+            client, connection=fakeredis.FakeRedis(server=server)
+        )
+        self.addCleanup(sync_cache.close)
+        query = {"filter": {}, "sort": None, "limit": 0}
+        self.assertFalse(
+            sync_cache._is_stale(
+                User.DATABASE_NAME,
+                "async_single_flight_user",
+                None,
+                sync_cache._encode_options(None, False, query, 0),
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
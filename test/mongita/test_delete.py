@@ -32,6 +32,28 @@ class TestDelete(unittest.TestCase):
         count = client.default_database.position.count_documents({"x": 50})
         self.assertEqual(count, 1)
 
+    def test_mongoclass_delete_listeners(self) -> None:
+        client = utils.create_client(engine="mongita_disk")
+        Position = utils.create_class("position", client, "deleted_position")
+        deleted = []
+
+        class Listener:
+            def on_upsert(self, database, collection, documents) -> None:
+                pass
+
+            def on_delete(self, database, collection, ids) -> None:
+                deleted.extend(ids)
+
+        client.add_write_listener(
+            Position.DATABASE_NAME, "deleted_position", Listener()
+        )
+        position = Position(1, 2, 3, _insert=True)
+        position.delete()
+
+        # The document is already gone, there is nothing to tell
+        self.assertEqual(position.delete().deleted_count, 0)
+        self.assertEqual(deleted, [position._mongodb_id])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from mongoclass.indexes import Index
+
+from .. import utils
+
+ENGINE = "mongita_disk"
+
+
+class TestIndexes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        utils.drop_database()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        utils.drop_database()
+
+    def test_ensure_indexes(self) -> None:
+        client = utils.create_client(ENGINE)
+        utils.create_class(
+            "user",
+            client,
+            "indexed_user",
+            indexes=[
+                "email",
+                [("country", 1), ("phone", -1)],
+                Index("phone", unique=True, sparse=True),
+            ],
+        )
+
+        # Mongita only has indexes on a single key without options
+        report = client.ensure_indexes()
+        self.assertEqual([x["name"] for x in report.created], ["email_1"])
+        self.assertEqual(
+            [x["name"] for x in report.unsupported], ["country_1_phone_-1", "phone_1"]
+        )
+        self.assertEqual(report.drift, [])
+        collection = client.default_database["indexed_user"]
+        self.assertIn(
+            {"email_1": {"key": [("email", 1)]}}, collection.index_information()
+        )
+
+        report = client.ensure_indexes()
+        self.assertEqual(report.created, [])
+        self.assertEqual(report.drift, [])
+
+        collection.create_index("name")
+        report = client.ensure_indexes()
+        self.assertEqual(
+            [(x["name"], x["reason"]) for x in report.drift], [("name_1", "undeclared")]
+        )
+
+    def test_duplicate_indexes(self) -> None:
+        client = utils.create_client(ENGINE)
+        with self.assertRaises(ValueError):
+            utils.create_class(
+                "user", client, indexes=["email", Index("email", unique=True)]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
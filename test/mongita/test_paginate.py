@@ -0,0 +1,96 @@
+import unittest
+
+from .. import utils
+
+ENGINE = "mongita_disk"
+
+
+class TestPaginate(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        utils.drop_database()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        utils.drop_database()
+
+    def test_paginate_after(self) -> None:
+        client = utils.create_client(ENGINE)
+        Position = utils.create_class("position", client, "seek_position")
+
+        # Plenty of ties on x so the pages have to be told apart by _id
+        positions = [Position(x // 3, x, 0) for x in range(10)]
+        client.insert_classes(positions)
+        expected = sorted(positions, key=lambda p: (-p.x, p._mongodb_id))
+
+        pages = []
+        token = None
+        while True:
+            page = Position.paginate_after(after=token, size=4, sort=[("x", -1)])
+            pages.append(page.items)
+            token = page.next_token
+            if token is None:
+                break
+
+        self.assertEqual([len(x) for x in pages], [4, 4, 2])
+        self.assertEqual(sum(pages, []), expected)
+        self.assertIsNone(
+            Position.paginate_after(size=4, sort=[("x", -1)]).previous_token
+        )
+
+        # Walk back from the last page
+        self.assertEqual(page.items, expected[8:])
+        page = Position.paginate_after(
+            after=page.previous_token, size=4, sort=[("x", -1)]
+        )
+        self.assertEqual(page.items, expected[4:8])
+        page = Position.paginate_after(
+            after=page.previous_token, size=4, sort=[("x", -1)]
+        )
+        self.assertEqual(page.items, expected[:4])
+        self.assertIsNone(page.previous_token)
+        self.assertIsNotNone(page.next_token)
+
+        # Filters apply to every page
+        page = Position.paginate_after({"x": 1}, size=2)
+        self.assertEqual(page.items, positions[3:5])
+        page = Position.paginate_after({"x": 1}, after=page.next_token, size=2)
+        self.assertEqual(page.items, positions[5:6])
+        self.assertIsNone(page.next_token)
+
+        with self.assertRaises(ValueError):
+            Position.paginate_after(after=page.previous_token, size=2, sort=[("y", 1)])
+        with self.assertRaises(ValueError):
+            Position.paginate_after(after="garbage", size=2)
+
+    def test_paginate_with_total(self) -> None:
+        client = utils.create_client(ENGINE)
+        Position = utils.create_class("position", client, "total_position")
+        positions = [Position(x % 2, x, 0) for x in range(7)]
+        client.insert_classes(positions)
+
+        page = Position.paginate({"x": 0}, page=2, size=3, with_total=True)
+        self.assertEqual(page.items, [positions[6]])
+        self.assertEqual(page.total, 4)
+        self.assertTrue(page.exact_total)
+
+        page = Position.paginate(page=1, size=2, sort=[("y", -1)], with_total=True)
+        self.assertEqual(page.items, [positions[6], positions[5]])
+        self.assertEqual(page.total, 7)
+
+        page = Position.paginate(
+            {"x": 1},
+            page=1,
+            size=2,
+            pre_call=lambda x: x.sort("y", -1),
+            with_total=True,
+        )
+        self.assertEqual(page.items, [positions[5], positions[3]])
+        self.assertEqual(page.total, 3)
+
+        # Without with_total the cursor of the page is returned as before
+        self.assertEqual(list(Position.paginate(page=3, size=3)), [positions[6]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import threading
+import unittest
+
+from .. import utils
+
+ENGINE = "mongita_disk"
+
+
+class TestScan(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        utils.drop_database()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        utils.drop_database()
+
+    def test_scan_parallel(self) -> None:
+        client = utils.create_client(ENGINE)
+        Position = utils.create_class("position", client, "scanned_position")
+        positions = [Position(i, i % 3, 0) for i in range(50)]
+        client.insert_classes(positions)
+
+        def key(position):
+            return position.x
+
+        scanned = list(Position.scan_parallel(partitions=4, workers=2, batch_size=7))
+        self.assertEqual(sorted(scanned, key=key), positions)
+
+        scanned = Position.scan_parallel({"y": 1}, partitions=3)
+        self.assertEqual(sorted(scanned, key=key), [x for x in positions if x.y == 1])
+        self.assertEqual(
+            sorted(Position.scan_parallel(Position.q.x < 10, partitions=1), key=key),
+            positions[:10],
+        )
+
+        batches = []
+        lock = threading.Lock()
+
+        def callback(batch):
+            with lock:
+                batches.append(batch)
+
+        self.assertEqual(
+            Position.scan_parallel(partitions=5, callback=callback, batch_size=4), 50
+        )
+        self.assertTrue(all(len(x) <= 4 for x in batches))
+        self.assertEqual(sorted((x for y in batches for x in y), key=key), positions)
+
+        with self.assertRaises(ValueError):
+            Position.scan_parallel(partitions=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from dataclasses import dataclass
+
+from .. import utils
+
+ENGINE = "pymongo"
+
+
+@dataclass
+class CountryCount:
+    _id: str
+    count: int
+    total_phone: int = 0
+
+
+class TestAggregate(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        utils.drop_database()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        utils.drop_database()
+
+    def test_aggregate(self) -> None:
+        client = utils.create_client(ENGINE)
+        User = utils.create_class("user", client, "aggregate_user")
+        john = User("John Howard", "john@gmail.com", 8771, "PH", _insert=True)
+        User("Tony Stark", "tonystark@gmail.com", 8080, _insert=True)
+        User("Peter Parker", "peter@gmail.com", 1234, _insert=True)
+
+        # Pipelines keeping the shape of the documents map back to the mongoclass
+        users = User.aggregate([{"$match": {"country": "PH"}}])
+        self.assertEqual(list(users), [john])
+
+        pipeline = [
+            {"$group": {"_id": "$country", "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}},
+        ]
+        self.assertEqual(
+            list(User.aggregate(pipeline, raw=True, batch_size=1)),
+            [{"_id": "PH", "count": 1}, {"_id": "US", "count": 2}],
+        )
+        self.assertEqual(
+            list(User.aggregate(pipeline, into=CountryCount, allowDiskUse=True)),
+            [CountryCount("PH", 1), CountryCount("US", 2)],
+        )
+
+        # Output documents built into a mongoclass keep their _id
+        users = list(
+            User.aggregate(
+                [{"$match": {"phone": 8771}}, {"$set": {"country": "JP"}}], into=User
+            )
+        )
+        self.assertEqual(users[0]._mongodb_id, john._mongodb_id)
+        self.assertEqual(users[0].country, "JP")
+
+        with self.assertRaises(ValueError):
+            list(User.aggregate([{"$project": {"email": 0}}], into=User))
+
+        with self.assertRaises(ValueError):
+            User.aggregate(pipeline, into=CountryCount, raw=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,25 @@
+import array
+import csv
+import datetime
+import io
 import random
+import tempfile
 import unittest
+from dataclasses import dataclass
+from typing import Optional
 
+from bson import json_util
+
+from mongoclass.codecs import JSON_OPTIONS
 from mongoclass.cursor import Cursor
 
 from .. import utils
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 ENGINE = "pymongo"
 
 
@@ -75,6 +90,171 @@ class TestCursor(unittest.TestCase):
         db_skipped = list(client.find_classes("coordinates").skip(3))
         self.assertEqual(db_skipped, positions[3:])
 
+    def test_cursor_indexing(self) -> None:
+        client = utils.create_client(ENGINE)
+        Position = utils.create_class("position", client, "indexed_position")
+        positions = [Position(x % 2, x, 0) for x in range(10)]
+        client.insert_classes(positions)
+        even = positions[::2]
+
+        cursor = Position.find_classes({"x": 0})
+        self.assertEqual(cursor[0], even[0])
+        self.assertEqual(cursor[3], even[3])
+        with self.assertRaises(IndexError):
+            cursor[5]
+        with self.assertRaises(IndexError):
+            cursor[-1]
+
+        self.assertIsInstance(cursor[1:3], Cursor)
+        self.assertEqual(list(cursor[1:3]), even[1:3])
+        self.assertEqual(list(cursor[3:]), even[3:])
+        self.assertEqual(list(cursor[3:3]), [])
+        with self.assertRaises(ValueError):
+            cursor[::2]
+
+        # Slices build on the skip and limit given so far
+        cursor = Position.find_classes().sort("y", -1).skip(2).limit(5)
+        self.assertEqual(list(cursor[1:10]), positions[::-1][3:7])
+        self.assertEqual(cursor[4], positions[3])
+        with self.assertRaises(IndexError):
+            cursor[5]
+
+        self.assertEqual(Position.find_classes({"x": 1}).first(), positions[1])
+        self.assertIsNone(Position.find_classes({"x": 2}).first())
+        self.assertEqual(Position.find_classes({"y": 4}).one(), positions[4])
+        with self.assertRaises(ValueError):
+            Position.find_classes({"x": 1}).one()
+        with self.assertRaises(ValueError):
+            Position.find_classes({"x": 2}).one()
+
+    def test_cursor_explain(self) -> None:
+        client = utils.create_client(ENGINE)
+        Position = utils.create_class("position", client, "explained_position")
+        Position(1, 2, 3, _insert=True)
+
+        cursor = Position.find_classes({"x": 1})
+        if ENGINE == "pymongo":
+            self.assertIn("queryPlanner", cursor.explain())
+        else:
+            with self.assertRaises(ValueError):
+                cursor.explain()
+        self.assertEqual(len(list(cursor)), 1)
+
+    def test_cursor_export(self) -> None:
+        client = utils.create_client(ENGINE)
+        Position = utils.create_class("position", client, "exported_position")
+        client.default_database["exported_position"].insert_many(
+            [
+                {
+                    "x": i,
+                    "y": i * 2,
+                    "z": 0,
+                    "created": datetime.datetime(2022, 1, i + 1),
+                    "meta": {"tags": ["a", "b"]},
+                }
+                for i in range(5)
+            ]
+        )
+        documents = list(client.default_database["exported_position"].find({}))
+
+        fp = io.StringIO()
+        self.assertEqual(Position.find_classes().export_jsonl(fp, buffer_size=10), 5)
+        lines = fp.getvalue().splitlines()
+        self.assertEqual(
+            [json_util.loads(x, json_options=JSON_OPTIONS) for x in lines], documents
+        )
+        self.assertIn('"$oid"', lines[0])
+
+        fp = io.BytesIO()
+        cursor = Position.find_classes({"x": {"$gte": 3}})
+        self.assertEqual(
+            cursor.export_csv(fp, fields=["_id", "x", "created", "meta.tags", "w"]), 2
+        )
+        rows = list(csv.reader(io.StringIO(fp.getvalue().decode())))
+        self.assertEqual(
+            rows,
+            [
+                ["_id", "x", "created", "meta.tags", "w"],
+                [
+                    str(documents[3]["_id"]),
+                    "3",
+                    "2022-01-04T00:00:00",
+                    '["a", "b"]',
+                    "",
+                ],
+                [
+                    str(documents[4]["_id"]),
+                    "4",
+                    "2022-01-05T00:00:00",
+                    '["a", "b"]',
+                    "",
+                ],
+            ],
+        )
+
+        # Text files that aren't TextIOBase and binary files
+        with tempfile.NamedTemporaryFile("w+") as fp:
+            self.assertEqual(Position.find_classes().export_jsonl(fp), 5)
+            self.assertEqual(Position.find_classes().export_csv(fp, ["x"]), 5)
+            fp.seek(0)
+            self.assertEqual(len(fp.read().splitlines()), 11)
+
+        fp = io.BytesIO()
+        self.assertEqual(Position.find_classes().export_jsonl(fp), 5)
+        self.assertEqual(fp.getvalue().decode().splitlines(), lines)
+
+        fp = io.StringIO()
+        self.assertEqual(Position.find_classes({"x": 10}).export_csv(fp, ["x"]), 0)
+        self.assertEqual(fp.getvalue().splitlines(), ["x"])
+
+    def test_cursor_columns(self) -> None:
+        client = utils.create_client(ENGINE)
+        Position = utils.create_class("position", client, "column_position")
+        client.insert_classes([Position(i, i * 2, -i) for i in range(5)])
+
+        columns = Position.find_classes().to_columns(["x", "z"])
+        self.assertEqual(columns, {"x": [0, 1, 2, 3, 4], "z": [0, -1, -2, -3, -4]})
+
+        columns = Position.find_classes({"x": {"$gte": 3}}).to_columns(
+            ["x", "y", "_id"], output="array"
+        )
+        self.assertEqual(columns["x"], array.array("q", [3, 4]))
+        self.assertEqual(columns["y"], array.array("q", [6, 8]))
+        self.assertIsInstance(columns["_id"], list)
+
+        with self.assertRaises(ValueError):
+            Position.find_classes().to_columns(["x"], output="dict")
+
+        @client.mongoclass(collection="column_reading")
+        @dataclass
+        class Reading:
+            value: Optional[float]
+            valid: bool
+
+        client.default_database["column_reading"].insert_many(
+            [{"value": 1.5, "valid": True}, {"valid": False}]
+        )
+        columns = Reading.find_classes().to_columns(["value", "valid"], output="array")
+        self.assertEqual(columns["value"][0], 1.5)
+        self.assertNotEqual(columns["value"][1], columns["value"][1])
+        self.assertEqual(list(columns["valid"]), [1, 0])
+
+        client.default_database["column_reading"].insert_one({"value": 1})
+        with self.assertRaises(ValueError):
+            Reading.find_classes().to_columns(["valid"], output="array")
+
+    @unittest.skipIf(numpy is None, "numpy isn't installed")
+    def test_cursor_columns_numpy(self) -> None:
+        client = utils.create_client(ENGINE)
+        Position = utils.create_class("position", client, "numpy_position")
+        client.insert_classes([Position(i, i * 2, -i) for i in range(5)])
+
+        columns = Position.find_classes().to_columns(["x", "_id"], output="numpy")
+        self.assertEqual(columns["x"].dtype, numpy.int64)
+        self.assertEqual(columns["x"].sum(), 10)
+        self.assertEqual(columns["_id"].dtype, object)
+        self.assertEqual(len(columns["_id"]), 5)
+
 
 if __name__ == "__main__":
     unittest.main()
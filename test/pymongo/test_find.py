@@ -1,8 +1,13 @@
 import random
+import threading
 import unittest
 from dataclasses import dataclass, field
 from typing import List
 
+from mongoclass.negative import NegativeCache
+from mongoclass.profiling import SlowQueryLog
+from mongoclass.query import Param
+
 from .. import utils
 
 
@@ -39,6 +44,95 @@ class TestFind(unittest.TestCase):
         self.assertTrue(tony._mongodb_id)
         self.assertEqual(tony.name, "Tony Stark")
 
+    def test_find_class_single_flight(self) -> None:
+        client = utils.create_client(single_flight=True)
+        User = utils.create_class("user", client, "shared_user")
+        User("John Howard", "john@gmail.com", 8771, "PH").insert()
+
+        users = []
+        threads = [
+            threading.Thread(
+                target=lambda: users.append(User.find_class({"phone": 8771}))
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every caller gets its own object
+        self.assertEqual(len(users), 8)
+        self.assertEqual(len(set(map(id, users))), 8)
+        for user in users:
+            self.assertEqual(user.name, "John Howard")
+            self.assertTrue(user._mongodb_id)
+
+        self.assertIsNone(User.find_class({"phone": 1}))
+
+    def test_find_class_negative_cache(self) -> None:
+        client = utils.create_client(negative_cache=NegativeCache(ttl=60))
+        User = utils.create_class("user", client, "missing_user")
+
+        self.assertIsNone(User.find_class({"phone": 8771}))
+        self.assertIsNone(User.find_class({"phone": 1234}))
+
+        # Writes made behind mongoclass's back aren't seen until the query expires
+        client.default_database["missing_user"].insert_one({"phone": 1234})
+        self.assertIsNone(User.find_class({"phone": 1234}))
+
+        john = User("John Howard", "john@gmail.com", 8771, "PH", _insert=True)
+        self.assertEqual(User.find_class({"phone": 8771}), john)
+        self.assertIsNone(User.find_class({"phone": 1234}))
+
+        self.assertIsNone(User.find_class({"name": "Tony Stark"}))
+        tony = User("Tony Stark", "tonystark@gmail.com", 8080)
+        client.insert_classes([tony])
+        self.assertEqual(User.find_class({"name": "Tony Stark"}), tony)
+
+    def test_slow_query_log(self) -> None:
+        log = SlowQueryLog(threshold=0)
+        client = utils.create_client(slow_query_log=log)
+        User = utils.create_class("user", client, "slow_user")
+        User("John Howard", "john@gmail.com", 8771, "PH").insert()
+
+        User.find_class({"phone": 8771})
+        list(User.find_classes({"country": {"$in": ["PH", "US"]}}))
+        User.count_documents({"country": "PH"})
+        list(User.paginate({"country": "PH"}, page=1, size=10))
+
+        self.assertEqual(
+            [(x["operation"], x["class"], x["shape"]) for x in log.as_list()],
+            [
+                ("find_class", "User", {"phone": "?"}),
+                ("find_classes", "User", {"country": {"$in": "?"}}),
+                ("count_documents", "User", {"country": "?"}),
+                ("paginate", "User", {"country": "?"}),
+            ],
+        )
+        for entry in log.entries:
+            self.assertEqual(entry.collection_name, "slow_user")
+            self.assertGreaterEqual(entry.duration, 0)
+
+    def test_find_classes_query(self) -> None:
+        client = utils.create_client()
+        User = utils.create_class("user", client, "query_user")
+        john = User("John Howard", "john@gmail.com", 8771, "PH", _insert=True)
+        tony = User("Tony Stark", "tonystark@gmail.com", 8080, _insert=True)
+        User("Peter Parker", "peter@gmail.com", 1234, "CA", _insert=True)
+
+        query = (User.q.phone > 2000) & User.q.country.in_(["PH", "US"])
+        self.assertEqual(list(User.find_classes(query)), [john, tony])
+        self.assertEqual(User.find_class(User.q.name == "Tony Stark"), tony)
+        self.assertEqual(User.count_documents(User.q.country == "CA"), 1)
+
+        by_country = (User.q.country == Param("country")).compile()
+        self.assertEqual(User.find_class(by_country(country="PH")), john)
+        self.assertEqual(User.find_class(by_country(country="US")), tony)
+
+        with self.assertRaises(AttributeError):
+            User.q.phone_number
+
     def test_find_class_using_class(self) -> None:
         client = utils.create_client()
         Position = utils.create_class("position", client, "position_2")
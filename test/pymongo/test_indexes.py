@@ -0,0 +1,88 @@
+import unittest
+
+from mongoclass.indexes import Index
+
+from .. import utils
+
+ENGINE = "pymongo"
+
+
+class TestIndexes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        utils.drop_database()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        utils.drop_database()
+
+    def test_ensure_indexes(self) -> None:
+        client = utils.create_client(ENGINE)
+        utils.create_class(
+            "user",
+            client,
+            "indexed_user",
+            indexes=[
+                "email",
+                [("country", 1), ("phone", -1)],
+                Index("phone", unique=True, sparse=True),
+            ],
+        )
+        utils.create_class(
+            "position",
+            client,
+            "expiring_position",
+            indexes=[Index("x", expire_after=60)],
+        )
+        utils.create_class("position", client, "unmanaged_position")
+
+        report = client.ensure_indexes(dry_run=True)
+        self.assertEqual(
+            [x["name"] for x in report.created],
+            ["email_1", "country_1_phone_-1", "phone_1", "x_1"],
+        )
+        self.assertNotIn(
+            "email_1", client.default_database["indexed_user"].index_information()
+        )
+
+        report = client.ensure_indexes()
+        self.assertEqual(len(report.created), 4)
+        self.assertEqual(report.drift, [])
+        information = client.default_database["indexed_user"].index_information()
+        self.assertTrue(information["phone_1"]["unique"])
+        self.assertTrue(information["phone_1"]["sparse"])
+        information = client.default_database["expiring_position"].index_information()
+        self.assertEqual(information["x_1"]["expireAfterSeconds"], 60)
+
+        # Nothing left to create
+        report = client.ensure_indexes()
+        self.assertEqual(
+            report.as_dict(), {"created": [], "drift": [], "unsupported": []}
+        )
+
+        # Indexes made outside of the declarations are reported but left alone
+        collection = client.default_database["indexed_user"]
+        collection.create_index("name")
+        collection.drop_index("phone_1")
+        collection.create_index("phone")
+        report = client.ensure_indexes()
+        self.assertEqual(report.created, [])
+        self.assertEqual(
+            [(x["name"], x["reason"]) for x in report.drift],
+            [("phone_1", "changed"), ("name_1", "undeclared")],
+        )
+        self.assertEqual(
+            report.drift[0]["existing"], {"name": "phone_1", "key": [("phone", 1)]}
+        )
+        self.assertIn("name_1", collection.index_information())
+
+    def test_duplicate_indexes(self) -> None:
+        client = utils.create_client(ENGINE)
+        with self.assertRaises(ValueError):
+            utils.create_class(
+                "user", client, indexes=["email", Index("email", unique=True)]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -56,6 +56,18 @@ class TestUpdate(unittest.TestCase):
         self.assertTrue(query)
         self.assertEqual(query._mongodb_id, p2._mongodb_id)
 
+    def test_update_no_op(self) -> None:
+        client = utils.create_client()
+        Position = utils.create_class("position", client)
+
+        home = Position(5, 6, 7, _insert=True)
+
+        # The driver's result is returned, nothing was modified
+        update_result, new = home.update({"$set": {"x": 5}})
+        self.assertEqual(update_result.matched_count, 1)
+        self.assertEqual(update_result.modified_count, 0)
+        self.assertEqual(new.x, 5)
+
     def test_update_save(self) -> None:
         client = utils.create_client()
 
@@ -0,0 +1,67 @@
+import datetime
+import unittest
+
+from bson import ObjectId
+
+from mongoclass.codecs import BSONCodec, Codec, JSONCodec, ZlibCodec, get_codec
+
+
+class TestCodecs(unittest.TestCase):
+    def setUp(self) -> None:
+        self.document = {
+            "_id": ObjectId(),
+            "name": "John Howard",
+            "created": datetime.datetime(2022, 5, 1, 12, 30),
+            "avatar": b"\x89PNG",
+            "scores": [1, 2.5, None],
+        }
+
+    def test_round_trip(self) -> None:
+        for codec in [
+            JSONCodec(),
+            BSONCodec(),
+            ZlibCodec(JSONCodec(), threshold=0),
+            ZlibCodec(BSONCodec()),
+        ]:
+            payload = codec.encode(self.document)
+            self.assertIsInstance(payload, bytes)
+            self.assertEqual(codec.decode(payload), self.document)
+
+    def test_json_compatible(self) -> None:
+        self.assertEqual(
+            JSONCodec().decode(b'{"name": "John", "phone": 8771}'),
+            {"name": "John", "phone": 8771},
+        )
+
+    def test_zlib_threshold(self) -> None:
+        codec = ZlibCodec(JSONCodec(), threshold=64)
+        small = codec.encode({"x": 1})
+        large = codec.encode({"x": "a" * 1000})
+
+        self.assertEqual(small[:1], ZlibCodec.RAW)
+        self.assertEqual(large[:1], ZlibCodec.COMPRESSED)
+        self.assertLess(len(large), 1000)
+        self.assertEqual(codec.decode(large), {"x": "a" * 1000})
+
+    def test_get_codec(self) -> None:
+        self.assertIsInstance(get_codec("json"), JSONCodec)
+        self.assertIsInstance(get_codec("bson"), BSONCodec)
+
+        codec = get_codec("zlib+bson")
+        self.assertIsInstance(codec, ZlibCodec)
+        self.assertIsInstance(codec.codec, BSONCodec)
+        self.assertEqual(codec.name, "zlib+bson")
+
+        with self.assertRaises(ValueError):
+            get_codec("pickle")
+
+    def test_abstract(self) -> None:
+        class NameOnly(Codec):
+            name = "name-only"
+
+        with self.assertRaises(TypeError):
+            NameOnly()
+
+
+if __name__ == "__main__":
+    unittest.main()
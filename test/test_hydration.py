@@ -0,0 +1,53 @@
+import unittest
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from mongoclass.hydration import HYDRATORS, get_hydrator
+
+
+@dataclass
+class Member:
+    name: str
+    age: int = 0
+
+
+@dataclass
+class Team:
+    _id: str
+    leader: Member
+    members: List[Member] = field(default_factory=list)
+    score: Optional[float] = None
+
+
+class TestHydration(unittest.TestCase):
+    def test_hydrate(self) -> None:
+        hydrate = get_hydrator(Team)
+        self.assertIs(get_hydrator(Team), hydrate)
+        self.assertIs(HYDRATORS[Team], hydrate)
+
+        team = hydrate(
+            {
+                "_id": "red",
+                "leader": {"name": "John", "age": 30, "email": "john@gmail.com"},
+                "members": [{"name": "Tony"}, Member("Peter")],
+                "count": 2,
+            }
+        )
+        self.assertEqual(
+            team, Team("red", Member("John", 30), [Member("Tony"), Member("Peter")])
+        )
+
+        # Defaults are not shared between documents
+        first, second = hydrate({"_id": "a", "leader": None}), hydrate(
+            {"_id": "b", "leader": None}
+        )
+        self.assertIsNot(first.members, second.members)
+
+        with self.assertRaises(ValueError):
+            hydrate({"leader": {"name": "John"}})
+        with self.assertRaises(ValueError):
+            get_hydrator(dict)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from mongoclass.indexes import Index, IndexReport, diff_indexes, is_emulated
+
+
+class TestIndexes(unittest.TestCase):
+    def test_index(self) -> None:
+        index = Index([("country", 1), "phone"], unique=True)
+        self.assertEqual(index.keys, [("country", 1), ("phone", 1)])
+        self.assertEqual(index.name, "country_1_phone_1")
+        self.assertEqual(index.to_model().document["unique"], True)
+        self.assertEqual(
+            Index.from_spec("email").as_dict(),
+            {"name": "email_1", "key": [("email", 1)]},
+        )
+
+        self.assertTrue(is_emulated(Index("email")))
+        self.assertFalse(is_emulated(index))
+        self.assertFalse(is_emulated(Index("created", expire_after=60)))
+        with self.assertRaises(ValueError):
+            Index([])
+        with self.assertRaises(ValueError):
+            Index(["a", "b"], expire_after=60)
+
+    def test_diff_indexes(self) -> None:
+        declared = [Index("email", unique=True), Index("country"), Index("phone")]
+        existing = {
+            "_id_": {"key": [("_id", 1)]},
+            "by_email": {"key": [("email", 1.0)], "unique": True},
+            "country_1": {"key": [("country", 1)], "sparse": True},
+            "name_1": {"key": [("name", 1)]},
+        }
+
+        report = IndexReport()
+        missing = diff_indexes("main", "user", declared, existing, report)
+        self.assertEqual([x.name for x in missing], ["phone_1"])
+        self.assertEqual(
+            [(x["name"], x["reason"]) for x in report.drift],
+            [("country_1", "changed"), ("name_1", "undeclared")],
+        )
+        self.assertEqual(
+            report.drift[0]["declared"], {"name": "country_1", "key": [("country", 1)]}
+        )
+        self.assertEqual(report.drift[1]["declared"], None)
+
+
+if __name__ == "__main__":
+    unittest.main()
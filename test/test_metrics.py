@@ -0,0 +1,66 @@
+import unittest
+
+from mongoclass.metrics import CacheStats
+
+
+class TestMetrics(unittest.TestCase):
+    def test_record(self) -> None:
+        stats = CacheStats()
+        stats.record("mongoclass", "user", "hit")
+        stats.record("mongoclass", "user", "hit")
+        stats.record("mongoclass", "user", "miss")
+        stats.record("mongoclass", "user", "lock_wait", 0.5)
+        stats.record("mongoclass", "user", "lock_timeout", 1.5)
+        stats.record("mongoclass", "user", "build", 2)
+        stats.record_payloads("mongoclass", "user", [10, 30])
+        stats.record("mongoclass", "position", "refresh_error", 1)
+
+        user = stats.as_dict()["mongoclass.user"]
+        self.assertEqual(user["hits"], 2)
+        self.assertAlmostEqual(user["hit_rate"], 2 / 3)
+        self.assertEqual(user["lock_waits"], 1)
+        self.assertEqual(user["lock_timeouts"], 1)
+        self.assertEqual(user["average_lock_wait"], 1)
+        self.assertEqual(user["max_lock_wait"], 1.5)
+        self.assertEqual(user["last_build_duration"], 2)
+        self.assertEqual(user["payloads"], 2)
+        self.assertEqual(user["average_payload_bytes"], 20)
+        self.assertEqual(user["max_payload_bytes"], 30)
+        self.assertIsNone(user["local_hit_rate"])
+
+        position = stats.as_dict()["mongoclass.position"]
+        self.assertEqual(position["refreshes"], 1)
+        self.assertEqual(position["refresh_errors"], 1)
+
+        with self.assertRaises(ValueError):
+            stats.record("mongoclass", "user", "unknown")
+
+        stats.reset()
+        self.assertEqual(stats.as_dict(), {})
+
+    def test_hooks(self) -> None:
+        stats = CacheStats()
+        events = []
+
+        def fail(*args):
+            raise RuntimeError("Hook failed")
+
+        stats.add_hook(fail)
+        stats.add_hook(lambda *args: events.append(args))
+        stats.record("mongoclass", "user", "hit")
+        stats.record_payloads("mongoclass", "user", [10, 30])
+
+        with self.assertRaises(KeyError):
+            with stats.timed("mongoclass", "user", "build"):
+                raise KeyError
+
+        self.assertEqual(events[0], ("mongoclass.user", "hit", 1))
+        self.assertEqual(events[1], ("mongoclass.user", "payload_bytes", 40))
+        self.assertEqual(events[2][1], "build_error")
+
+        stats.remove_hook(fail)
+        self.assertEqual(len(stats.hooks), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
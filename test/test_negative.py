@@ -0,0 +1,101 @@
+import time
+import unittest
+
+from bson import ObjectId
+
+from mongoclass.negative import (
+    NegativeCache,
+    get_document_terms,
+    get_query_term,
+    may_match,
+)
+
+
+class TestNegativeCache(unittest.TestCase):
+    def test_may_match(self) -> None:
+        _id = ObjectId()
+        document = {
+            "_id": _id,
+            "name": "John Howard",
+            "address": {"country": "PH"},
+            "tags": ["admin"],
+            "orders": [{"total": 5}],
+        }
+
+        self.assertTrue(may_match({}, document))
+        self.assertTrue(may_match({"_id": _id}, document))
+        self.assertFalse(may_match({"_id": ObjectId()}, document))
+        self.assertTrue(may_match({"name": "John Howard", "tags": "admin"}, document))
+        self.assertFalse(may_match({"name": "John Howard", "tags": "user"}, document))
+        self.assertTrue(may_match({"address.country": "PH"}, document))
+        self.assertFalse(may_match({"address.country": "US"}, document))
+        self.assertFalse(may_match({"email": "john@gmail.com"}, document))
+        self.assertTrue(may_match({"email": None}, document))
+
+        # Anything but equality may match
+        self.assertTrue(may_match({"name": {"$regex": "^Tony"}}, document))
+        self.assertTrue(may_match({"$or": [{"name": "Tony Stark"}]}, document))
+        self.assertTrue(may_match({"orders.total": 10}, document))
+
+    def test_terms(self) -> None:
+        _id = ObjectId()
+        document = {"_id": _id, "phone": 1.0, "tags": ["admin", 2], "address": {}}
+        terms = get_document_terms(document)
+        self.assertEqual(
+            terms,
+            {
+                ("_id", f'{{"$oid": "{_id}"}}'),
+                ("phone", "1"),
+                ("tags", '"admin"'),
+                ("tags", "2"),
+            },
+        )
+
+        # Every query that may match the document is found by one of its terms
+        for query in [
+            {"phone": 1, "_id": _id},
+            {"phone": 1},
+            {"tags": "admin", "email": None},
+        ]:
+            self.assertTrue(may_match(query, document))
+            self.assertIn(get_query_term(query), terms)
+        self.assertEqual(get_query_term({"phone": 1, "_id": _id})[0], "_id")
+
+        # Queries without a plain equality on a top level field have none
+        for query in [
+            {},
+            {"email": None},
+            {"address": {}},
+            {"address.country": "PH"},
+            {"phone": {"$gt": 0}},
+            {"$or": [{"phone": 1}]},
+        ]:
+            self.assertIsNone(get_query_term(query))
+
+    def test_cache(self) -> None:
+        cache = NegativeCache(ttl=60, max_entries=2)
+        generation = cache.generation("main", "user")
+        self.assertTrue(cache.add("main", "user", "a", {"phone": 1}, generation))
+        self.assertTrue(cache.add("main", "user", "b", {"phone": 2}, generation))
+        self.assertTrue(cache.contains("main", "user", "a"))
+        self.assertFalse(cache.contains("main", "position", "a"))
+        self.assertEqual(cache.lookup("main", "user", "a"), (True, generation))
+
+        # The least recently used query goes first
+        self.assertTrue(cache.add("main", "user", "c", {"phone": 3}, generation))
+        self.assertFalse(cache.contains("main", "user", "b"))
+
+        self.assertEqual(cache.invalidate("main", "user", [{"phone": 3}]), 1)
+        self.assertFalse(cache.contains("main", "user", "c"))
+        self.assertTrue(cache.contains("main", "user", "a"))
+
+        # A miss that raced with a write isn't remembered
+        self.assertFalse(cache.add("main", "user", "d", {"phone": 4}, generation))
+        self.assertFalse(cache.contains("main", "user", "d"))
+
+    def test_ttl(self) -> None:
+        cache = NegativeCache(ttl=0.05)
+        cache.add("main", "user", "a", {}, 0)
+        self.assertTrue(cache.contains("main", "user", "a"))
+        time.sleep(0.06)
+        self.assertFalse(cache.contains("main", "user", "a"))
@@ -0,0 +1,41 @@
+import unittest
+
+from mongoclass import pagination
+
+
+class TestPagination(unittest.TestCase):
+    def test_seek_filter(self) -> None:
+        sort = pagination.normalize_sort([("score", -1)])
+        self.assertEqual(sort, [("score", -1), ("_id", 1)])
+        self.assertEqual(
+            pagination.seek_filter(sort, [10, 5], False),
+            {"$or": [{"score": {"$lt": 10}}, {"score": 10, "_id": {"$gt": 5}}]},
+        )
+        self.assertEqual(
+            pagination.seek_filter(sort, [10, 5], True),
+            {"$or": [{"score": {"$gt": 10}}, {"score": 10, "_id": {"$lt": 5}}]},
+        )
+        with self.assertRaises(ValueError):
+            pagination.normalize_sort([("score", 0)])
+
+    def test_is_after(self) -> None:
+        sort = [("score", -1), ("_id", 1)]
+        self.assertTrue(pagination.is_after(sort, {"score": 9, "_id": 1}, [10, 5]))
+        self.assertTrue(pagination.is_after(sort, {"score": 10, "_id": 6}, [10, 5]))
+        self.assertFalse(pagination.is_after(sort, {"score": 10, "_id": 5}, [10, 5]))
+        self.assertFalse(pagination.is_after(sort, {"score": 11, "_id": 1}, [10, 5]))
+        self.assertTrue(
+            pagination.is_after(sort, {"score": 11, "_id": 1}, [10, 5], backwards=True)
+        )
+        self.assertTrue(pagination.is_after(sort, {"_id": 1}, [10, 5]))
+
+    def test_token(self) -> None:
+        sort = [("address.city", 1), ("_id", 1)]
+        token = pagination.encode_token(
+            sort, {"_id": 3, "address": {"city": "Manila"}}, True
+        )
+        self.assertEqual(pagination.decode_token(token, sort), (["Manila", 3], True))
+        with self.assertRaises(ValueError):
+            pagination.decode_token(token, [("_id", 1)])
+        with self.assertRaises(ValueError):
+            pagination.decode_token("not a token", sort)
@@ -0,0 +1,68 @@
+import unittest
+
+from mongoclass.profiling import SlowQueryLog, query_shape
+
+
+class TestProfiling(unittest.TestCase):
+    def test_query_shape(self) -> None:
+        self.assertEqual(
+            query_shape(
+                {
+                    "age": {"$gt": 30},
+                    "country": {"$in": ["PH", "US"]},
+                    "$or": [{"vip": True}, {"score": {"$gte": 10}}],
+                }
+            ),
+            {
+                "age": {"$gt": "?"},
+                "country": {"$in": "?"},
+                "$or": [{"vip": "?"}, {"score": {"$gte": "?"}}],
+            },
+        )
+        self.assertEqual(
+            query_shape([{"$match": {"name": "John"}}, {"$limit": 5}]),
+            [{"$match": {"name": "?"}}, {"$limit": "?"}],
+        )
+
+    def test_log(self) -> None:
+        log = SlowQueryLog(threshold=0.5, explain=True, max_entries=2)
+        recorded = []
+        log.add_hook(recorded.append)
+
+        self.assertIsNone(log.record("find_class", "main", "user", "User", {}, 0.1))
+        entry = log.record(
+            "find_class",
+            "main",
+            "user",
+            "User",
+            {"name": "John"},
+            0.6,
+            lambda: {"queryPlanner": {}},
+        )
+        self.assertEqual(recorded, [entry])
+        self.assertEqual(
+            entry.as_dict(),
+            {
+                "operation": "find_class",
+                "database": "main",
+                "collection": "user",
+                "class": "User",
+                "shape": {"name": "?"},
+                "duration": 0.6,
+                "explain": {"queryPlanner": {}},
+            },
+        )
+
+        # A failing explain doesn't lose the query
+        def explain():
+            raise RuntimeError
+
+        log.record("count_documents", "main", "user", "User", None, 1, explain)
+        log.record("aggregate", "main", "user", "User", [], 1)
+        self.assertEqual(
+            [x["operation"] for x in log.as_list()], ["count_documents", "aggregate"]
+        )
+        self.assertIsNone(log.entries[0].explain)
+
+        log.clear()
+        self.assertEqual(log.as_list(), [])
@@ -0,0 +1,118 @@
+import unittest
+from dataclasses import dataclass
+from typing import List, Optional
+
+from mongoclass.query import Expression, Fields, Param
+
+
+@dataclass
+class Address:
+    city: str
+    zip_code: Optional[str] = None
+
+
+@dataclass
+class User:
+    name: str
+    age: int
+    score: float
+    tags: List[str]
+    address: Address
+
+
+q = Fields(User)
+
+
+class TestQuery(unittest.TestCase):
+    def test_to_filter(self) -> None:
+        self.assertEqual((q.age > 30).to_filter(), {"age": {"$gt": 30}})
+        self.assertEqual((q.name == "John").to_filter(), {"name": "John"})
+        self.assertEqual(
+            ((q.age >= 30) & q.name.in_(("John", "Tony"))).to_filter(),
+            {"age": {"$gte": 30}, "name": {"$in": ["John", "Tony"]}},
+        )
+        self.assertEqual(
+            ((q.age > 30) & (q.age < 40) & (q.score <= 1)).to_filter(),
+            {
+                "$and": [
+                    {"age": {"$gt": 30}},
+                    {"age": {"$lt": 40}},
+                    {"score": {"$lte": 1}},
+                ]
+            },
+        )
+        self.assertEqual(
+            ((q.age != 30) | ~q.tags.not_in(["admin"])).to_filter(),
+            {"$or": [{"age": {"$ne": 30}}, {"$nor": [{"tags": {"$nin": ["admin"]}}]}]},
+        )
+        self.assertEqual(
+            ((q.address.city == "Manila") & q._id.exists()).to_filter(),
+            {"address.city": "Manila", "_id": {"$exists": True}},
+        )
+        self.assertEqual((q["tags"] == "admin").to_filter(), {"tags": "admin"})
+
+    def test_typos_and_types(self) -> None:
+        with self.assertRaises(AttributeError):
+            q.agee
+        with self.assertRaises(AttributeError):
+            q.address.country
+        with self.assertRaises(AttributeError):
+            q.name.first
+
+        with self.assertRaises(TypeError):
+            q.age > "30"
+        with self.assertRaises(TypeError):
+            q.name.in_(["John", 1])
+        with self.assertRaises(TypeError):
+            q.name.in_("John")
+        with self.assertRaises(TypeError):
+            (q.age > 30) and (q.age < 40)
+
+        # Expressions have to build their filter
+        class Empty(Expression):
+            pass
+
+        with self.assertRaises(TypeError):
+            Empty()
+
+        q.score > 1
+        q.address.zip_code == None
+        q.tags == ["admin"]
+
+    def test_compile(self) -> None:
+        countries = [f"city {i}" for i in range(100)]
+        query = (
+            (q.age > Param("min_age"))
+            & q.address.city.in_(countries)
+            & q.name.in_(Param("names"))
+        ).compile()
+
+        self.assertEqual(set(query.params), {"min_age", "names"})
+        first = query(min_age=30, names=("John",))
+        self.assertEqual(
+            first,
+            {
+                "age": {"$gt": 30},
+                "address.city": {"$in": countries},
+                "name": {"$in": ["John"]},
+            },
+        )
+
+        # The parts without parameters are shared between filters
+        second = query(min_age=40, names=["Tony"])
+        self.assertEqual(second["age"], {"$gt": 40})
+        self.assertIs(first["address.city"], second["address.city"])
+        self.assertEqual(first["age"], {"$gt": 30})
+
+        with self.assertRaises(ValueError):
+            query(min_age=30)
+        with self.assertRaises(ValueError):
+            query(min_age=30, names=[], limit=1)
+        with self.assertRaises(TypeError):
+            query(min_age="30", names=[])
+
+        self.assertEqual((q.age > 30).compile()(), {"age": {"$gt": 30}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import threading
+import unittest
+
+from mongoclass import scan
+
+
+def make_read(documents, batch_size=2, fail_on=None):
+    started = []
+
+    def read(query, emit):
+        started.append(query)
+        low = query.get("_id", {}).get("$gte", float("-inf"))
+        high = query.get("_id", {}).get("$lt", float("inf"))
+        selected = [x for x in documents if low <= x < high]
+        if selected and selected[0] == fail_on:
+            raise RuntimeError("Read failed")
+        for i in range(0, len(selected), batch_size):
+            emit(selected[i : i + batch_size])
+        return len(selected)
+
+    return read, started
+
+
+class TestScan(unittest.TestCase):
+    def test_boundaries(self) -> None:
+        self.assertEqual(scan.sample_boundaries(list(range(10)), 3), [3, 6])
+        self.assertEqual(scan.sample_boundaries([1, 1, 1, 2], 4), [1, 2])
+        self.assertEqual(scan.sample_boundaries([], 4), [])
+
+        self.assertEqual(scan.partition_filters({"x": 1}, []), [{"x": 1}])
+        self.assertEqual(
+            scan.partition_filters({"x": 1}, [3, 6]),
+            [
+                {"x": 1, "_id": {"$lt": 3}},
+                {"x": 1, "_id": {"$gte": 3, "$lt": 6}},
+                {"x": 1, "_id": {"$gte": 6}},
+            ],
+        )
+        self.assertEqual(
+            scan.partition_filters({"_id": {"$ne": 1}}, [3])[0],
+            {"$and": [{"_id": {"$ne": 1}}, {"_id": {"$lt": 3}}]},
+        )
+
+    def test_iter_partitions(self) -> None:
+        documents = list(range(100))
+        filters = scan.partition_filters({}, scan.sample_boundaries(documents, 8))
+        read, _ = make_read(documents)
+        self.assertEqual(sorted(scan.iter_partitions(read, filters, 3)), documents)
+
+        # Stopping early stops the partitions that didn't start yet
+        read, started = make_read(documents)
+        results = scan.iter_partitions(read, filters, 1)
+        self.assertEqual(next(results), 0)
+        results.close()
+        self.assertLess(len(started), len(filters))
+
+        read, _ = make_read(documents, fail_on=50)
+        with self.assertRaises(RuntimeError):
+            list(scan.iter_partitions(read, filters, 2))
+
+    def test_run_partitions(self) -> None:
+        documents = list(range(100))
+        filters = scan.partition_filters({}, scan.sample_boundaries(documents, 4))
+        read, _ = make_read(documents, batch_size=10)
+
+        batches = []
+        lock = threading.Lock()
+
+        def callback(batch):
+            with lock:
+                batches.append(batch)
+
+        self.assertEqual(scan.run_partitions(read, filters, 4, callback), 100)
+        self.assertEqual(len(batches), 12)
+        self.assertEqual(sorted(x for batch in batches for x in batch), documents)
+
+
+if __name__ == "__main__":
+    unittest.main()
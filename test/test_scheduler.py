@@ -0,0 +1,108 @@
+import threading
+import time
+import unittest
+
+from mongoclass.scheduler import RefreshScheduler
+
+
+class Collection:
+    DATABASE_NAME = "mongoclass"
+    COLLECTION_NAME = "user"
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.scheduler = RefreshScheduler(jitter=0)
+
+    def tearDown(self) -> None:
+        self.scheduler.stop()
+
+    def test_schedule(self) -> None:
+        runs = []
+        self.scheduler.schedule(Collection, 0.05, lambda: runs.append(1))
+        self.scheduler.schedule(Collection, 0.05, lambda: runs.append(2))
+        self.scheduler.start()
+        self.scheduler.start()
+        time.sleep(0.3)
+        self.scheduler.stop()
+
+        # Scheduling twice replaces the first schedule
+        self.assertTrue(runs)
+        self.assertNotIn(1, runs)
+
+        stats = self.scheduler.stats()["mongoclass.user"]
+        self.assertEqual(stats["runs"], len(runs))
+        self.assertEqual(stats["errors"], 0)
+        self.assertIsNotNone(stats["last_duration"])
+
+        # Stopped schedulers don't run anything
+        count = len(runs)
+        time.sleep(0.15)
+        self.assertEqual(len(runs), count)
+
+    def test_backoff(self) -> None:
+        def fail():
+            raise RuntimeError("Refresh failed")
+
+        self.scheduler.schedule(Collection, 0.05, fail)
+        self.scheduler.start()
+        time.sleep(0.5)
+        self.scheduler.stop()
+
+        # Without backoff this would have failed around 10 times
+        stats = self.scheduler.stats()["mongoclass.user"]
+        self.assertGreater(stats["errors"], 0)
+        self.assertLess(stats["errors"], 5)
+        self.assertEqual(stats["errors"], stats["consecutive_failures"])
+        self.assertIn("Refresh failed", stats["last_error"])
+
+    def test_skip_running(self) -> None:
+        running = threading.Semaphore(1)
+        overlapped = []
+
+        def slow():
+            if not running.acquire(blocking=False):
+                overlapped.append(True)
+                return
+            time.sleep(0.25)
+            running.release()
+
+        self.scheduler.schedule(Collection, 0.05, slow)
+        self.scheduler.start()
+        time.sleep(0.4)
+        self.scheduler.stop()
+
+        self.assertFalse(overlapped)
+        self.assertGreater(self.scheduler.stats()["mongoclass.user"]["skipped"], 0)
+
+    def test_unschedule(self) -> None:
+        runs = []
+        self.scheduler.schedule(Collection, 0.05, lambda: runs.append(1))
+        self.scheduler.unschedule(Collection)
+        self.scheduler.start()
+        time.sleep(0.15)
+
+        self.assertEqual(runs, [])
+        self.assertEqual(self.scheduler.stats(), {})
+
+    def test_subset(self) -> None:
+        runs = []
+        self.scheduler.schedule(Collection, 0.05, lambda: runs.append(1))
+        self.scheduler.schedule(Collection, 0.05, lambda: runs.append(2), "active")
+        self.scheduler.start()
+        time.sleep(0.15)
+        self.scheduler.stop()
+
+        # Subsets don't replace the schedule of their mongoclass
+        self.assertIn(1, runs)
+        self.assertIn(2, runs)
+        self.assertEqual(
+            set(self.scheduler.stats()), {"mongoclass.user", "mongoclass.user:active"}
+        )
+
+        self.scheduler.unschedule(Collection, "active")
+        self.assertEqual(set(self.scheduler.stats()), {"mongoclass.user"})
+
+
+if __name__ == "__main__":
+    unittest.main()
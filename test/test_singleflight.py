@@ -0,0 +1,56 @@
+import threading
+import unittest
+
+from mongoclass.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_do(self) -> None:
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return {"name": "John Howard"}
+
+        results = []
+
+        def run():
+            results.append(flights.do("user", load))
+
+        leader = threading.Thread(target=run)
+        leader.start()
+        started.wait()
+
+        followers = [threading.Thread(target=run) for _ in range(5)]
+        for thread in followers:
+            thread.start()
+
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(sum(shared for _, shared in results), 5)
+
+        # Finished calls are not reused
+        self.assertEqual(flights.do("user", lambda: 1), (1, False))
+
+    def test_exception(self) -> None:
+        flights = SingleFlight()
+
+        def fail():
+            raise RuntimeError("Query failed")
+
+        with self.assertRaises(RuntimeError):
+            flights.do("user", fail)
+        self.assertEqual(flights.do("user", lambda: 1), (1, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,13 +20,13 @@ def drop_database(database: str = None) -> None:
                 client.drop_database(d)
 
 
-def create_client(engine: str = "pymongo"):
+def create_client(engine: str = "pymongo", **kwargs):
 
     host = HOSTS[0]
     if engine != "pymongo":
         host = HOSTS[1]
 
-    return client_constructor(engine, host=host, default_db_name=DATABASES[0])
+    return client_constructor(engine, host=host, default_db_name=DATABASES[0], **kwargs)
 
 
 def create_class(cls: str, client, *args, **kwargs):